@@ -1,35 +1,44 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from sqlalchemy import text
 
 # Импорт моделей для создания таблиц при старте
-from models import engine, Base, get_db
+from models import engine, get_db, run_migrations
 from services.auth_service import AuthService
+from services.export_jobs import export_job_manager
+from services.facet_service import facet_service
+from services.import_jobs import import_job_manager
+from services.parse_pool import parse_pool
 
 # Lifespan для инициализации БД
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Создание таблиц при старте
+    # Создание таблиц, идемпотентные миграции и индексы при старте
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        # Простые миграции (idempotent): добавляем колонку results, если ее нет
-        try:
-            await conn.execute(text("ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS results JSONB"))
-        except Exception:
-            # Логируем по желанию; пропускаем ошибку, чтобы не блокировать старт
-            pass
+        await run_migrations(conn)
     
     # Создание пользователей по умолчанию
     async for db in get_db():
         await AuthService.create_default_users(db)
+        # Задачи выгрузки и импорта, прерванные перезапуском, больше не выполнятся
+        await export_job_manager.recover(db)
+        await import_job_manager.recover(db)
         break
     
+    # Пул процессов для разбора Excel (PARSE_POOL_WORKERS, PARSE_POOL_QUEUE)
+    parse_pool.start()
+    # Свертка дельт фасетов, которые пишут триггеры products (FACET_FOLD_INTERVAL_SECONDS)
+    facet_fold = asyncio.create_task(
+        facet_service.fold_periodically(float(os.getenv("FACET_FOLD_INTERVAL_SECONDS", "30")))
+    )
     yield
-    # Очистка при завершении, если нужно
+    facet_fold.cancel()
+    parse_pool.shutdown()
 
 app = FastAPI(
     title="AI Database Platform",
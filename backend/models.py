@@ -1,9 +1,11 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
-from sqlalchemy import Text, DateTime, func, String, Integer, ForeignKey, JSON
+from sqlalchemy import Text, DateTime, func, String, Integer, BigInteger, ForeignKey, JSON, Index, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from typing import Optional, AsyncGenerator
 from datetime import datetime
+from fastapi import Request
 
 # Базовый класс для моделей
 class Base(DeclarativeBase):
@@ -21,6 +23,57 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
     last_login: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
+# Взвешенный tsvector для полнотекстового поиска по товарам:
+# A — артикул и название, B — бренд и производитель, C — цвет.
+# Конфигурация 'simple': артикулы и названия моделей не нужно стеммить.
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple'::regconfig, coalesce(part_number, '')), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(part_name, '')), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(brand, '')), 'B') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(manufacturer_name, '')), 'B') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(color, '')), 'C')"
+)
+
+# Склеенный текст тех же полей для подстрочного поиска через pg_trgm.
+# Выражение должно совпадать с выражением индекса ix_products_search_trgm символ в символ.
+SEARCH_TEXT_SQL = (
+    "(coalesce(part_number, '') || ' ' || coalesce(part_name, '') || ' ' || "
+    "coalesce(brand, '') || ' ' || coalesce(manufacturer_name, '') || ' ' || "
+    "coalesce(color, ''))"
+)
+
+# Справочники низкокардинальных атрибутов товара (словарное кодирование).
+# value — каноническое написание (без лишних пробелов), normalized — ключ
+# сравнения (value в нижнем регистре). Товар хранит id значения в колонке <поле>_id.
+class AttributeValueMixin:
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    value: Mapped[str] = mapped_column(Text)
+    normalized: Mapped[str] = mapped_column(Text, unique=True)
+
+class ProductBrand(AttributeValueMixin, Base):
+    __tablename__ = "product_brands"
+
+class ProductColor(AttributeValueMixin, Base):
+    __tablename__ = "product_colors"
+
+class ProductType(AttributeValueMixin, Base):
+    __tablename__ = "product_types"
+
+class ProductGender(AttributeValueMixin, Base):
+    __tablename__ = "product_genders"
+
+class ProductShape(AttributeValueMixin, Base):
+    __tablename__ = "product_shapes"
+
+# Поле товара → модель справочника
+DICTIONARY_MODELS = {
+    "brand": ProductBrand,
+    "color": ProductColor,
+    "type": ProductType,
+    "gender": ProductGender,
+    "shape": ProductShape,
+}
+
 # Модель очков
 class Product(Base):
     __tablename__ = "products"
@@ -43,6 +96,147 @@ class Product(Base):
     shape: Mapped[Optional[str]]              # Форма оправы (круглые, квадратные, авиаторы и т.д.)
     year: Mapped[Optional[int]]               # Год выпуска модели
 
+    # Ссылки на справочники; строки выше остаются представлением для API и
+    # синхронизируются с ними триггером products_dictionary_sync
+    brand_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_brands.id"), nullable=True)
+    color_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_colors.id"), nullable=True)
+    type_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_types.id"), nullable=True)
+    gender_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_genders.id"), nullable=True)
+    shape_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product_shapes.id"), nullable=True)
+
+    # Номер изменения для ленты GET /products/changes: id транзакции последней записи,
+    # проставляется триггером products_change_seq (1 — строки, существовавшие до ленты)
+    change_seq: Mapped[int] = mapped_column(BigInteger, server_default=text("1"))
+
+    # Служебная колонка полнотекстового поиска (генерируется PostgreSQL, не загружается по умолчанию)
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True), deferred=True
+    )
+
+    # Составные индексы (колонка сортировки, id) для keyset-пагинации списка товаров
+    __table_args__ = (
+        Index("ix_products_part_number_id", "part_number", "id"),
+        Index("ix_products_part_name_id", "part_name", "id"),
+        Index("ix_products_brand_id", "brand", "id"),
+        Index("ix_products_category_id", "category", "id"),
+        Index("ix_products_color_id", "color", "id"),
+        Index("ix_products_size_id", "size", "id"),
+        Index("ix_products_year_id", "year", "id"),
+        # Диапазонные фильтры и сортировка по размерам оправы
+        Index("ix_products_width_id", "width", "id"),
+        Index("ix_products_height_id", "height", "id"),
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        # Фильтры по значениям справочников (равенство по id + порядок по id)
+        Index("ix_products_fk_brand_id", "brand_id", "id"),
+        Index("ix_products_fk_color_id", "color_id", "id"),
+        Index("ix_products_fk_type_id", "type_id", "id"),
+        Index("ix_products_fk_gender_id", "gender_id", "id"),
+        Index("ix_products_fk_shape_id", "shape_id", "id"),
+        # Частые структурные запросы: бренд + год / бренд + ширина
+        Index("ix_products_fk_brand_year", "brand_id", "year"),
+        Index("ix_products_fk_brand_width", "brand_id", "width"),
+        # Лента изменений: keyset по (change_seq, id)
+        Index("ix_products_change_seq_id", "change_seq", "id"),
+    )
+
+# Поля товара, по которым строятся фасеты фильтров
+FACET_FIELDS = ["brand", "category", "color", "type", "gender", "shape"]
+
+# Сводная таблица фасетов: количество товаров на каждое значение поля.
+# Триггеры products_facets_* (см. SCHEMA_MIGRATIONS) учитывают любые записи — CRUD,
+# импорт Excel и изменения через чат — но пишут не сюда, а в facet_count_deltas;
+# FacetService периодически сворачивает дельты в эту таблицу.
+# Для полей со справочником value — id значения справочника (как текст), чтобы
+# разные написания одного значения считались вместе, как в фасетах с фильтрами.
+class ProductFacet(Base):
+    __tablename__ = "facet_counts"
+
+    facet: Mapped[str] = mapped_column(String(20), primary_key=True)  # Имя поля (brand, color, ...)
+    value: Mapped[str] = mapped_column(Text, primary_key=True)        # id справочника или значение поля
+    count: Mapped[int] = mapped_column(Integer, default=0)            # Количество товаров
+
+# Несвернутые изменения количеств фасетов: только вставки, поэтому пишущие транзакции
+# (в том числе длинный импорт) не держат блокировки общих строк facet_counts и не
+# ждут друг друга. Текущее количество = facet_counts.count + сумма дельт.
+class ProductFacetDelta(Base):
+    __tablename__ = "facet_count_deltas"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    facet: Mapped[str] = mapped_column(String(20))
+    value: Mapped[str] = mapped_column(Text)
+    diff: Mapped[int] = mapped_column(Integer)
+
+# Нормализованные изображения товаров: одна строка на ссылку из Product.images.
+# Строка images остается представлением для API; таблица поддерживается триггерами
+# products_images_* (см. SCHEMA_MIGRATIONS) и служит индексом в обе стороны:
+# товар → изображения (первичный ключ) и ключ S3 → товары (ix_product_images_s3_key).
+class ProductImage(Base):
+    __tablename__ = "product_images"
+
+    product_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    position: Mapped[int] = mapped_column(Integer, primary_key=True)  # Порядок в строке images, с 0
+    url: Mapped[str] = mapped_column(Text)                             # Ссылка как в строке images
+    s3_key: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Ключ объекта в бакете
+
+    __table_args__ = (
+        Index("ix_product_images_s3_key", "s3_key", "product_id"),
+    )
+
+# Надгробия удаленных товаров для ленты изменений: id удаленного товара и номер
+# изменения (транзакции) удаления. Заполняется триггером products_tombstones.
+class ProductTombstone(Base):
+    __tablename__ = "product_tombstones"
+
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    change_seq: Mapped[int] = mapped_column(BigInteger)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_product_tombstones_change_seq_id", "change_seq", "product_id"),
+    )
+
+# Модель фоновых задач выгрузки товаров
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)        # UUID задачи
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    status: Mapped[str] = mapped_column(String(20), default="queued")    # queued | running | done | failed
+    params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # Параметры выгрузки (бренды, колонки, ...)
+    rows_written: Mapped[int] = mapped_column(Integer, default=0)
+    images_total: Mapped[int] = mapped_column(Integer, default=0)
+    images_fetched: Mapped[int] = mapped_column(Integer, default=0)
+    file_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    storage: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)  # local | s3
+    location: Mapped[Optional[str]] = mapped_column(Text, nullable=True)       # Путь на диске или ключ S3
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), index=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+# Фоновые задачи импорта товаров из Excel (/upload/confirm-mapping)
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)        # UUID задачи
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    status: Mapped[str] = mapped_column(String(20), default="queued")    # queued | running | done | failed
+    phase: Mapped[str] = mapped_column(String(20), default="queued")     # queued | reading | writing | merging | committing | done
+    params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # upload_id, маппинг, стратегия, имя файла
+    rows_processed: Mapped[int] = mapped_column(Integer, default=0)
+    inserted: Mapped[int] = mapped_column(Integer, default=0)
+    updated: Mapped[int] = mapped_column(Integer, default=0)
+    unchanged: Mapped[int] = mapped_column(Integer, default=0)
+    invalid: Mapped[int] = mapped_column(Integer, default=0)             # Отброшенные строки (не осталось ни одного значения)
+    error_count: Mapped[int] = mapped_column(Integer, default=0)         # Всего ошибок валидации
+    errors: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)  # Первые ошибки валидации
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), index=True)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
 # Модель настроек маппинга колонок
 class ColumnMappingSetting(Base):
     __tablename__ = "column_mapping_settings"
@@ -71,12 +265,391 @@ class ChatMessage(Base):
 
 # Настройки для асинхронной работы с БД
 import os
+import re
+import time
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres:password@db:5432/ai_database")
 
 engine = create_async_engine(DATABASE_URL, echo=True)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Необязательная реплика для чтения (каталог, выгрузки, SELECT из чата).
+# Без DATABASE_READ_URL чтение идет через основной engine.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+read_engine = create_async_engine(DATABASE_READ_URL, echo=True) if DATABASE_READ_URL else engine
+async_read_session = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Read-your-writes: после записи чтение идет с основной БД, пока реплика не
+# воспроизведет WAL до позиции основной БД на момент этой записи. Окно по времени
+# не годится: ETag каталога меняется сразу при записи, и отстающая дольше окна
+# реплика отдавала бы старые строки под новым тегом.
+# REPLICA_CHECK_SECONDS — как часто при отставании перепроверять позицию реплики.
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "0.5"))
+_write_seq = 0         # номер последней записи этого процесса
+_replica_seq = 0       # номер последней записи, которую реплика уже воспроизвела
+_replica_checked_at = 0.0
+
+def mark_write() -> None:
+    """Отмечает запись в основную БД (вызывается после commit при каждом изменении каталога)"""
+    global _write_seq
+    _write_seq += 1
+
+async def replica_caught_up() -> bool:
+    """
+    True, если реплике можно читать: она воспроизвела WAL основной БД не раньше
+    последней записи. Позиция основной БД берется после записи (текущая), поэтому
+    сравнение только строже нужного. Не на standby pg_last_wal_replay_lsn() = NULL —
+    такая «реплика» после записей не используется.
+    """
+    global _replica_seq, _replica_checked_at
+    if read_engine is engine or _replica_seq == _write_seq:
+        return True
+    now = time.monotonic()
+    if now - _replica_checked_at < REPLICA_CHECK_SECONDS:
+        return False
+    _replica_checked_at = now
+    seq = _write_seq
+    try:
+        async with engine.connect() as conn:
+            primary_lsn = await conn.scalar(text("SELECT pg_current_wal_lsn()::text"))
+        async with read_engine.connect() as conn:
+            caught_up = await conn.scalar(
+                text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"), {"lsn": primary_lsn}
+            )
+    except Exception as e:
+        print(f"Ошибка проверки отставания реплики: {e}")
+        return False
+    if caught_up:
+        _replica_seq = max(_replica_seq, seq)
+    return _replica_seq == _write_seq
+
+def read_session(force_primary: bool = False) -> AsyncSession:
+    """
+    Сессия для чтения: реплика, если она настроена и уже догнала последнюю запись
+    (состояние обновляет replica_caught_up — вызывать перед открытием сессии)
+    """
+    if force_primary or read_engine is engine or _replica_seq != _write_seq:
+        return async_session()
+    return async_read_session()
+
+def _facet_values_sql(alias: str) -> str:
+    """LATERAL VALUES, разворачивающий строку товара в пары (facet, value); для справочников — id"""
+    pairs = ", ".join(
+        f"('{field}', {alias}.{field}_id::text)" if field in DICTIONARY_MODELS else f"('{field}', {alias}.{field})"
+        for field in FACET_FIELDS
+    )
+    return f"CROSS JOIN LATERAL (VALUES {pairs}) AS f(facet, value)"
+
+def _facet_delta_insert_sql(delta_select: str) -> str:
+    return (
+        "INSERT INTO facet_count_deltas (facet, value, diff) "
+        f"SELECT facet, value, sum(diff) FROM ({delta_select}) AS d "
+        "WHERE value IS NOT NULL AND value <> '' "
+        "GROUP BY facet, value HAVING sum(diff) <> 0;"
+    )
+
+# Триггерная функция уровня оператора: одна агрегированная вставка дельт фасетов на
+# весь INSERT/UPDATE/DELETE (transition tables), а не на каждую строку импорта
+PRODUCT_FACETS_TRIGGER_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION products_facets_sync() RETURNS trigger AS $body$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_facet_delta_insert_sql(f"SELECT f.facet, f.value, 1 AS diff FROM new_rows r {_facet_values_sql('r')}")}
+    ELSIF TG_OP = 'DELETE' THEN
+        {_facet_delta_insert_sql(f"SELECT f.facet, f.value, -1 AS diff FROM old_rows r {_facet_values_sql('r')}")}
+    ELSE
+        {_facet_delta_insert_sql(
+            f"SELECT f.facet, f.value, 1 AS diff FROM new_rows r {_facet_values_sql('r')} "
+            f"UNION ALL SELECT f.facet, f.value, -1 AS diff FROM old_rows r {_facet_values_sql('r')}"
+        )}
+    END IF;
+    RETURN NULL;
+END;
+$body$ LANGUAGE plpgsql
+"""
+
+# Первичное заполнение фасетов для уже существующих товаров (только если таблица пуста)
+PRODUCT_FACETS_BACKFILL_SQL = (
+    "INSERT INTO facet_counts (facet, value, count) "
+    f"SELECT f.facet, f.value, count(*) FROM products p {_facet_values_sql('p')} "
+    "WHERE f.value IS NOT NULL AND f.value <> '' "
+    "AND NOT EXISTS (SELECT 1 FROM facet_counts) AND NOT EXISTS (SELECT 1 FROM facet_count_deltas) "
+    "GROUP BY f.facet, f.value"
+)
+
+# Свертка дельт в facet_counts (FacetService.fold_deltas): забирает все видимые
+# (зафиксированные) дельты одной командой. Строки сводной таблицы обновляются
+# в порядке (facet, value), поэтому параллельные свертки не взаимоблокируются.
+PRODUCT_FACETS_FOLD_SQL = [
+    "WITH moved AS (DELETE FROM facet_count_deltas RETURNING facet, value, diff) "
+    "INSERT INTO facet_counts (facet, value, count) "
+    "SELECT facet, value, sum(diff) FROM moved GROUP BY facet, value HAVING sum(diff) <> 0 "
+    "ORDER BY facet, value "
+    "ON CONFLICT (facet, value) DO UPDATE SET count = facet_counts.count + EXCLUDED.count",
+    "DELETE FROM facet_counts WHERE count <= 0",
+]
+
+# Ключ объекта S3 из ссылки на изображение: без схемы, хоста, query-строки и
+# префикса бакета (path-style URL). Для ключей без схемы — сам ключ.
+_S3_BUCKET_PATTERN = re.escape(os.getenv("S3_BUCKET_NAME", "ai-database-images"))
+PRODUCT_IMAGE_KEY_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION product_image_key(ref text) RETURNS text AS $body$
+    SELECT NULLIF(
+        regexp_replace(
+            regexp_replace(split_part(btrim(ref), '?', 1), '^[a-zA-Z][a-zA-Z0-9+.-]*://[^/]*', ''),
+            '^/*({_S3_BUCKET_PATTERN}/)?', ''
+        ),
+        ''
+    )
+$body$ LANGUAGE sql IMMUTABLE
+"""
+
+# Разворачивает строку images в (pos, url) без пустых элементов
+PRODUCT_IMAGE_REFS_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION product_image_refs(images text) RETURNS TABLE(pos integer, url text) AS $body$
+    SELECT (row_number() OVER (ORDER BY t.ord) - 1)::integer, btrim(t.x)
+    FROM unnest(string_to_array(images, ',')) WITH ORDINALITY AS t(x, ord)
+    WHERE btrim(t.x) <> ''
+$body$ LANGUAGE sql IMMUTABLE
+"""
+
+# Триггерная функция уровня строки: пересобирает product_images товара при изменении images.
+# Удаление товара чистит изображения каскадом по внешнему ключу.
+PRODUCT_IMAGES_TRIGGER_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION products_images_sync() RETURNS trigger AS $body$
+BEGIN
+    DELETE FROM product_images WHERE product_id = NEW.id;
+    INSERT INTO product_images (product_id, position, url, s3_key)
+    SELECT NEW.id, r.pos, r.url, product_image_key(r.url) FROM product_image_refs(NEW.images) r;
+    RETURN NULL;
+END;
+$body$ LANGUAGE plpgsql
+"""
+
+# Перенос существующих строк images в product_images (только если таблица пуста)
+PRODUCT_IMAGES_BACKFILL_SQL = (
+    "INSERT INTO product_images (product_id, position, url, s3_key) "
+    "SELECT p.id, r.pos, r.url, product_image_key(r.url) "
+    "FROM products p CROSS JOIN LATERAL product_image_refs(p.images) r "
+    "WHERE p.images IS NOT NULL AND NOT EXISTS (SELECT 1 FROM product_images)"
+)
+
+# Пробельные символы значений справочников — ровно те, что str.isspace() в Python
+# (в том числе неразрывный пробел из Excel). Класс задан явно: \s в PostgreSQL
+# зависит от локали и NBSP может не включать. Выражение понимают и re, и ARE PostgreSQL.
+ATTR_WHITESPACE_PATTERN = (
+    r"[\u0009-\u000d\u001c-\u0020\u0085\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+"
+)
+
+# Каноническое написание и ключ сравнения значения справочника. Должны совпадать
+# с AttributeDictionary.canonical/normalize в services/attribute_dictionary.py.
+PRODUCT_ATTR_FUNCTIONS_SQL = [
+    f"""
+CREATE OR REPLACE FUNCTION product_attr_canonical(v text) RETURNS text AS $body$
+    SELECT NULLIF(btrim(regexp_replace(v, '{ATTR_WHITESPACE_PATTERN}', ' ', 'g'), ' '), '')
+$body$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION product_attr_key(v text) RETURNS text AS $body$
+    SELECT lower(product_attr_canonical(v))
+$body$ LANGUAGE sql IMMUTABLE
+""",
+]
+
+def _dictionary_sync_sql(field: str, table: str) -> str:
+    """
+    Синхронизация строки и id одного поля:
+    - пустая строка — id сбрасывается;
+    - переданы и строка, и id (импорт через кеш справочников) — доверяем им;
+    - изменен только id — строка берется из справочника;
+    - иначе значение находится (или добавляется) в справочнике по ключу без учета
+      регистра и пробелов; проставляется только id, строка остается как ее ввел
+      пользователь (исправление регистра бренда или цвета не теряется).
+    """
+    return f"""
+    IF product_attr_key(NEW.{field}) IS NULL THEN
+        NEW.{field}_id := NULL;
+    ELSIF TG_OP = 'UPDATE' AND NEW.{field}_id IS DISTINCT FROM OLD.{field}_id
+          AND NEW.{field} IS NOT DISTINCT FROM OLD.{field} AND NEW.{field}_id IS NOT NULL THEN
+        SELECT value INTO NEW.{field} FROM {table} WHERE id = NEW.{field}_id;
+    ELSIF NEW.{field}_id IS NULL
+          OR (TG_OP = 'UPDATE' AND NEW.{field} IS DISTINCT FROM OLD.{field}
+              AND NEW.{field}_id IS NOT DISTINCT FROM OLD.{field}_id) THEN
+        INSERT INTO {table} (value, normalized)
+        VALUES (product_attr_canonical(NEW.{field}), product_attr_key(NEW.{field}))
+        ON CONFLICT (normalized) DO NOTHING;
+        SELECT id INTO NEW.{field}_id FROM {table}
+        WHERE normalized = product_attr_key(NEW.{field});
+    END IF;"""
+
+PRODUCT_DICTIONARY_TRIGGER_FUNCTION_SQL = (
+    "CREATE OR REPLACE FUNCTION products_dictionary_sync() RETURNS trigger AS $body$\nBEGIN"
+    + "".join(_dictionary_sync_sql(field, model.__tablename__) for field, model in DICTIONARY_MODELS.items())
+    + "\n    RETURN NEW;\nEND;\n$body$ LANGUAGE plpgsql"
+)
+
+# Пробелы, которые product_attr_canonical раньше (\s по локали) не заменял: у товаров
+# с такими значениями ссылка на справочник пересчитывается при старте
+LEGACY_UNMATCHED_WHITESPACE = r"[\u001c-\u001f\u0085\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]"
+
+def _stale_dictionary_sql(column: str) -> str:
+    """Товар без ссылки на справочник или со значением, ключ которого изменился"""
+    return f"({column}_id IS NULL OR {column} ~ '{LEGACY_UNMATCHED_WHITESPACE}')"
+
+def _dictionary_migrations() -> list:
+    """
+    Колонки id для существующих таблиц, первичное заполнение справочников и
+    пересчет ссылок, ключ которых изменился. Выполняется без триггера
+    products_dictionary_sync, чтобы смена id не переписала строку товара.
+    """
+    statements = []
+    for field, model in DICTIONARY_MODELS.items():
+        table = model.__tablename__
+        statements += [
+            f"ALTER TABLE products ADD COLUMN IF NOT EXISTS {field}_id INTEGER REFERENCES {table}(id)",
+            # Каноническое написание — самый частый вариант среди совпадающих по ключу
+            f"INSERT INTO {table} (value, normalized) "
+            f"SELECT DISTINCT ON (product_attr_key({field})) product_attr_canonical({field}), product_attr_key({field}) "
+            f"FROM products WHERE {_stale_dictionary_sql(field)} AND product_attr_key({field}) IS NOT NULL "
+            f"GROUP BY {field} ORDER BY product_attr_key({field}), count(*) DESC "
+            "ON CONFLICT (normalized) DO NOTHING",
+            # Только ссылка: строки товаров не переписываются написанием из справочника
+            f"UPDATE products p SET {field}_id = d.id FROM {table} d "
+            f"WHERE {_stale_dictionary_sql('p.' + field)} AND d.normalized = product_attr_key(p.{field}) "
+            f"AND p.{field}_id IS DISTINCT FROM d.id",
+        ]
+    return statements
+
+# Номер изменения — id текущей транзакции (xid8, монотонный и без переполнения).
+# В отличие от nextval, он позволяет ленте отдавать только завершенные транзакции:
+# все строки с номером меньше xmin текущего снимка уже видны и новых не появится.
+CHANGE_SEQ_SQL = "pg_current_xact_id()::text::bigint"
+
+PRODUCT_CHANGE_SEQ_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION products_change_seq() RETURNS trigger AS $body$
+BEGIN
+    NEW.change_seq := {CHANGE_SEQ_SQL};
+    RETURN NEW;
+END;
+$body$ LANGUAGE plpgsql
+"""
+
+# Триггерная функция уровня оператора: одна вставка надгробий на весь DELETE
+PRODUCT_TOMBSTONES_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION products_tombstones() RETURNS trigger AS $body$
+BEGIN
+    INSERT INTO product_tombstones (product_id, change_seq)
+    SELECT id, {CHANGE_SEQ_SQL} FROM old_rows
+    ON CONFLICT (product_id) DO UPDATE SET change_seq = EXCLUDED.change_seq, deleted_at = now();
+    RETURN NULL;
+END;
+$body$ LANGUAGE plpgsql
+"""
+
+# Артикул уникален без учета пробелов по краям (пустые не учитываются): цель
+# ON CONFLICT для импорта Excel (ProductBulkService.upsert_many). Если в базе уже
+# есть дубликаты, миграция пропускается (повторяется при каждом старте), а импорт
+# пишет через поиск по артикулу (upsert_many_by_lookup).
+PART_NUMBER_KEY_PREDICATE_SQL = "btrim(part_number) <> ''"
+PART_NUMBER_UNIQUE_INDEX = "ux_products_part_number"
+
+# Идемпотентные миграции схемы. PRE_CREATE выполняются до create_all,
+# остальные — после, для таблиц, созданных предыдущими версиями приложения.
+PRE_CREATE_MIGRATIONS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Фасеты по строкам заменены фасетами по id справочников (facet_counts):
+    # новые таблицы заполняются заново через PRODUCT_FACETS_BACKFILL_SQL
+    "DROP TABLE IF EXISTS product_facet_deltas",
+    "DROP TABLE IF EXISTS product_facets",
+]
+
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS results JSONB",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_trgm ON products "
+    f"USING gin ({SEARCH_TEXT_SQL} gin_trgm_ops)",
+    PRODUCT_FACETS_TRIGGER_FUNCTION_SQL,
+    "DROP TRIGGER IF EXISTS products_facets_insert ON products",
+    "CREATE TRIGGER products_facets_insert AFTER INSERT ON products "
+    "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION products_facets_sync()",
+    "DROP TRIGGER IF EXISTS products_facets_update ON products",
+    "CREATE TRIGGER products_facets_update AFTER UPDATE ON products "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT "
+    "EXECUTE FUNCTION products_facets_sync()",
+    "DROP TRIGGER IF EXISTS products_facets_delete ON products",
+    "CREATE TRIGGER products_facets_delete AFTER DELETE ON products "
+    "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION products_facets_sync()",
+    PRODUCT_FACETS_BACKFILL_SQL,
+    PRODUCT_IMAGE_KEY_FUNCTION_SQL,
+    PRODUCT_IMAGE_REFS_FUNCTION_SQL,
+    PRODUCT_IMAGES_TRIGGER_FUNCTION_SQL,
+    "DROP TRIGGER IF EXISTS products_images_insert ON products",
+    "CREATE TRIGGER products_images_insert AFTER INSERT ON products FOR EACH ROW "
+    "WHEN (NEW.images IS NOT NULL) EXECUTE FUNCTION products_images_sync()",
+    "DROP TRIGGER IF EXISTS products_images_update ON products",
+    "CREATE TRIGGER products_images_update AFTER UPDATE OF images ON products FOR EACH ROW "
+    "WHEN (OLD.images IS DISTINCT FROM NEW.images) EXECUTE FUNCTION products_images_sync()",
+    PRODUCT_IMAGES_BACKFILL_SQL,
+    *PRODUCT_ATTR_FUNCTIONS_SQL,
+    PRODUCT_DICTIONARY_TRIGGER_FUNCTION_SQL,
+    "DROP TRIGGER IF EXISTS products_dictionary_sync ON products",
+    *_dictionary_migrations(),
+    "CREATE TRIGGER products_dictionary_sync BEFORE INSERT OR UPDATE ON products "
+    "FOR EACH ROW EXECUTE FUNCTION products_dictionary_sync()",
+    # DEFAULT без перезаписи строк: существующие товары получают номер 1
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 1",
+    PRODUCT_CHANGE_SEQ_FUNCTION_SQL,
+    "DROP TRIGGER IF EXISTS products_change_seq ON products",
+    "CREATE TRIGGER products_change_seq BEFORE INSERT OR UPDATE ON products "
+    "FOR EACH ROW EXECUTE FUNCTION products_change_seq()",
+    PRODUCT_TOMBSTONES_FUNCTION_SQL,
+    "DROP TRIGGER IF EXISTS products_tombstones ON products",
+    "CREATE TRIGGER products_tombstones AFTER DELETE ON products "
+    "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION products_tombstones()",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {PART_NUMBER_UNIQUE_INDEX} ON products "
+    f"((btrim(part_number))) WHERE {PART_NUMBER_KEY_PREDICATE_SQL}",
+    # Владелец задачи выгрузки; у задач, созданных раньше, его нет — они видны только админу
+    "ALTER TABLE export_jobs ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id) ON DELETE SET NULL",
+]
+
+async def _execute_migrations(conn, statements) -> None:
+    for statement in statements:
+        try:
+            # SAVEPOINT, чтобы ошибка одной миграции не обрывала всю транзакцию
+            async with conn.begin_nested():
+                await conn.execute(text(statement))
+        except Exception as e:
+            # Пропускаем ошибку, чтобы не блокировать старт
+            print(f"Миграция пропущена ({statement[:60]}...): {e}")
+
+async def run_migrations(conn) -> None:
+    """Создание таблиц, миграции и индексы при старте приложения"""
+    await _execute_migrations(conn, PRE_CREATE_MIGRATIONS)
+    await conn.run_sync(Base.metadata.create_all)
+    await _execute_migrations(conn, SCHEMA_MIGRATIONS)
+    # Индексы, добавленные в модели после создания таблиц
+    await conn.run_sync(ensure_indexes)
+
+def ensure_indexes(sync_conn) -> None:
+    """Создает недостающие индексы для уже существующих таблиц.
+
+    create_all создает индексы только вместе с новой таблицей, поэтому
+    индексы, добавленные в модели позже, досоздаются здесь (idempotent).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 # Функция для получения сессии
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
+
+# Сессия для эндпоинтов, которые только читают. Заголовок X-Read-Primary: 1
+# принудительно читает с основной БД (например, сразу после собственной записи)
+async def get_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    force_primary = request.headers.get("x-read-primary", "").lower() in ("1", "true", "yes")
+    if not force_primary:
+        await replica_caught_up()
+    async with read_session(force_primary) as session:
+        yield session
@@ -1,16 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse, FileResponse, RedirectResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from models import Product, get_db, User
+from sqlalchemy import select, func, text
+from sqlalchemy.exc import IntegrityError
+from models import Product, get_db, get_read_db, User
 from services.backup_service import backup_service
+from services.count_cache import product_count_cache
+from services.product_cache import product_detail_cache
+from services.attribute_dictionary import AttributeDictionary, attribute_dictionary
+from services.catalog_version import catalog_version
+from services.product_search import product_search
+from services.facet_service import facet_service
+from services.export_service import export_service, EXPORT_FORMATS
+from services.export_jobs import export_job_manager
+from services.product_bulk_service import product_bulk_service, duplicate_part_number
+from services.product_image_service import product_image_service
+from services.product_changes import product_change_feed
+from services.s3_service import s3_service
 from utils.auth_middleware import get_current_active_user, require_admin
-from pydantic import BaseModel
-from typing import List, Optional
-import pandas as pd
-import zipfile
-import httpx
-from io import BytesIO
+from utils.pagination import (
+    InvalidCursorError, encode_cursor, decode_cursor, keyset_segments, keyset_order_by, next_cursor_for
+)
+from pydantic import BaseModel, create_model
+from typing import List, Optional, Tuple
+from functools import lru_cache
+import json
+import os
 
 # Pydantic схемы для очков
 class ProductBase(BaseModel):
@@ -43,77 +58,313 @@ class ProductResponse(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductPatch(ProductBase):
+    id: int
+
+class BulkCreateRequest(BaseModel):
+    products: List[ProductCreate]
+
+class BulkPatchRequest(BaseModel):
+    products: List[ProductPatch]
+
+class BulkRowResult(BaseModel):
+    index: Optional[int] = None   # Позиция строки в запросе (для операций по списку)
+    id: Optional[int] = None
+    status: str                   # created, updated, deleted, not_found
+
+class BulkWriteResponse(BaseModel):
+    affected: int
+    results: List[BulkRowResult]
+
+class ProductChange(BaseModel):
+    seq: int                                   # Номер изменения (транзакции)
+    id: int
+    deleted: bool = False
+    product: Optional[ProductResponse] = None  # Текущее состояние товара (для удаленных — null)
+
+class ProductChangesResponse(BaseModel):
+    changes: List[ProductChange]
+    has_more: bool
+    next_cursor: Optional[str] = None  # Следующая страница той же выборки
+    since: int                         # Значение since для следующего опроса, когда has_more=false
+
 class ProductsListResponse(BaseModel):
     products: List[ProductResponse]
     total_count: int
     page: int
     size: int
     total_pages: int
+    next_cursor: Optional[str] = None   # Курсор следующей страницы (режим pagination=cursor)
+    count_type: str = "exact"           # exact — точный COUNT, estimated — оценка планировщика
+
+@lru_cache(maxsize=128)
+def _projection_models(fields: Tuple[str, ...]):
+    """
+    Облегченные модели ответа для выбранных полей (fields=...): товар и страница списка.
+    Кешируются по набору полей, чтобы не пересоздавать классы на каждый запрос.
+    """
+    suffix = "_".join(fields)
+    item_model = create_model(
+        f"ProductFields_{suffix}",
+        **{field: (ProductResponse.model_fields[field].annotation, None) for field in fields}
+    )
+    page_model = create_model(
+        f"ProductsFieldsList_{suffix}",
+        __base__=ProductsListResponse,
+        products=(List[item_model], ...)
+    )
+    return item_model, page_model
+
+def _parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Список полей из параметра fields (через запятую) или None, если проекция не запрошена.
+    id включается всегда — он нужен для ключа строки и курсора.
+    """
+    if not fields or not fields.strip():
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in ProductResponse.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    selected = ["id"]
+    for field in requested:
+        if field not in selected:
+            selected.append(field)
+    return tuple(selected)
 
 router = APIRouter()
 
+# Условные GET: 304 Not Modified без обращения к БД, пока каталог не менялся
+products_not_modified = catalog_version.dependency("products")
+
+# Поля сортировки — явный список: у каждого есть составной индекс (поле, id) в
+# Product.__table_args__, чтобы ORDER BY и keyset-пагинация шли по индексу.
+# Новый индекс сам по себе не открывает сортировку по служебной колонке.
+SORTABLE_FIELDS = {
+    "id", "part_number", "part_name", "brand", "category", "color", "size", "width", "height", "year",
+}
+
+class ProductFilters:
+    """
+    Фильтры списка товаров — общие для GET /products, /products/filter-options
+    и массовых операций по фильтру.
+    type/gender/shape принимают несколько значений (?type=a&type=b), width/height/year —
+    диапазоны с включительными границами.
+    """
+
+    def __init__(
+        self,
+        brand: Optional[str] = None,
+        category: Optional[str] = None,
+        color: Optional[str] = None,
+        search: Optional[str] = None,
+        type: Optional[List[str]] = Query(None),
+        gender: Optional[List[str]] = Query(None),
+        shape: Optional[List[str]] = Query(None),
+        width_min: Optional[float] = None,
+        width_max: Optional[float] = None,
+        height_min: Optional[float] = None,
+        height_max: Optional[float] = None,
+        year_min: Optional[int] = None,
+        year_max: Optional[int] = None,
+    ):
+        self.brand = brand
+        self.category = category
+        self.color = color
+        self.search = search
+        self.values = {"type": type, "gender": gender, "shape": shape}
+        self.ranges = {
+            "width": (width_min, width_max),
+            "height": (height_min, height_max),
+            "year": (year_min, year_max),
+        }
+        for field, (low, high) in self.ranges.items():
+            if low is not None and high is not None and low > high:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Некорректный диапазон {field}: {field}_min больше {field}_max"
+                )
+
+    def as_dict(self) -> dict:
+        """Нормализуемый набор фильтров (ключ кеша количества)"""
+        filters = {"brand": self.brand, "category": self.category, "color": self.color, "search": self.search}
+        filters.update(self.values)
+        for field, (low, high) in self.ranges.items():
+            filters[f"{field}_min"] = low
+            filters[f"{field}_max"] = high
+        return filters
+
+    def conditions(self):
+        """
+        Условия WHERE для фильтров списка товаров.
+        Возвращает (conditions, relevance); relevance — выражение ранжирования поиска или None.
+        """
+        conditions = []
+        if self.brand:
+            conditions.append(AttributeDictionary.condition("brand", self.brand))
+        if self.category:
+            conditions.append(Product.category == self.category)
+        if self.color:
+            conditions.append(AttributeDictionary.condition("color", self.color))
+        for field, values in self.values.items():
+            values = [v for v in values or [] if v and v.strip()]
+            if values:
+                conditions.append(AttributeDictionary.in_condition(field, values))
+        for field, (low, high) in self.ranges.items():
+            column = getattr(Product, field)
+            if low is not None:
+                conditions.append(column >= low)
+            if high is not None:
+                conditions.append(column <= high)
+        relevance = None
+        if self.search and self.search.strip():
+            search_condition, relevance = product_search.build(self.search)
+            conditions.append(search_condition)
+        return conditions, relevance
+
 @router.get("/products", response_model=ProductsListResponse)
 async def get_products(
-    brand: Optional[str] = None,
-    category: Optional[str] = None,
-    color: Optional[str] = None,
-    search: Optional[str] = None,
+    filters: ProductFilters = Depends(),
     sort_field: Optional[str] = None,
     sort_order: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
-    db: AsyncSession = Depends(get_db)
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
+    count: str = Query("exact", pattern="^(exact|estimated)$"),
+    fields: Optional[str] = None,
+    cache_headers: dict = Depends(products_not_modified),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Получение списка очков с фильтрами и пагинацией"""
+    """
+    Получение списка очков с фильтрами и пагинацией.
+    pagination=offset — классический limit/offset;
+    pagination=cursor — keyset-пагинация: offset игнорируется, следующая страница
+    запрашивается по next_cursor из предыдущего ответа.
+    count=estimated — для списка без фильтров total_count берется из статистики
+    планировщика (pg_class.reltuples) вместо COUNT(*).
+    search — полнотекстовый (с префиксами) и подстрочный поиск по артикулу, названию,
+    бренду, производителю и цвету; без sort_field результаты сортируются по релевантности
+    (sort_field=relevance).
+    fields — список полей через запятую (например, fields=id,part_number,brand):
+    выбираются только эти колонки, без загрузки ORM-объектов, ответ содержит только их.
+    Фильтры: brand, category, color, search, type/gender/shape (несколько значений),
+    width_min/width_max, height_min/height_max, year_min/year_max.
+    sort_field — только колонки с индексом (см. SORTABLE_FIELDS), иначе 400.
+    """
+    projection = _parse_fields(fields)
+    
     # Базовый запрос для подсчета общего количества
-    base_query = select(Product)
+    conditions, relevance = filters.conditions()
+    if projection:
+        base_query = select(*[Product.__table__.c[field] for field in projection]).where(*conditions)
+    else:
+        base_query = select(Product).where(*conditions)
     
-    # Применяем фильтры
-    if brand:
-        base_query = base_query.where(Product.brand == brand)
-    if category:
-        base_query = base_query.where(Product.category == category)
-    if color:
-        base_query = base_query.where(Product.color == color)
-    if search:
-        base_query = base_query.where(Product.part_name.ilike(f"%{search}%"))
+    # Определяем сортировку; id всегда добавляется как tie-breaker,
+    # чтобы порядок был детерминированным и совпадал с индексом (колонка, id)
+    if relevance is not None and (not sort_field or sort_field == "relevance"):
+        sort_field = "relevance"
+        sort_order = "asc" if sort_order == "asc" else "desc"
+        sort_column = relevance
+    else:
+        if not sort_field or sort_field == "relevance":
+            sort_field = "id"
+        elif sort_field not in SORTABLE_FIELDS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Сортировка по полю {sort_field} не поддерживается. Доступны: {', '.join(sorted(SORTABLE_FIELDS))}"
+            )
+        sort_order = "desc" if sort_order == "desc" else "asc"
+        sort_column = getattr(Product, sort_field)
     
     # Получаем общее количество записей
-    count_query = select(func.count()).select_from(base_query.subquery())
-    count_result = await db.execute(count_query)
-    total_count = count_result.scalar()
+    total_count, count_type = await _count_products(db, base_query, filters.as_dict(), count)
     
-    # Получаем данные с пагинацией и сортировкой
-    data_query = base_query
+    data_query = keyset_order_by(base_query, sort_column, Product.id, sort_order)
     
-    # Применяем сортировку
-    if sort_field:
-        if hasattr(Product, sort_field):
-            sort_column = getattr(Product, sort_field)
-            if sort_order == 'desc':
-                data_query = data_query.order_by(sort_column.desc())
-            else:
-                data_query = data_query.order_by(sort_column.asc())
+    if pagination == "cursor":
+        segments = [data_query]
+        if cursor:
+            try:
+                value, last_id = decode_cursor(cursor, sort_field, sort_order)
+            except InvalidCursorError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            segments = keyset_segments(data_query, sort_column, Product.id, sort_order, value, last_id)
+        # Берем на одну строку больше, чтобы понять, есть ли следующая страница;
+        # значение сортировки выбираем явно — оно может быть вычисляемым (relevance).
+        # Следующий сегмент (хвост NULL) читается, только если страница не набрана
+        rows = []
+        for segment in segments:
+            segment = segment.add_columns(sort_column.label("sort_value")).limit(limit + 1 - len(rows))
+            rows.extend((await db.execute(segment)).all())
+            if len(rows) > limit:
+                break
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        products = rows if projection else [row[0] for row in rows]
+        next_cursor = next_cursor_for(rows, has_more, sort_field, sort_order)
     else:
-        # Сортировка по умолчанию по ID
-        data_query = data_query.order_by(Product.id.asc())
-    
-    data_query = data_query.limit(limit).offset(offset)
-    data_result = await db.execute(data_query)
-    products = data_result.scalars().all()
+        data_query = data_query.limit(limit).offset(offset)
+        data_result = await db.execute(data_query)
+        products = data_result.all() if projection else data_result.scalars().all()
+        next_cursor = None
     
     # Рассчитываем общее количество страниц
     total_pages = (total_count + limit - 1) // limit
-    current_page = offset // limit
+    current_page = offset // limit if pagination == "offset" else 0
+    
+    if projection:
+        # Ответ по облегченной модели отдается напрямую, минуя полный ProductsListResponse
+        item_model, page_model = _projection_models(projection)
+        page = page_model(
+            products=[item_model(**{field: row._mapping[field] for field in projection}) for row in products],
+            total_count=total_count,
+            page=current_page,
+            size=limit,
+            total_pages=total_pages,
+            next_cursor=next_cursor,
+            count_type=count_type
+        )
+        return JSONResponse(page.model_dump(mode="json"), headers=cache_headers)
     
     return ProductsListResponse(
         products=products,
         total_count=total_count,
         page=current_page,
         size=limit,
-        total_pages=total_pages
+        total_pages=total_pages,
+        next_cursor=next_cursor,
+        count_type=count_type
     )
 
+async def _count_products(db: AsyncSession, base_query, filters: dict, count_mode: str):
+    """
+    Возвращает (total_count, count_type).
+    Оценка планировщика используется только для списка без фильтров; точные
+    значения кешируются по нормализованному набору фильтров до следующей записи в products.
+    """
+    cache_key = product_count_cache.make_key(filters)
+
+    if count_mode == "estimated" and not cache_key:
+        estimate_result = await db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+        )
+        estimate = estimate_result.scalar()
+        # reltuples = -1 (или 0), если таблица еще не анализировалась — считаем точно
+        if estimate and estimate > 0:
+            return int(estimate), "estimated"
+
+    cached = product_count_cache.get(cache_key)
+    if cached is not None:
+        return cached, "exact"
+
+    count_query = select(func.count()).select_from(base_query.with_only_columns(Product.id).subquery())
+    count_result = await db.execute(count_query)
+    total_count = count_result.scalar()
+    product_count_cache.set(cache_key, total_count)
+    return total_count, "exact"
+
 @router.post("/products", response_model=ProductResponse)
 async def create_product(
     product: ProductCreate, 
@@ -123,11 +374,145 @@ async def create_product(
     """Создание нового товара"""
     db_product = Product(**product.dict())
     db.add(db_product)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        _raise_duplicate_part_number(e)
+        raise
+    product_count_cache.invalidate()
+    catalog_version.bump("products")
     await db.refresh(db_product)
     return db_product
 
-@router.get("/products/columns")
+def _raise_duplicate_part_number(error: Exception):
+    # Артикул уникален (ux_products_part_number): конфликт — 409, а не 500
+    part_number = duplicate_part_number(error)
+    if part_number is not None:
+        raise HTTPException(status_code=409, detail=f"Товар с артикулом {part_number} уже существует")
+
+def _check_bulk_size(rows: list):
+    if not rows:
+        raise HTTPException(status_code=400, detail="Список товаров пуст")
+    if len(rows) > product_bulk_service.max_rows:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много товаров в одном запросе (максимум {product_bulk_service.max_rows})"
+        )
+
+def _require_filter(conditions: list):
+    # Массовая операция без фильтра затронула бы весь каталог
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Необходимо указать хотя бы один фильтр")
+
+@router.post("/products/bulk", response_model=BulkWriteResponse)
+async def bulk_create_products(
+    request: BulkCreateRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Создание множества товаров одним INSERT в одной транзакции"""
+    _check_bulk_size(request.products)
+    try:
+        ids = await product_bulk_service.insert_many(db, [p.dict() for p in request.products])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        _raise_duplicate_part_number(e)
+        raise HTTPException(status_code=500, detail=f"Ошибка массового создания: {str(e)}")
+    product_count_cache.invalidate()
+    catalog_version.bump("products")
+    return BulkWriteResponse(
+        affected=len(ids),
+        results=[BulkRowResult(index=i, id=product_id, status="created") for i, product_id in enumerate(ids)]
+    )
+
+@router.patch("/products/bulk", response_model=BulkWriteResponse)
+async def bulk_patch_products(
+    request: BulkPatchRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Частичное обновление множества товаров по id одним UPDATE.
+    Меняются только переданные поля; для отсутствующих id — статус not_found.
+    """
+    _check_bulk_size(request.products)
+    ids = [p.id for p in request.products]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Идентификаторы товаров в запросе повторяются")
+    try:
+        updated = set(await product_bulk_service.patch_many(
+            db, [p.dict(exclude_unset=True) for p in request.products]
+        ))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        _raise_duplicate_part_number(e)
+        raise HTTPException(status_code=500, detail=f"Ошибка массового обновления: {str(e)}")
+    product_count_cache.invalidate()
+    await product_detail_cache.invalidate(updated)
+    catalog_version.bump("products")
+    return BulkWriteResponse(
+        affected=len(updated),
+        results=[
+            BulkRowResult(index=i, id=product_id, status="updated" if product_id in updated else "not_found")
+            for i, product_id in enumerate(ids)
+        ]
+    )
+
+@router.patch("/products/by-filter", response_model=BulkWriteResponse)
+async def update_products_by_filter(
+    product_update: ProductUpdate,
+    filters: ProductFilters = Depends(),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_admin)
+):
+    """Обновление всех товаров под фильтрами GET /products одним UPDATE (только для админа)"""
+    conditions, _ = filters.conditions()
+    _require_filter(conditions)
+    values = product_update.dict(exclude_unset=True)
+    if not values:
+        raise HTTPException(status_code=400, detail="Не переданы поля для обновления")
+    try:
+        ids = await product_bulk_service.update_where(db, conditions, values)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        _raise_duplicate_part_number(e)
+        raise HTTPException(status_code=500, detail=f"Ошибка массового обновления: {str(e)}")
+    product_count_cache.invalidate()
+    await product_detail_cache.invalidate(ids)
+    catalog_version.bump("products")
+    return BulkWriteResponse(
+        affected=len(ids),
+        results=[BulkRowResult(id=product_id, status="updated") for product_id in ids]
+    )
+
+@router.delete("/products/by-filter", response_model=BulkWriteResponse)
+async def delete_products_by_filter(
+    filters: ProductFilters = Depends(),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(require_admin)
+):
+    """Удаление всех товаров под фильтрами GET /products одним DELETE (только для админа)"""
+    conditions, _ = filters.conditions()
+    _require_filter(conditions)
+    try:
+        ids = await product_bulk_service.delete_where(db, conditions)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка массового удаления: {str(e)}")
+    product_count_cache.invalidate()
+    await product_detail_cache.invalidate(ids)
+    catalog_version.bump("products")
+    return BulkWriteResponse(
+        affected=len(ids),
+        results=[BulkRowResult(id=product_id, status="deleted") for product_id in ids]
+    )
+
+@router.get("/products/columns", dependencies=[Depends(products_not_modified)])
 async def get_product_columns():
     """Получение списка всех колонок таблицы продуктов с человеческими названиями"""
     try:
@@ -155,27 +540,29 @@ async def get_product_columns():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения колонок: {str(e)}")
 
-@router.get("/products/filter-options")
-async def get_filter_options(db: AsyncSession = Depends(get_db)):
-    """Получение опций для фильтров"""
+@router.get("/products/filter-options", dependencies=[Depends(products_not_modified)])
+async def get_filter_options(
+    filters: ProductFilters = Depends(),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Получение опций для фильтров с количеством товаров по каждому значению.
+    Без фильтров — из сводной таблицы facet_counts; с фильтрами (те же, что у
+    GET /products) — количества под текущими фильтрами одним запросом.
+    """
     try:
-        # Получаем уникальные значения для фильтров
-        brands_query = select(Product.brand).distinct().where(Product.brand.isnot(None))
-        categories_query = select(Product.category).distinct().where(Product.category.isnot(None))
-        colors_query = select(Product.color).distinct().where(Product.color.isnot(None))
-        
-        brands_result = await db.execute(brands_query)
-        categories_result = await db.execute(categories_query)
-        colors_result = await db.execute(colors_query)
-        
-        brands = [row[0] for row in brands_result.fetchall() if row[0]]
-        categories = [row[0] for row in categories_result.fetchall() if row[0]]
-        colors = [row[0] for row in colors_result.fetchall() if row[0]]
+        conditions, _ = filters.conditions()
+        if conditions:
+            facets = await facet_service.get_filtered_facets(db, conditions)
+        else:
+            facets = await facet_service.get_facets(db)
         
         return {
-            "brands": sorted(brands),
-            "categories": sorted(categories),
-            "colors": sorted(colors)
+            "brands": [item["value"] for item in facets["brand"]],
+            "categories": [item["value"] for item in facets["category"]],
+            "colors": [item["value"] for item in facets["color"]],
+            "facets": facets,
+            "filtered": bool(conditions)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения фильтров: {str(e)}")
@@ -183,14 +570,130 @@ async def get_filter_options(db: AsyncSession = Depends(get_db)):
 # ВАЖНО: динамические маршруты должны идти после статических, иначе
 # запросы вида /products/columns будут интерпретированы как /products/{product_id}
 # и вернут 422 из-за невозможности преобразовать 'columns' в int.
+async def _product_payloads(db: AsyncSession, ids: List[int]) -> dict:
+    """
+    Карточки товаров (JSON-словари ProductResponse) по id: из кеша,
+    промахи — одним запросом к БД с последующим сохранением в кеш.
+    """
+    payloads = await product_detail_cache.get_many(ids)
+    missing = [product_id for product_id in dict.fromkeys(ids) if product_id not in payloads]
+    if missing:
+        generation = product_detail_cache.generation
+        result = await db.execute(select(Product).where(Product.id.in_(missing)))
+        loaded = {
+            product.id: ProductResponse.model_validate(product).model_dump(mode="json")
+            for product in result.scalars().all()
+        }
+        await product_detail_cache.put(loaded, generation)
+        payloads.update(loaded)
+    return payloads
+
+@router.get("/products/changes", response_model=ProductChangesResponse)
+async def get_product_changes(
+    since: int = 0,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Лента изменений каталога: товары, созданные/измененные/удаленные после since.
+    since=0 — весь каталог. Страницы — по next_cursor, пока has_more; затем следующий
+    опрос делается с since из ответа. Изменения внутри страницы упорядочены по seq,
+    поэтому применять их нужно по порядку (последнее состояние товара побеждает).
+    """
+    if limit > product_change_feed.max_limit:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком большой limit (максимум {product_change_feed.max_limit})"
+        )
+    after_id = None
+    if cursor:
+        try:
+            since, after_id = decode_cursor(cursor, "change_seq", "asc")
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    rows, has_more = await product_change_feed.changes(db, since, after_id, limit)
+    upsert_ids = [product_id for _, product_id, deleted in rows if not deleted]
+    products = {}
+    if upsert_ids:
+        result = await db.execute(select(Product).where(Product.id.in_(upsert_ids)))
+        products = {product.id: product for product in result.scalars().all()}
+
+    changes = [
+        # Товар могли удалить между запросами — его надгробие придет в следующих страницах
+        ProductChange(seq=seq, id=product_id, deleted=deleted or product_id not in products,
+                      product=None if deleted else products.get(product_id))
+        for seq, product_id, deleted in rows
+    ]
+    last_seq = rows[-1][0] if rows else since
+    return ProductChangesResponse(
+        changes=changes,
+        has_more=has_more,
+        next_cursor=encode_cursor("change_seq", "asc", last_seq, rows[-1][1]) if has_more else None,
+        since=last_seq,
+    )
+
+@router.get("/products/batch", response_model=List[ProductResponse])
+async def get_products_batch(
+    ids: List[int] = Query(...),
+    fields: Optional[str] = None,
+    cache_headers: dict = Depends(products_not_modified),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Товары по списку id (?ids=1&ids=2) в порядке запроса; отсутствующие id пропускаются.
+    fields — только перечисленные поля (как у GET /products)
+    """
+    if len(ids) > product_bulk_service.max_rows:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много id в одном запросе (максимум {product_bulk_service.max_rows})"
+        )
+    projection = _parse_fields(fields)
+    payloads = await _product_payloads(db, ids)
+    items = [payloads[product_id] for product_id in dict.fromkeys(ids) if product_id in payloads]
+    if projection:
+        items = [{field: item[field] for field in projection} for item in items]
+    return JSONResponse(items, headers=cache_headers)
+
+@router.get("/products/cache-stats")
+async def get_product_cache_stats(current_user: User = Depends(require_admin)):
+    """Метрики кеша карточек товаров: попадания, промахи, размер (только для админа)"""
+    return product_detail_cache.stats()
+
 @router.get("/products/{product_id}", response_model=ProductResponse)
-async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
-    """Получение товара по ID"""
-    result = await db.execute(select(Product).where(Product.id == product_id))
-    product = result.scalar_one_or_none()
-    if not product:
+async def get_product(
+    product_id: int,
+    fields: Optional[str] = None,
+    cache_headers: dict = Depends(products_not_modified),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Получение товара по ID; fields — только перечисленные поля (как у GET /products).
+    Карточка отдается из кеша product_detail_cache, если она там есть.
+    """
+    projection = _parse_fields(fields)
+    payload = (await _product_payloads(db, [product_id])).get(product_id)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Товар не найден")
-    return product
+    if projection:
+        payload = {field: payload[field] for field in projection}
+    return JSONResponse(payload, headers=cache_headers)
+
+@router.get("/products/{product_id}/images")
+async def get_product_images(
+    product_id: int,
+    cache_headers: dict = Depends(products_not_modified),
+    db: AsyncSession = Depends(get_db)
+):
+    """Изображения товара по порядку (из product_images), с ключами объектов S3"""
+    images = await product_image_service.product_images(db, product_id)
+    if not images:
+        exists = await db.execute(select(Product.id).where(Product.id == product_id))
+        if exists.scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="Товар не найден")
+    return {"product_id": product_id, "images": images}
 
 @router.put("/products/{product_id}", response_model=ProductResponse)
 async def update_product(
@@ -206,7 +709,15 @@ async def update_product(
         raise HTTPException(status_code=404, detail="Товар не найден")
     for key, value in product_update.dict(exclude_unset=True).items():
         setattr(db_product, key, value)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        _raise_duplicate_part_number(e)
+        raise
+    product_count_cache.invalidate()
+    await product_detail_cache.invalidate([product_id])
+    catalog_version.bump("products")
     await db.refresh(db_product)
     return db_product
 
@@ -223,170 +734,157 @@ async def delete_product(
         raise HTTPException(status_code=404, detail="Товар не найден")
     await db.delete(db_product)
     await db.commit()
+    product_count_cache.invalidate()
+    await product_detail_cache.invalidate([product_id])
+    catalog_version.bump("products")
     return {"message": "Товар удален"}
 @router.post("/products/export")
 async def export_products(
     request: dict,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Экспорт товаров в Excel с возможностью экспорта изображений"""
+    """
+    Экспорт товаров в Excel, CSV или Parquet (поле format, по умолчанию xlsx)
+    с возможностью экспорта изображений.
+    Файл формируется потоково: строки читаются серверным курсором и сразу
+    уходят клиенту, без загрузки всей выборки в память.
+    """
     try:
         # Получение параметров из запроса
-        selected_brands = request.get('brands', [])
-        selected_columns = request.get('columns', [])
-        include_images = request.get('include_images', False)
-        
-        if not selected_brands:
-            raise HTTPException(status_code=400, detail="Необходимо выбрать хотя бы один бренд")
-        if not selected_columns:
-            raise HTTPException(status_code=400, detail="Необходимо выбрать хотя бы одну колонку")
+        selected_brands, selected_columns, include_images, export_format = _parse_export_request(request)
 
-        # Создание запроса с фильтрацией по брендам
-        query = select(Product).where(Product.brand.in_(selected_brands))
-        result = await db.execute(query)
-        products = result.scalars().all()
-
-        if not products:
+        if not await export_service.has_products(db, selected_brands):
             raise HTTPException(status_code=404, detail="Товары не найдены")
 
-        # Маппинг колонок БД к человеческим названиям
-        column_mapping = {
-            'id': 'ID',
-            'images': 'Изображения',
-            'manufacturer_name': 'Название производителя',
-            'part_number': 'Номер детали',
-            'part_name': 'Название',
-            'category': 'Категория',
-            'type': 'Тип',
-            'size': 'Размер',
-            'color': 'Цвет',
-            'brand': 'Бренд',
-            'producer': 'Производитель',
-            'gender': 'Пол',
-            'width': 'Ширина',
-            'height': 'Высота',
-            'age': 'Возраст',
-            'shape': 'Форма',
-            'year': 'Год'
-        }
-
-        # Подготовка данных для экспорта
-        export_data = []
-        for product in products:
-            row = {}
-            for col_config in selected_columns:
-                field = col_config['field']
-                display_name = col_config['display_name']
-                
-                # Получение значения
-                if field == 'description':
-                    # Виртуальная колонка — всегда пустая строка
-                    value = ""
-                else:
-                    value = getattr(product, field, None)
-                
-                # Специальная обработка для category
-                if field == 'category':
-                    value = f"category/{product.brand}" if product.brand else "category/"
-                elif field == 'images' and value:
-                    # Форматирование изображений с .jpg
-                    images = value.split(',')
-                    formatted_images = []
-                    for img in images:
-                        img = img.strip()
-                        if not img.endswith('.jpg'):
-                            img += '.jpg'
-                        formatted_images.append(img)
-                    value = ', '.join(formatted_images)
-                
-                row[display_name] = value or ""
-            
-            export_data.append(row)
-
-        # Если экспорт без изображений - только Excel файл
+        # Если экспорт без изображений - только файл данных
         if not include_images:
-            df = pd.DataFrame(export_data)
-            # Гарантируем порядок колонок согласно выбору пользователя
-            ordered_headers = [c['display_name'] for c in selected_columns]
-            # На случай, если какие-то заголовки отсутствуют (не должны) — фильтруем по пересечению
-            ordered_headers = [h for h in ordered_headers if h in df.columns]
-            df = df.reindex(columns=ordered_headers)
-            
-            # Создание Excel файла в памяти
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Данные')
-            output.seek(0)
-            
             return StreamingResponse(
-                BytesIO(output.getvalue()),
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                headers={"Content-Disposition": "attachment; filename=data.xlsx"}
+                export_service.stream_file(export_format, selected_brands, selected_columns),
+                media_type=EXPORT_FORMATS[export_format],
+                headers={"Content-Disposition": f"attachment; filename=data.{export_format}"}
             )
         else:
-            # Экспорт с изображениями - создание архива
-            # Создание Excel файла
-            df = pd.DataFrame(export_data)
-            ordered_headers = [c['display_name'] for c in selected_columns]
-            ordered_headers = [h for h in ordered_headers if h in df.columns]
-            df = df.reindex(columns=ordered_headers)
-            excel_buffer = BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Данные')
-            excel_buffer.seek(0)
-            
-            # Создание ZIP архива
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                # Добавление Excel файла
-                zip_file.writestr('data.xlsx', excel_buffer.getvalue())
-                
-                # Сбор всех уникальных изображений
-                unique_images = set()
-                for product in products:
-                    if product.images:
-                        images = product.images.split(',')
-                        for img in images:
-                            img = img.strip()
-                            if img:
-                                unique_images.add(img)
-                
-                # Создание папки media и загрузка изображений
-                if unique_images:
-                    async with httpx.AsyncClient() as client:
-                        for image_url in unique_images:
-                            try:
-                                # Попытка загрузить изображение
-                                response = await client.get(image_url, timeout=10)
-                                if response.status_code == 200:
-                                    # Определение имени файла
-                                    filename = image_url.split('/')[-1]
-                                    if not filename.endswith('.jpg'):
-                                        filename += '.jpg'
-                                    
-                                    # Добавление в архив
-                                    zip_file.writestr(f'media/{filename}', response.content)
-                            except Exception as e:
-                                print(f"Ошибка загрузки изображения {image_url}: {e}")
-                                continue
-            
-            zip_buffer.seek(0)
-            
+            # Экспорт с изображениями - архив формируется и отдается потоково,
+            # изображения скачиваются параллельно (из S3 напрямую по ключу)
             return StreamingResponse(
-                BytesIO(zip_buffer.getvalue()),
+                export_service.stream_zip_with_images(selected_brands, selected_columns, export_format),
                 media_type='application/zip',
                 headers={"Content-Disposition": "attachment; filename=export_with_images.zip"}
             )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка экспорта: {str(e)}")
 
+def _parse_export_request(request: dict):
+    """Параметры выгрузки из тела запроса: (brands, columns, include_images, format)"""
+    selected_brands = request.get('brands', [])
+    selected_columns = request.get('columns', [])
+    include_images = request.get('include_images', False)
+    export_format = (request.get('format') or 'xlsx').lower()
+    
+    if not selected_brands:
+        raise HTTPException(status_code=400, detail="Необходимо выбрать хотя бы один бренд")
+    if not selected_columns:
+        raise HTTPException(status_code=400, detail="Необходимо выбрать хотя бы одну колонку")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неподдерживаемый формат выгрузки: {export_format}. Доступны: {', '.join(EXPORT_FORMATS)}"
+        )
+    return selected_brands, selected_columns, include_images, export_format
+
+@router.post("/products/export-jobs")
+async def create_export_job(
+    request: dict,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Постановка выгрузки в очередь (те же параметры, что у /products/export).
+    Прогресс: GET /products/export-jobs/{job_id} или SSE .../events, файл — .../download.
+    """
+    selected_brands, selected_columns, include_images, export_format = _parse_export_request(request)
+    try:
+        if not await export_service.has_products(db, selected_brands):
+            raise HTTPException(status_code=404, detail="Товары не найдены")
+        
+        job = await export_job_manager.submit(db, current_user.id, {
+            "brands": selected_brands,
+            "columns": selected_columns,
+            "include_images": include_images,
+            "format": export_format
+        })
+        return export_job_manager.to_dict(job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка создания задачи выгрузки: {str(e)}")
+
+async def _get_export_job(db: AsyncSession, job_id: str, current_user: User):
+    """Задача выгрузки, видимая пользователю: своя или любая для админа"""
+    job = await export_job_manager.get(db, job_id)
+    if not job or (job.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Задача выгрузки не найдена")
+    return job
+
+@router.get("/products/export-jobs/{job_id}")
+async def get_export_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Состояние задачи выгрузки: статус, записано строк, скачано изображений"""
+    job = await _get_export_job(db, job_id, current_user)
+    return export_job_manager.to_dict(job)
+
+@router.get("/products/export-jobs/{job_id}/events")
+async def export_job_events(
+    job_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Прогресс задачи выгрузки через Server-Sent Events до ее завершения"""
+    await _get_export_job(db, job_id, current_user)
+    
+    async def event_stream():
+        async for state in export_job_manager.events(job_id):
+            yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/products/export-jobs/{job_id}/download")
+async def download_export_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Скачивание готового файла выгрузки (с диска или redirect на S3)"""
+    job = await _get_export_job(db, job_id, current_user)
+    if job.status != "done" or not job.location:
+        raise HTTPException(status_code=409, detail=f"Выгрузка еще не готова (статус: {job.status})")
+    
+    if job.storage == "s3":
+        return RedirectResponse(s3_service.build_download_url(job.location, job.file_name))
+    if not os.path.exists(job.location):
+        raise HTTPException(status_code=410, detail="Файл выгрузки удален")
+    return FileResponse(job.location, filename=job.file_name)
+
 @router.post("/restore-database")
 async def restore_database(current_user: User = Depends(require_admin)):
     """Восстановление базы данных из последнего бэкапа (только для админа)"""
     try:
         success = await backup_service.restore_backup()
         if success:
+            product_count_cache.invalidate()
+            await product_detail_cache.invalidate()
+            attribute_dictionary.invalidate()
+            catalog_version.bump()
             return {"message": "База данных успешно восстановлена из бэкапа"}
         else:
             raise HTTPException(status_code=500, detail="Ошибка восстановления базы данных")
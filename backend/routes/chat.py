@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, select
-from models import get_db, User, ChatMessage
+from models import get_db, get_read_db, User, ChatMessage
 from services.ai_service import ai_service
 from services.backup_service import backup_service
+from services.count_cache import product_count_cache
+from services.product_cache import product_detail_cache
+from services.catalog_version import catalog_version
+from services.attribute_dictionary import attribute_dictionary
+from services.product_bulk_service import duplicate_part_number
 from utils.auth_middleware import get_current_active_user
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
@@ -37,6 +42,7 @@ async def save_ai_message(user_id: int, db: AsyncSession, sql: Optional[str] = N
 async def process_query(
     chat_query: ChatQuery, 
     db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Обработка запроса на естественном языке"""
@@ -52,18 +58,24 @@ async def process_query(
         if not any(sql_upper.startswith(cmd) for cmd in allowed_commands):
             return ChatResponse(sql=sql, results=[], error="Недопустимый тип запроса")
 
-        result = await db.execute(text(sql))
-
         if sql_upper.startswith("SELECT"):
+            # Чтение — с реплики (если настроена), изменения — только в основную БД
+            result = await read_db.execute(text(sql))
             rows = result.fetchall()
             # Преобразование в dict
             results = []
             for row in rows:
                 results.append(dict(row._mapping))
         else:
+            result = await db.execute(text(sql))
             # Создание бэкапа перед изменением данных (кроме SELECT)
             await backup_service.create_backup()
             await db.commit()
+            product_count_cache.invalidate()
+            await product_detail_cache.invalidate()
+            attribute_dictionary.invalidate()
+            # Произвольный SQL мог изменить и товары, и настройки маппинга
+            catalog_version.bump()
             results = [{"message": "Запрос выполнен успешно"}]
 
         # Сохраняем в историю: ответ ИИ, вместе с результатами если они есть
@@ -74,11 +86,15 @@ async def process_query(
         return ChatResponse(sql=sql, results=results)
 
     except Exception as e:
+        # Транзакция после ошибки прервана — иначе история чата не сохранится
+        await db.rollback()
+        part_number = duplicate_part_number(e)
+        message = f"товар с артикулом {part_number} уже существует" if part_number is not None else str(e)
         try:
-            await save_ai_message(current_user.id, db, sql=sql, error=f"Ошибка выполнения: {str(e)}")
+            await save_ai_message(current_user.id, db, sql=sql, error=f"Ошибка выполнения: {message}")
         except Exception:
             pass
-        return ChatResponse(sql=sql, results=[], error=f"Ошибка выполнения: {str(e)}")
+        return ChatResponse(sql=sql, results=[], error=f"Ошибка выполнения: {message}")
 
 class ChatMessageIn(BaseModel):
     role: str  # 'user' | 'ai'
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
 from models import get_db, User
 from services.s3_service import s3_service
+from services.product_image_service import product_image_service
 from utils.auth_middleware import get_current_active_user
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
@@ -46,12 +47,16 @@ async def browse_images(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Просмотр папок и изображений в указанном пути"""
+    """Просмотр папок и изображений в указанном пути; для изображений — id товаров, которые их используют"""
     try:
         result = await s3_service.list_folder_contents(path)
+        images = result.get('images', [])
+        usage = await product_image_service.products_using(db, [img['id'] for img in images])
+        for img in images:
+            img['productIds'] = usage.get(img['id'], [])
         return BrowseResponse(
             folders=result.get('folders', []),
-            images=result.get('images', []),
+            images=images,
             currentPath=path
         )
     except Exception as e:
@@ -211,10 +216,14 @@ async def delete_image(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Удаление изображения"""
+    """Удаление изображения; в ответе — товары, которые на него ссылались"""
     try:
+        usage = await product_image_service.products_using(db, [delete_data.path])
         await s3_service.delete_image_by_path(delete_data.path)
-        return {"message": "Изображение удалено"}
+        return {
+            "message": "Изображение удалено",
+            "linkedProducts": usage.get(product_image_service.normalize_key(delete_data.path), [])
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка удаления изображения: {e}")
 
@@ -270,10 +279,14 @@ async def bulk_delete_items(
                 for p in image_paths:
                     failed_items.append({"path": p, "error": str(e)})
 
+        # Товары, ссылавшиеся на удаленные изображения (одна выборка по индексу s3_key)
+        linked = await product_image_service.products_using(db, image_paths)
+
         return {
             "message": f"Удалено {deleted_count} из {len(delete_data.paths)} элементов",
             "deleted": deleted_count,
-            "failed": failed_items
+            "failed": failed_items,
+            "linkedProducts": {'/' + key: ids for key, ids in linked.items()}
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка множественного удаления: {e}")
@@ -327,6 +340,36 @@ async def move_items(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка перемещения: {e}")
 
+@router.get("/usage")
+async def image_usage(
+    paths: List[str] = Query(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Товары, которые используют изображения (по путям в бакете)"""
+    usage = await product_image_service.products_using(db, paths)
+    return {
+        "usage": [
+            {"path": path, "productIds": usage.get(product_image_service.normalize_key(path), [])}
+            for path in paths
+        ]
+    }
+
+@router.get("/orphans")
+async def orphan_images(
+    path: str = "/",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Изображения папки, на которые не ссылается ни один товар"""
+    try:
+        result = await s3_service.list_folder_contents(path)
+        images = result.get('images', [])
+        unused = set(await product_image_service.unused_keys(db, [img['id'] for img in images]))
+        return {"images": [img for img in images if img['id'] in unused], "currentPath": path}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка поиска неиспользуемых изображений: {e}")
+
 @router.get("/search")
 async def search_images(
     query: str = "",
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
 from models import ColumnMappingSetting, get_db
+from services.catalog_version import catalog_version
 from pydantic import BaseModel
 from typing import List, Dict, Any
 import json
@@ -25,7 +26,11 @@ class MappingSettingResponse(BaseModel):
 
 router = APIRouter()
 
-@router.get("/mapping-settings", response_model=List[MappingSettingResponse])
+@router.get(
+    "/mapping-settings",
+    response_model=List[MappingSettingResponse],
+    dependencies=[Depends(catalog_version.dependency("mapping"))]
+)
 async def get_mapping_settings(db: AsyncSession = Depends(get_db)):
     """Получить все настройки маппинга"""
     try:
@@ -75,6 +80,7 @@ async def create_mapping_setting(
         
         db.add(new_setting)
         await db.commit()
+        catalog_version.bump("mapping")
         await db.refresh(new_setting)
         
         return MappingSettingResponse(
@@ -115,6 +121,8 @@ async def update_mapping_setting(
         )
         
         await db.commit()
+        
+        catalog_version.bump("mapping")
         await db.refresh(setting)
         
         return MappingSettingResponse(
@@ -152,6 +160,8 @@ async def delete_mapping_setting(
         
         await db.commit()
         
+        catalog_version.bump("mapping")
+        
         return {"message": "Настройка успешно удалена"}
         
     except HTTPException:
@@ -254,6 +264,8 @@ async def bulk_create_default_settings(db: AsyncSession = Depends(get_db)):
         
         await db.commit()
         
+        catalog_version.bump("mapping")
+        
         return {
             "message": f"Создано {created_count} настроек по умолчанию",
             "created_count": created_count
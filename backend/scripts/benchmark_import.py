@@ -0,0 +1,102 @@
+"""
+Сравнение способов записи импорта Excel на текущей базе (DATABASE_URL).
+
+    cd backend && python -m scripts.benchmark_import --rows 100000
+
+Для каждого способа в отдельной транзакции, которая в конце откатывается:
+1) вставка rows новых товаров, 2) повтор того же файла с измененной шириной
+(обновление всех товаров). Способы:
+- orm    — прежняя запись через ORM: поиск существующих по 1000 артикулов,
+           setattr/db.add на каждую строку, flush пачки;
+- upsert — ProductBulkService.upsert_many (INSERT ... ON CONFLICT на пачку);
+- copy   — COPY во временную таблицу и одно слияние (merge_staging).
+В синтетических строках нет полей справочников (brand, color, ...): откат
+транзакции не должен оставлять в кеше справочников id несуществующих значений.
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, Iterator, List
+import pandas as pd
+from sqlalchemy import select
+from models import Product, async_session
+from services.excel_processor import excel_processor
+from services.product_import import product_import_service
+
+COLUMNS = ['part_number', 'part_name', 'manufacturer_name', 'size', 'width', 'height', 'year']
+
+
+def synthetic_chunks(rows: int, chunk_size: int, width: float) -> Iterator[pd.DataFrame]:
+    """Пачки строк как из ExcelSheetStream: объектные колонки, названия — поля товара"""
+    for start in range(0, rows, chunk_size):
+        stop = min(start + chunk_size, rows)
+        yield pd.DataFrame(
+            [
+                [f"BENCH-{i:08d}", f"Модель {i}", "Benchmark", f"{50 + i % 10}-{18 + i % 5}", width, 40 + i % 7, 2000 + i % 25]
+                for i in range(start, stop)
+            ],
+            columns=COLUMNS,
+            dtype=object,
+        )
+
+
+async def orm_write(db, valid_records: List[Dict[str, Any]]) -> None:
+    """Прежний путь записи (до INSERT ... ON CONFLICT) — для сравнения"""
+    by_part_number = {str(record['part_number']).strip(): record for record in valid_records}
+    existing = {}
+    part_numbers = list(by_part_number)
+    for i in range(0, len(part_numbers), 1000):
+        result = await db.execute(select(Product).where(Product.part_number.in_(part_numbers[i:i + 1000])))
+        for product in result.scalars().all():
+            existing[product.part_number] = product
+    for part_number, record in by_part_number.items():
+        product = existing.get(part_number)
+        if product:
+            for key, value in record.items():
+                setattr(product, key, value)
+        else:
+            db.add(Product(**record))
+    await db.flush()
+    db.expunge_all()
+
+
+async def run_orm(db, rows: int, chunk_size: int, width: float) -> None:
+    mapping = {column: column for column in COLUMNS}
+    for chunk in synthetic_chunks(rows, chunk_size, width):
+        df, _ = excel_processor.check_frame(product_import_service.mapped_frame(chunk, mapping))
+        records, _ = product_import_service.frame_records(df)
+        await orm_write(db, records)
+
+
+async def benchmark(strategy: str, rows: int, chunk_size: int) -> None:
+    mapping = {column: column for column in COLUMNS}
+    async with async_session() as db:
+        try:
+            for label, width in (("вставка", 50.0), ("обновление", 51.0)):
+                started = time.perf_counter()
+                if strategy == 'orm':
+                    await run_orm(db, rows, chunk_size, width)
+                    counts = ""
+                else:
+                    result = await product_import_service.run(
+                        db, synthetic_chunks(rows, chunk_size, width), mapping, strategy
+                    )
+                    counts = f" (inserted {result['inserted']}, updated {result['updated']}, unchanged {result['unchanged']})"
+                elapsed = time.perf_counter() - started
+                print(f"{strategy:>6} {label:>10}: {elapsed:8.2f} с, {rows / elapsed:10.0f} строк/с{counts}")
+        finally:
+            await db.rollback()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк записи импорта Excel (изменения откатываются)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=product_import_service.chunk_size)
+    parser.add_argument("--strategies", default="orm,upsert,copy")
+    args = parser.parse_args()
+    for strategy in args.strategies.split(","):
+        await benchmark(strategy.strip(), args.rows, args.chunk_size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
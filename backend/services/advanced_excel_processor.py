@@ -63,11 +63,10 @@ class AdvancedExcelProcessor:
             'empty_rows': []
         }
         
-        # Находим пустые строки
-        for idx in range(header_row + 1, len(df)):
-            row = df.iloc[idx]
-            if row.isna().all() or (row.astype(str) == '').all():
-                structure_info['empty_rows'].append(idx)
+        # Находим пустые строки (маской по всем строкам сразу, без цикла по df.iloc)
+        data = df.iloc[header_row + 1:]
+        empty = data.isna().all(axis=1) | (data.astype(str) == '').all(axis=1)
+        structure_info['empty_rows'] = [header_row + 1 + int(pos) for pos in np.flatnonzero(empty.to_numpy())]
         
         return structure_info
     
@@ -30,6 +30,15 @@ DB_SCHEMA = """
 - age (VARCHAR) - возрастная группа
 - shape (VARCHAR) - форма оправы (круглые, квадратные, авиаторы и т.д.)
 - year (INTEGER) - год выпуска модели
+- brand_id, color_id, type_id, gender_id, shape_id (INTEGER) - ссылки на справочники product_brands, product_colors, product_types, product_genders, product_shapes (id, value, normalized); заполняются автоматически по строковым полям, изменяй строковые поля
+- change_seq (BIGINT) - служебный номер последнего изменения строки, заполняется автоматически, не изменяй его
+- search_vector (TSVECTOR) - служебная колонка полнотекстового поиска, не выбирай её в SELECT (перечисляй нужные колонки вместо SELECT *)
+
+Таблица product_images (изображения товаров, заполняется автоматически из products.images — не изменяй её напрямую):
+- product_id (INTEGER) - ссылка на products.id
+- position (INTEGER) - порядковый номер изображения в products.images, с 0
+- url (TEXT) - ссылка на изображение
+- s3_key (TEXT) - ключ объекта в S3 (например, products/abc.jpg)
 
 ВАЖНО: Это база данных ТОЛЬКО для очков. Категории представляют бренды очков.
 """
@@ -0,0 +1,143 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ATTR_WHITESPACE_PATTERN, DICTIONARY_MODELS, Product, async_session
+
+_WHITESPACE = re.compile(ATTR_WHITESPACE_PATTERN)
+
+
+class AttributeDictionary:
+    """
+    Кеш справочников brand/color/type/gender/shape в памяти процесса.
+    Значения справочников не удаляются и не меняют id, поэтому кеш только
+    пополняется: промах — это новое значение, которое один раз добавляется в БД.
+    canonical/normalize должны совпадать с SQL-функциями product_attr_canonical/product_attr_key.
+    """
+
+    def __init__(self):
+        self.fields = list(DICTIONARY_MODELS)
+        # поле → ключ сравнения → (id, каноническое значение)
+        self._by_key: Dict[str, Dict[str, Tuple[int, str]]] = {field: {} for field in self.fields}
+        # поле → id → каноническое значение
+        self._by_id: Dict[str, Dict[int, str]] = {field: {} for field in self.fields}
+        self._loaded = False
+
+    @staticmethod
+    def canonical(value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        # То же выражение, что в product_attr_canonical (ATTR_WHITESPACE_PATTERN)
+        text = _WHITESPACE.sub(" ", str(value)).strip(" ")
+        return text or None
+
+    @classmethod
+    def normalize(cls, value: Any) -> Optional[str]:
+        text = cls.canonical(value)
+        return text.lower() if text else None
+
+    @classmethod
+    def condition(cls, field: str, value: str):
+        """
+        Равенство по id справочника вместо сравнения строк: id значения находится
+        одним подзапросом по уникальному ключу, дальше — индекс (<поле>_id, id).
+        """
+        model = DICTIONARY_MODELS[field]
+        value_id = (
+            select(model.id)
+            .where(model.normalized == cls.normalize(value))
+            .scalar_subquery()
+        )
+        return getattr(Product, f"{field}_id") == value_id
+
+    @classmethod
+    def in_condition(cls, field: str, values: Iterable[str]):
+        """
+        IN по id справочника: значения сопоставляются по ключу без учета регистра.
+        Используется везде, где выбираются товары по значениям справочника
+        (фильтры списка, экспорт, изображения), чтобы выборка совпадала с фасетами.
+        """
+        model = DICTIONARY_MODELS[field]
+        keys = {cls.normalize(v) for v in values} - {None}
+        value_ids = select(model.id).where(model.normalized.in_(keys))
+        return getattr(Product, f"{field}_id").in_(value_ids)
+
+    def _remember(self, field: str, rows: Iterable[Tuple[int, str, str]]) -> None:
+        for value_id, value, normalized in rows:
+            self._by_key[field][normalized] = (value_id, value)
+            self._by_id[field][value_id] = value
+
+    def invalidate(self) -> None:
+        """Сброс кеша (после восстановления БД из бэкапа или произвольного SQL)"""
+        for field in self.fields:
+            self._by_key[field].clear()
+            self._by_id[field].clear()
+        self._loaded = False
+
+    async def _load(self, db: AsyncSession) -> None:
+        for field, model in DICTIONARY_MODELS.items():
+            result = await db.execute(select(model.id, model.value, model.normalized))
+            self._remember(field, result.all())
+        self._loaded = True
+
+    async def _ensure(self, field: str, values: Dict[str, str]) -> None:
+        """
+        Добавляет недостающие значения (ключ → каноническое) в справочник.
+        Пишет в отдельной сессии с немедленным commit: id попадают в кеш только
+        после того, как гарантированно существуют в БД, даже если импорт откатится.
+        """
+        model = DICTIONARY_MODELS[field]
+        async with async_session() as session:
+            await session.execute(
+                insert(model)
+                .values([{"value": value, "normalized": key} for key, value in values.items()])
+                .on_conflict_do_nothing(index_elements=["normalized"])
+            )
+            await session.commit()
+            result = await session.execute(
+                select(model.id, model.value, model.normalized).where(model.normalized.in_(list(values)))
+            )
+            self._remember(field, result.all())
+
+    async def resolve_records(self, db: AsyncSession, records: List[Dict[str, Any]]) -> None:
+        """
+        Для записей импорта подставляет <поле>_id (строки значений не меняются).
+        Один запрос на поле только для значений, которых еще нет в кеше.
+        """
+        if not self._loaded:
+            await self._load(db)
+        for field in self.fields:
+            missing: Dict[str, str] = {}
+            for record in records:
+                key = self.normalize(record.get(field))
+                if key and key not in self._by_key[field]:
+                    missing.setdefault(key, self.canonical(record[field]))
+            if missing:
+                await self._ensure(field, missing)
+
+            for record in records:
+                if field not in record:
+                    continue
+                key = self.normalize(record[field])
+                if key is None:
+                    record[f"{field}_id"] = None
+                    continue
+                # Строка остается как в файле, как и в триггере products_dictionary_sync
+                record[f"{field}_id"] = self._by_key[field][key][0]
+
+    async def values_by_id(self, db: AsyncSession, field: str, ids: Iterable[int]) -> Dict[int, str]:
+        """Канонические значения по id (для фасетов, сгруппированных по id)"""
+        wanted = {value_id for value_id in ids if value_id is not None}
+        missing = [value_id for value_id in wanted if value_id not in self._by_id[field]]
+        if missing:
+            model = DICTIONARY_MODELS[field]
+            result = await db.execute(
+                select(model.id, model.value, model.normalized).where(model.id.in_(missing))
+            )
+            self._remember(field, result.all())
+        return {value_id: self._by_id[field][value_id] for value_id in wanted if value_id in self._by_id[field]}
+
+
+# Глобальный экземпляр
+attribute_dictionary = AttributeDictionary()
@@ -0,0 +1,79 @@
+import time
+import uuid
+from email.utils import formatdate
+from typing import Dict, Optional
+from fastapi import HTTPException, Request, Response
+from models import mark_write
+
+
+def _opaque_tag(tag: str) -> str:
+    """Тег без префикса слабого ETag: W/"x" и "x" при слабом сравнении равны"""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+class CatalogVersion:
+    """
+    Счетчики версий каталога для условных GET (ETag / If-None-Match).
+    Область "products" увеличивается при любой записи в товары, "mapping" — при
+    изменении настроек маппинга. Счетчики живут в памяти процесса; метка запуска
+    в ETag делает теги прошлого процесса недействительными после рестарта.
+    """
+
+    SCOPES = ("products", "mapping")
+
+    def __init__(self):
+        self._boot = uuid.uuid4().hex[:8]
+        now = time.time()
+        self._versions: Dict[str, int] = {scope: 0 for scope in self.SCOPES}
+        self._modified: Dict[str, float] = {scope: now for scope in self.SCOPES}
+
+    def bump(self, *scopes: str) -> None:
+        """Отмечает изменение данных; без аргументов — все области"""
+        # Следующие чтения пойдут с основной БД, пока реплика не догонит запись
+        mark_write()
+        now = time.time()
+        for scope in scopes or self.SCOPES:
+            self._versions[scope] += 1
+            self._modified[scope] = now
+
+    def etag(self, scope: str) -> str:
+        return f'W/"{self._boot}-{scope}-{self._versions[scope]}"'
+
+    def last_modified(self, scope: str) -> str:
+        return formatdate(self._modified[scope], usegmt=True)
+
+    def headers(self, scope: str) -> Dict[str, str]:
+        return {
+            "ETag": self.etag(scope),
+            "Last-Modified": self.last_modified(scope),
+            # Браузер хранит ответ, но перед использованием всегда перепроверяет его
+            "Cache-Control": "no-cache",
+        }
+
+    def matches(self, scope: str, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        current = _opaque_tag(self.etag(scope))
+        return any(_opaque_tag(tag) == current for tag in if_none_match.split(","))
+
+    def dependency(self, scope: str):
+        """
+        Зависимость FastAPI для GET-эндпоинтов каталога: при совпадении If-None-Match
+        отвечает 304 до обращения к БД, иначе добавляет ETag/Last-Modified в ответ.
+        Возвращает заголовки — для эндпоинтов, которые сами собирают Response.
+        """
+        async def check_not_modified(request: Request, response: Response) -> Dict[str, str]:
+            headers = self.headers(scope)
+            if self.matches(scope, request.headers.get("if-none-match")):
+                raise HTTPException(status_code=304, headers=headers)
+            response.headers.update(headers)
+            return headers
+
+        return check_not_modified
+
+
+# Глобальный экземпляр
+catalog_version = CatalogVersion()
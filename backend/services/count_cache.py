@@ -0,0 +1,62 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class CountCache:
+    """
+    Кеш total_count для списка товаров.
+    Ключ — нормализованный набор фильтров, значение — точное количество строк.
+    Любая запись в products должна вызывать invalidate(); TTL ограничивает
+    устаревание, если запись прошла мимо приложения (например, восстановление из бэкапа
+    в другом процессе).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple, Tuple[float, int]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(filters: Dict[str, Any]) -> Tuple:
+        """Нормализует фильтры: пустые значения отбрасываются, порядок не важен"""
+        normalized = []
+        for name, value in filters.items():
+            if value is None or value == "":
+                continue
+            if name == "search":
+                # ilike регистронезависим — разный регистр дает тот же результат
+                value = str(value).lower()
+            elif isinstance(value, (list, tuple, set)):
+                value = tuple(sorted(str(v) for v in value))
+            normalized.append((name, value))
+        return tuple(sorted(normalized))
+
+    def get(self, key: Tuple) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, count = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return count
+
+    def set(self, key: Tuple, count: int) -> None:
+        self._entries[key] = (time.monotonic(), count)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Сбрасывает все закешированные количества (вызывается после записи в products)"""
+        self._entries.clear()
+
+
+# Глобальный экземпляр
+product_count_cache = CountCache(
+    max_entries=int(os.getenv("COUNT_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("COUNT_CACHE_TTL", "60")),
+)
@@ -1,8 +1,23 @@
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Union
 from io import BytesIO
 
+# Запись целого числа в строке (как принимает int())
+INTEGER_PATTERN = r'\s*[+-]?\d+\s*'
+# Признаки строк, которые Python считает числом, а pandas нет
+PYTHON_NUMBER_HINT = r'[_nN]|[^\x00-\x7f]'
+# Диапазон колонки INTEGER в PostgreSQL (products.year)
+INTEGER_MIN, INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
 class ExcelProcessor:
+    # Текстовые поля товара (VARCHAR 255)
+    STRING_FIELDS = [
+        'manufacturer_name', 'part_number', 'part_name', 'category', 'type', 'size',
+        'color', 'brand', 'producer', 'gender', 'age', 'shape',
+    ]
+    MAX_STRING_LENGTH = 255
+
     def __init__(self):
         pass
 
@@ -27,40 +42,121 @@ class ExcelProcessor:
 
         return records
 
-    def validate_data(self, records: List[Dict[str, Any]]) -> List[str]:
-        """Валидация данных перед вставкой"""
-        errors = []
-        for i, record in enumerate(records):
-            row_num = i + 2  # +2 потому что заголовок + индекс
-
-            # Проверка width
-            if 'width' in record and record['width'] is not None:
-                try:
-                    float(record['width'])
-                except (ValueError, TypeError):
-                    errors.append(f"Строка {row_num}: width должен быть числом")
-
-            # Проверка height
-            if 'height' in record and record['height'] is not None:
-                try:
-                    float(record['height'])
-                except (ValueError, TypeError):
-                    errors.append(f"Строка {row_num}: height должен быть числом")
-
-            # Проверка year
-            if 'year' in record and record['year'] is not None:
-                try:
-                    int(record['year'])
-                except (ValueError, TypeError):
-                    errors.append(f"Строка {row_num}: year должен быть целым числом")
-
-            # Проверка размеров строк
-            for field in ['manufacturer_name', 'part_number', 'part_name', 'category', 'type', 'size', 'color', 'brand', 'producer', 'gender', 'age', 'shape']:
-                if field in record and record[field] is not None:
-                    if len(str(record[field])) > 255:
-                        errors.append(f"Строка {row_num}: {field} слишком длинный (макс 255 символов)")
-
-        return errors
+    @staticmethod
+    def _string_mask(series: pd.Series) -> np.ndarray:
+        """Ячейки со строками (числа и даты из openpyxl приходят своими типами)"""
+        if series.dtype == object:
+            return series.map(type).eq(str).to_numpy()
+        if pd.api.types.is_string_dtype(series.dtype):
+            return series.notna().to_numpy()
+        return np.zeros(len(series), dtype=bool)
+
+    def to_float(self, series: pd.Series) -> Tuple[pd.Series, np.ndarray]:
+        """
+        Колонка → float64 так же, как float() по каждой ячейке; второй результат —
+        маска непустых ячеек, которые не являются числом. Строки, не разобранные
+        pandas, но похожие на число для Python ('1_000' и т.п.), перепроверяются float().
+        """
+        present = series.notna().to_numpy()
+        values = pd.to_numeric(series, errors='coerce').astype('float64').to_numpy(copy=True)
+        invalid = present & np.isnan(values)
+        self._python_fallback(series, values, invalid, float)
+        return pd.Series(values, index=series.index), invalid
+
+    def to_int(self, series: pd.Series) -> Tuple[pd.Series, np.ndarray]:
+        """
+        Колонка → Int64 так же, как int() по каждой ячейке: числа отбрасывают дробную
+        часть, строки должны быть записью целого числа ('2020', но не '2020.5').
+        Значения вне диапазона INTEGER базы (3000000000, 1e300) считаются ошибкой.
+        """
+        present = series.notna().to_numpy()
+        values = np.trunc(pd.to_numeric(series, errors='coerce').astype('float64').to_numpy(copy=True))
+        is_str = self._string_mask(series)
+        if is_str.any():
+            # Регулярное выражение по строкам — в pyarrow, без цикла Python по ячейкам
+            integer_literal = (
+                series[is_str].astype('string[pyarrow]').str.fullmatch(INTEGER_PATTERN)
+                .to_numpy(dtype=bool, na_value=False)
+            )
+            values[np.flatnonzero(is_str)[~integer_literal]] = np.nan
+        invalid = present & ~np.isfinite(values)
+        self._python_fallback(series, values, invalid, int)
+        # Целое вне INTEGER не записать в БД — ошибка значения, а не всего импорта
+        invalid |= (values < INTEGER_MIN) | (values > INTEGER_MAX)
+        values[invalid] = np.nan
+        return pd.Series(values, index=series.index).astype('Int64'), invalid
+
+    def _python_fallback(self, series: pd.Series, values: np.ndarray, invalid: np.ndarray, convert) -> None:
+        """
+        Строки, которые float()/int() принимают, а pandas нет ('1_000', 'nan', цифры
+        не-ASCII), дочитываются по одной. Проверяются только уже отбракованные ячейки.
+        """
+        candidates = np.flatnonzero(invalid & self._string_mask(series))
+        if not len(candidates):
+            return
+        hint = (
+            series.iloc[candidates].astype('string[pyarrow]').str.contains(PYTHON_NUMBER_HINT)
+            .to_numpy(dtype=bool, na_value=False)
+        )
+        raw = series.to_numpy()
+        for i in candidates[hint]:
+            try:
+                values[i] = convert(raw[i])
+                invalid[i] = False
+            except (ValueError, TypeError, OverflowError):
+                pass
+
+    def check_frame(self, df: pd.DataFrame, start_row: int = 2) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        Проверка и приведение типов по колонкам целиком (без обхода ячеек в Python).
+        Возвращает копию таблицы, где width/height — float, year — Int64 (не числа → пусто),
+        текстовые поля — строки до 255 символов (пустые → пусто), и сообщения об ошибках:
+        упорядочены по строкам, внутри строки — width, height, year, строковые поля.
+        start_row — номер первой строки таблицы в сообщениях.
+        """
+        df = df.copy()
+        checks = []  # (маска ошибок, текст сообщения)
+        for field in ('width', 'height'):
+            if field in df.columns:
+                values, invalid = self.to_float(df[field])
+                # inf/nan не записываются: в JSON для пачечной вставки их нет
+                df[field] = values.where(np.isfinite(values))
+                checks.append((invalid, f"{field} должен быть числом"))
+        if 'year' in df.columns:
+            df['year'], invalid = self.to_int(df['year'])
+            checks.append((invalid, "year должен быть целым числом"))
+
+        # Проверка размеров строк: длинные обрезаются, пустые → None
+        limit = self.MAX_STRING_LENGTH
+        for field in self.STRING_FIELDS:
+            if field not in df.columns:
+                continue
+            column = df[field]
+            present = column.notna()
+            text = column[present].astype(str)
+            too_long = text.str.len() > limit
+            checks.append((too_long.reindex(df.index, fill_value=False).to_numpy(), f"{field} слишком длинный (макс {limit} символов)"))
+            text = text.where(~too_long, text.str.slice(0, limit))
+            # Строка из одних пробелов длиннее лимита только обрезается, как и раньше
+            blank = ~too_long & text.str.strip().eq('')
+            df[field] = text.where(~blank).reindex(df.index).astype(object)
+
+        rows = [np.flatnonzero(mask) for mask, _ in checks]
+        if not any(len(r) for r in rows):
+            return df, []
+        row_index = np.concatenate(rows)
+        check_index = np.concatenate([np.full(len(r), k) for k, r in enumerate(rows)])
+        order = np.lexsort((check_index, row_index))
+        errors = [
+            f"Строка {row_index[i] + start_row}: {checks[check_index[i]][1]}"
+            for i in order
+        ]
+        return df, errors
+
+    def validate_data(self, data: Union[List[Dict[str, Any]], pd.DataFrame], start_row: int = 2) -> List[str]:
+        """Валидация данных перед вставкой; start_row — номер первой записи в сообщениях"""
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame.from_records(data)
+        return self.check_frame(df, start_row)[1]
 
 # Глобальный экземпляр
 excel_processor = ExcelProcessor()
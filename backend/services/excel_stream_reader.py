@@ -0,0 +1,389 @@
+import logging
+import os
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+from xml.etree import ElementTree
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.datetime import from_excel
+from services.advanced_excel_processor import advanced_excel_processor
+
+logger = logging.getLogger(__name__)
+
+# Строки, которые pd.read_excel по умолчанию читает как пустую ячейку (na_values)
+NA_STRINGS = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+
+XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+# Сколько строк после заголовка просматривать в поисках примеров данных и непустых колонок
+PREVIEW_SCAN_ROWS = 1000
+
+
+class ExcelSheetStream:
+    """
+    Потоковое чтение первого листа: строки заголовка определяются по первым строкам,
+    данные отдаются пачками DataFrame по chunk_size строк (пустые строки отброшены).
+    Статистика структуры (total_rows, empty_rows, пустые колонки) накапливается
+    по мере чтения и полна после того, как chunks() дочитан до конца.
+    """
+
+    def __init__(
+        self,
+        rows: Iterator[List[Any]],
+        width: Optional[int],
+        chunk_size: int,
+        rows_to_check: int,
+        total_rows_hint: Optional[int] = None,
+    ):
+        self._rows = rows
+        self.chunk_size = chunk_size
+        # Число строк из размера листа в файле (без чтения строк) — для предпросмотра
+        self.total_rows_hint = total_rows_hint
+
+        # Окно для определения заголовка — те же правила, что у process_excel_advanced
+        self._window: List[List[Any]] = []
+        for row in rows:
+            self._window.append(row)
+            if len(self._window) >= rows_to_check:
+                break
+        self.width = width or max((len(row) for row in self._window), default=0)
+        window_df = self._frame([self._pad(row) for row in self._window])
+        self.header_row = advanced_excel_processor.detect_header_row(window_df, rows_to_check) if len(window_df) else 0
+        headers = window_df.iloc[self.header_row].astype(str) if len(window_df) else []
+        self.columns: List[str] = [str(col).strip() for col in headers]
+
+        self.total_rows = 0            # Строк листа до последней непустой (как у read_excel)
+        self.empty_rows: List[int] = []
+        self._non_empty = np.zeros(self.width, dtype=bool)
+        self._header_width = 0         # Ширина непустой части строк до заголовка включительно
+        self._truncated_rows = 0
+
+    def _pad(self, row: List[Any]) -> List[Any]:
+        if len(row) > self.width:
+            self._truncated_rows += 1
+            return row[:self.width]
+        return row + [None] * (self.width - len(row))
+
+    def _frame(self, rows: List[List[Any]]) -> pd.DataFrame:
+        df = pd.DataFrame(rows, columns=range(self.width), dtype=object)
+        # Пустые ячейки — NaN, как в DataFrame из read_excel
+        return df.where(df.notna(), np.nan)
+
+    def _all_rows(self) -> Iterator[List[Any]]:
+        yield from self._window
+        yield from self._rows
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        """Пачки строк данных (после заголовка) с названиями колонок из строки заголовка"""
+        index = 0
+        pending_empty: List[int] = []
+        buffer: List[List[Any]] = []
+        for row in self._all_rows():
+            row_index = index
+            index += 1
+            if row_index <= self.header_row:
+                used = [i for i, value in enumerate(row[:self.width]) if value is not None]
+                if used:
+                    self.total_rows = index
+                    self._header_width = max(self._header_width, used[-1] + 1)
+                continue
+            if all(value is None for value in row):
+                # Пустые строки в конце листа read_excel отбрасывает — учитываем только
+                # те, после которых есть данные
+                pending_empty.append(row_index)
+                continue
+            self.empty_rows.extend(pending_empty)
+            pending_empty = []
+            self.total_rows = index
+            buffer.append(self._pad(row))
+            if len(buffer) >= self.chunk_size:
+                yield self._chunk(buffer)
+                buffer = []
+        if buffer:
+            yield self._chunk(buffer)
+        if self._truncated_rows:
+            logger.warning(
+                "%s строк шире заявленного размера листа (%s колонок), лишние ячейки отброшены",
+                self._truncated_rows, self.width,
+            )
+
+    def preview(self, sample_rows: int = 3, max_scan_rows: int = 1000) -> Dict[str, Any]:
+        """
+        Быстрый предпросмотр: заголовок и первые sample_rows строк данных без чтения
+        остального листа. Колонки — по тому же правилу, что и при полном разборе
+        (available_positions): есть данные хотя бы в одной строке, но просматриваются
+        только первые max_scan_rows строк после заголовка. Поэтому колонки предпросмотра
+        всегда есть и в полном разборе. total_rows берется из размера листа, пустые
+        строки не ищутся (complete=False).
+        """
+        samples: List[List[Any]] = []
+        non_empty = np.zeros(self.width, dtype=bool)
+        for row_index, row in enumerate(self._all_rows()):
+            if row_index > self.header_row + max_scan_rows:
+                break
+            if row_index <= self.header_row:
+                continue
+            used = [i for i, value in enumerate(row[:self.width]) if value is not None]
+            if used:
+                non_empty[used] = True
+                if len(samples) < sample_rows:
+                    samples.append(self._pad(row))
+
+        sample_df = self._frame(samples)
+        positions = [i for i in range(self.width) if non_empty[i]]
+        sample_df = sample_df.iloc[:, positions]
+        sample_df.columns = [self.columns[i] for i in positions]
+        return {
+            'available_columns': [self.columns[i] for i in positions],
+            'structure_info': {
+                'header_row': self.header_row,
+                'data_start_row': self.header_row + 1,
+                'total_rows': self.total_rows_hint if self.total_rows_hint is not None else len(self._window),
+                'total_columns': self.width,
+                'merged_cells': [],
+                'empty_rows': [],
+                'complete': False,
+            },
+            'sample_data': sample_df.where(sample_df.notna(), None).to_dict('records'),
+        }
+
+    def close(self) -> None:
+        """Закрывает книгу, если строки дочитаны не до конца"""
+        self._rows.close()
+
+    def _chunk(self, buffer: List[List[Any]]) -> pd.DataFrame:
+        df = self._frame(buffer)
+        self._non_empty |= df.notna().any(axis=0).to_numpy()
+        df.columns = self.columns
+        return df
+
+    @property
+    def available_positions(self) -> List[int]:
+        """Позиции непустых колонок (полностью пустые отбрасываются, как в clean_and_prepare_dataframe)"""
+        return [i for i in range(self.width) if self._non_empty[i]]
+
+    @property
+    def available_columns(self) -> List[str]:
+        return [self.columns[i] for i in self.available_positions]
+
+    def structure_info(self) -> Dict[str, Any]:
+        # Пустые колонки в конце листа read_excel отбрасывает
+        data_width = int(np.flatnonzero(self._non_empty)[-1]) + 1 if self._non_empty.any() else 0
+        return {
+            'header_row': self.header_row,
+            'data_start_row': self.header_row + 1,
+            'total_rows': self.total_rows,
+            'total_columns': max(self._header_width, data_width),
+            'merged_cells': [],
+            'empty_rows': self.empty_rows,
+            'complete': True,
+        }
+
+
+class ExcelStreamReader:
+    """
+    Чтение Excel без загрузки листа целиком: .xlsx — через openpyxl в режиме read_only
+    (строки разбираются из XML по одной), .xls — через pandas (формат ограничен 65536 строками).
+    Значения ячеек приводятся так же, как в pd.read_excel: целые float → int,
+    строки из списка NA pandas ('', 'n/a', 'NULL', ...) → пусто.
+    """
+
+    def __init__(self, chunk_size: int = 5000, rows_to_check: int = 10):
+        self.chunk_size = chunk_size
+        self.rows_to_check = rows_to_check
+
+    @staticmethod
+    def _convert_cell(value: Any) -> Any:
+        if value is None:
+            return None
+        if isinstance(value, float):
+            if value != value:
+                return None
+            return int(value) if value.is_integer() else value
+        if isinstance(value, str) and value in NA_STRINGS:
+            return None
+        return value
+
+    @staticmethod
+    def _source(content: Union[bytes, str, Path]):
+        # Файл на диске (сессия загрузки) читается по пути, без копии в памяти
+        return BytesIO(content) if isinstance(content, bytes) else content
+
+    def _xlsx_rows(self, content: Union[bytes, str, Path]):
+        workbook = load_workbook(self._source(content), read_only=True, data_only=True)
+        sheet = workbook.worksheets[0]
+        width = sheet.max_column if sheet.max_column and sheet.max_column > 1 else None
+        total_rows = sheet.max_row if sheet.max_row and sheet.max_row > 1 else None
+
+        def rows() -> Iterator[List[Any]]:
+            try:
+                for row in sheet.iter_rows(values_only=True):
+                    yield [self._convert_cell(value) for value in row]
+            finally:
+                workbook.close()
+
+        return rows(), width, total_rows
+
+    @staticmethod
+    def _column_index(ref: str) -> int:
+        # "BC12" → 54 (с нуля)
+        index = 0
+        for char in ref:
+            if not char.isalpha():
+                break
+            index = index * 26 + ord(char.upper()) - 64
+        return index - 1
+
+    def _xlsx_head_rows(self, content: Union[bytes, str, Path], max_rows: int):
+        """
+        Первые max_rows строк первого листа прямо из XML внутри zip. openpyxl при открытии
+        книги разбирает всю таблицу общих строк (секунды на больших файлах) — здесь
+        она читается только до наибольшего индекса, встреченного в этих строках.
+        """
+        with zipfile.ZipFile(self._source(content)) as archive:
+            names = set(archive.namelist())
+            workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+            first_sheet = workbook.find(f'{{{XLSX_NS}}}sheets/{{{XLSX_NS}}}sheet')
+            rel_id = first_sheet.get(f'{{{XLSX_REL_NS}}}id')
+            rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+            target = next(rel.get('Target') for rel in rels if rel.get('Id') == rel_id)
+            sheet_path = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+
+            # Стили: какие форматы ячеек — даты (числа в них хранятся днями от 1900 года)
+            date_styles: List[bool] = []
+            if 'xl/styles.xml' in names:
+                styles = ElementTree.fromstring(archive.read('xl/styles.xml'))
+                formats = {
+                    int(fmt.get('numFmtId')): fmt.get('formatCode')
+                    for fmt in styles.iter(f'{{{XLSX_NS}}}numFmt')
+                }
+                cell_xfs = styles.find(f'{{{XLSX_NS}}}cellXfs')
+                for xf in (cell_xfs if cell_xfs is not None else []):
+                    fmt_id = int(xf.get('numFmtId', 0))
+                    code = formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+                    date_styles.append(bool(code) and is_date_format(code))
+
+            rows: List[List[Any]] = []
+            shared_refs: List[tuple] = []   # (строка, колонка, индекс общей строки)
+            width = total_rows = None
+            with archive.open(sheet_path) as sheet:
+                for event, elem in ElementTree.iterparse(sheet, events=('end',)):
+                    tag = elem.tag.rsplit('}', 1)[-1]
+                    if tag == 'dimension':
+                        last = elem.get('ref', '').split(':')[-1]
+                        digits = ''.join(ch for ch in last if ch.isdigit())
+                        if ':' in elem.get('ref', '') and digits:
+                            width = self._column_index(last) + 1
+                            total_rows = int(digits)
+                    elif tag == 'row':
+                        # Пустые строки в XML пропускаются — восстанавливаем их по номеру
+                        number = int(elem.get('r', len(rows) + 1))
+                        while len(rows) < min(number - 1, max_rows):
+                            rows.append([])
+                        if len(rows) >= max_rows:
+                            break
+                        row: List[Any] = []
+                        for cell in elem.iter(f'{{{XLSX_NS}}}c'):
+                            ref = cell.get('r')
+                            column = self._column_index(ref) if ref else len(row)
+                            row.extend([None] * (column + 1 - len(row)))
+                            cell_type = cell.get('t', 'n')
+                            value_node = cell.find(f'{{{XLSX_NS}}}v')
+                            raw = value_node.text if value_node is not None else None
+                            if cell_type == 'inlineStr':
+                                value = ''.join(t.text or '' for t in cell.iter(f'{{{XLSX_NS}}}t'))
+                            elif raw is None:
+                                value = None
+                            elif cell_type == 's':
+                                shared_refs.append((len(rows), column, int(raw)))
+                                value = None
+                            elif cell_type in ('str', 'e'):
+                                value = raw
+                            elif cell_type == 'b':
+                                value = raw == '1'
+                            else:
+                                value = float(raw)
+                                style = int(cell.get('s', 0))
+                                if style < len(date_styles) and date_styles[style]:
+                                    value = from_excel(value)
+                            row[column] = value
+                        rows.append(row)
+                        elem.clear()
+                        if len(rows) >= max_rows:
+                            break
+
+            if shared_refs:
+                needed = max(index for _, _, index in shared_refs)
+                strings: List[str] = []
+                with archive.open('xl/sharedStrings.xml') as shared:
+                    for event, elem in ElementTree.iterparse(shared, events=('end',)):
+                        if elem.tag != f'{{{XLSX_NS}}}si':
+                            continue
+                        # Текст — все фрагменты <t>, кроме фонетических подсказок <rPh>
+                        phonetic = {id(t) for rph in elem.iter(f'{{{XLSX_NS}}}rPh') for t in rph.iter(f'{{{XLSX_NS}}}t')}
+                        strings.append(''.join(t.text or '' for t in elem.iter(f'{{{XLSX_NS}}}t') if id(t) not in phonetic))
+                        elem.clear()
+                        if len(strings) > needed:
+                            break
+                for row_index, column, index in shared_refs:
+                    rows[row_index][column] = strings[index]
+
+        converted = [[self._convert_cell(value) for value in row] for row in rows]
+        return iter(converted), width, total_rows
+
+    def _xls_rows(self, content: Union[bytes, str, Path]):
+        df = pd.read_excel(self._source(content), header=None)
+
+        def rows() -> Iterator[List[Any]]:
+            for values in df.itertuples(index=False, name=None):
+                yield [self._convert_cell(value) for value in values]
+
+        return rows(), df.shape[1], len(df)
+
+    def open(
+        self,
+        content: Union[bytes, str, Path],
+        filename: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+    ) -> ExcelSheetStream:
+        """content — содержимое файла или путь к нему; формат определяется по имени файла"""
+        try:
+            if filename and filename.lower().endswith('.xls'):
+                rows, width, total_rows = self._xls_rows(content)
+            else:
+                rows, width, total_rows = self._xlsx_rows(content)
+            return ExcelSheetStream(rows, width, chunk_size or self.chunk_size, self.rows_to_check, total_rows)
+        except Exception as e:
+            raise ValueError(f"Ошибка обработки Excel файла: {e}")
+
+    def preview(self, content: Union[bytes, str, Path], filename: Optional[str] = None, sample_rows: int = 3) -> Dict[str, Any]:
+        """Заголовок, колонки и примеры строк без разбора всего листа"""
+        if not (filename and filename.lower().endswith('.xls')):
+            try:
+                rows, width, total_rows = self._xlsx_head_rows(content, self.rows_to_check + PREVIEW_SCAN_ROWS)
+                return ExcelSheetStream(rows, width, self.chunk_size, self.rows_to_check, total_rows).preview(
+                    sample_rows, PREVIEW_SCAN_ROWS
+                )
+            except Exception as e:
+                # Нестандартная разметка (strict OOXML и т.п.) — читаем через openpyxl
+                logger.warning("Быстрый предпросмотр xlsx не удался, читаем через openpyxl: %s", e)
+        stream = self.open(content, filename)
+        try:
+            return stream.preview(sample_rows)
+        finally:
+            # Закрываем книгу, не дочитывая строки
+            stream.close()
+
+
+# Глобальный экземпляр
+excel_stream_reader = ExcelStreamReader(
+    chunk_size=int(os.getenv("EXCEL_CHUNK_ROWS", "5000")),
+)
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ExportJob, async_session
+from services.export_service import export_service, EXPORT_FORMATS
+from services.s3_service import s3_service
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class ExportJobManager:
+    """
+    Фоновые задачи выгрузки товаров.
+    Одновременно выполняется не более max_jobs задач, остальные ждут в очереди.
+    Сериализация строк и запись архива идут в отдельном пуле потоков, чтобы
+    крупные выгрузки не занимали event loop API. Прогресс обновляется в памяти
+    и периодически сохраняется в таблицу export_jobs.
+    """
+
+    def __init__(
+        self, max_jobs: int = 2, storage: str = "local", ttl_hours: int = 24, storage_dir: Optional[str] = None
+    ):
+        self.max_jobs = max_jobs
+        self.storage = storage
+        self.ttl = timedelta(hours=ttl_hours)
+        # Каталог файлов выгрузки (EXPORT_STORAGE_DIR), по умолчанию backend/exports
+        self.storage_dir = Path(storage_dir) if storage_dir else Path(__file__).parent.parent / "exports"
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Семафор создается лениво: в Python 3.9 он привязывается к loop при создании
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="export-job")
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Как часто сбрасывать прогресс в БД (секунды)
+        self.persist_interval = 2.0
+
+    def to_dict(self, job: ExportJob) -> Dict[str, Any]:
+        """Состояние задачи; для выполняемых в этом процессе — живой прогресс из памяти"""
+        data = {
+            "id": job.id,
+            "status": job.status,
+            "rows_written": job.rows_written,
+            "images_total": job.images_total,
+            "images_fetched": job.images_fetched,
+            "file_name": job.file_name,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+        live = self._progress.get(job.id)
+        if live:
+            data.update(live)
+        return data
+
+    async def submit(self, db: AsyncSession, user_id: int, params: Dict[str, Any]) -> ExportJob:
+        """Создает задачу пользователя user_id и ставит ее в очередь"""
+        await self.cleanup_expired(db)
+        job = ExportJob(id=str(uuid.uuid4()), user_id=user_id, status="queued", params=params)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+
+        self._progress[job.id] = {"status": "queued", "rows_written": 0, "images_total": 0, "images_fetched": 0}
+        task = asyncio.create_task(self._run(job.id, params))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _t, job_id=job.id: self._tasks.pop(job_id, None))
+        return job
+
+    async def get(self, db: AsyncSession, job_id: str) -> Optional[ExportJob]:
+        result = await db.execute(select(ExportJob).where(ExportJob.id == job_id))
+        return result.scalar_one_or_none()
+
+    async def get_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задачи в отдельной сессии (для SSE, которое живет дольше запроса)"""
+        async with async_session() as session:
+            job = await self.get(session, job_id)
+            return self.to_dict(job) if job else None
+
+    async def events(self, job_id: str, interval: float = 1.0):
+        """Поток состояний задачи для SSE: до завершения задачи, раз в interval секунд"""
+        last = None
+        while True:
+            state = self._progress.get(job_id)
+            if state is None or state.get("status") in FINISHED_STATUSES:
+                state = await self.get_state(job_id)
+                if state is None:
+                    return
+            if state != last:
+                yield state
+                last = dict(state)
+            if state.get("status") in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(interval)
+
+    async def _persist(self, job_id: str, **values) -> None:
+        async with async_session() as session:
+            await session.execute(update(ExportJob).where(ExportJob.id == job_id).values(**values))
+            await session.commit()
+
+    async def _run(self, job_id: str, params: Dict[str, Any]) -> None:
+        progress = self._progress[job_id]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        async with self._semaphore:
+            progress["status"] = "running"
+            await self._persist(job_id, status="running")
+            work_dir = self.storage_dir / job_id
+            work_dir.mkdir(exist_ok=True)
+            try:
+                result_path, media_type = await self._build(job_id, params, work_dir, progress)
+                file_name = result_path.name
+                if self.storage == "s3":
+                    key = f"exports/{job_id}/{file_name}"
+                    await s3_service.upload_file(str(result_path), key, media_type)
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                    location = key
+                else:
+                    location = str(result_path)
+
+                progress["status"] = "done"
+                await self._persist(
+                    job_id,
+                    status="done",
+                    rows_written=progress["rows_written"],
+                    images_total=progress["images_total"],
+                    images_fetched=progress["images_fetched"],
+                    file_name=file_name,
+                    storage=self.storage,
+                    location=location,
+                    finished_at=datetime.utcnow(),
+                )
+            except Exception as e:
+                print(f"Ошибка задачи выгрузки {job_id}: {e}")
+                progress["status"] = "failed"
+                shutil.rmtree(work_dir, ignore_errors=True)
+                await self._persist(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+            finally:
+                self._progress.pop(job_id, None)
+
+    async def _maybe_persist(self, job_id: str, progress: Dict[str, Any], state: Dict[str, float]) -> None:
+        now = time.monotonic()
+        if now - state["last"] >= self.persist_interval:
+            state["last"] = now
+            await self._persist(
+                job_id,
+                rows_written=progress["rows_written"],
+                images_total=progress["images_total"],
+                images_fetched=progress["images_fetched"],
+            )
+
+    async def _build(self, job_id: str, params: Dict[str, Any], work_dir: Path, progress: Dict[str, Any]):
+        """Формирует файл выгрузки на диске; возвращает (путь, media type)"""
+        loop = asyncio.get_running_loop()
+        brands: List[str] = params["brands"]
+        selected_columns: List[Dict[str, str]] = params["columns"]
+        include_images: bool = params.get("include_images", False)
+        export_format: str = params.get("format", "xlsx")
+        fields, headers = export_service.columns_for(selected_columns)
+        persist_state = {"last": time.monotonic()}
+
+        data_name = f"data.{export_format}"
+        data_path = work_dir / data_name
+        with open(data_path, "wb") as data_file:
+            writer = await loop.run_in_executor(
+                self._executor, export_service.open_writer, export_format, data_file, fields, headers
+            )
+            async for columns in export_service.iter_columns(brands, fields):
+                await loop.run_in_executor(
+                    self._executor, export_service.write_columns, writer, columns, fields
+                )
+                progress["rows_written"] += len(columns["id"])
+                await self._maybe_persist(job_id, progress, persist_state)
+            await loop.run_in_executor(self._executor, writer.close)
+
+        if not include_images:
+            return data_path, EXPORT_FORMATS[export_format]
+
+        zip_path = work_dir / "export_with_images.zip"
+        unique_images = await export_service.image_urls(brands)
+        progress["images_total"] = len(unique_images)
+        archive = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED)
+        try:
+            data_compression = zipfile.ZIP_DEFLATED if export_format == "csv" else zipfile.ZIP_STORED
+            await loop.run_in_executor(
+                self._executor, archive.write, str(data_path), data_name, data_compression
+            )
+            written = set()
+            async with export_service.image_client() as client:
+                async for image_url, content in export_service.fetch_images(client, unique_images):
+                    await loop.run_in_executor(
+                        self._executor, export_service.add_image_to_archive, archive, written, image_url, content
+                    )
+                    progress["images_fetched"] += 1
+                    await self._maybe_persist(job_id, progress, persist_state)
+        finally:
+            await loop.run_in_executor(self._executor, archive.close)
+        data_path.unlink()
+        return zip_path, 'application/zip'
+
+    async def cleanup_expired(self, db: AsyncSession) -> None:
+        """Удаляет файлы и записи завершенных задач старше TTL"""
+        threshold = datetime.utcnow() - self.ttl
+        result = await db.execute(
+            select(ExportJob).where(ExportJob.status.in_(FINISHED_STATUSES), ExportJob.created_at < threshold)
+        )
+        for job in result.scalars().all():
+            if job.storage == "s3" and job.location:
+                try:
+                    await s3_service.delete_image_by_key(job.location)
+                except Exception as e:
+                    print(f"Не удалось удалить выгрузку {job.location} из S3: {e}")
+            shutil.rmtree(self.storage_dir / job.id, ignore_errors=True)
+            await db.delete(job)
+        await db.commit()
+
+    async def recover(self, db: AsyncSession) -> None:
+        """При старте помечает прерванные перезапуском задачи как failed"""
+        await db.execute(
+            update(ExportJob)
+            .where(ExportJob.status.in_(("queued", "running")))
+            .values(status="failed", error="Задача прервана перезапуском сервера", finished_at=datetime.utcnow())
+        )
+        await db.commit()
+
+
+# Глобальный экземпляр
+export_job_manager = ExportJobManager(
+    max_jobs=int(os.getenv("EXPORT_JOB_WORKERS", "2")),
+    storage=os.getenv("EXPORT_JOB_STORAGE", "local"),
+    ttl_hours=int(os.getenv("EXPORT_JOB_TTL_HOURS", "24")),
+    storage_dir=os.getenv("EXPORT_STORAGE_DIR"),
+)
@@ -0,0 +1,317 @@
+import asyncio
+import os
+import zipfile
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import httpx
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product, read_session, replica_caught_up
+from services.attribute_dictionary import AttributeDictionary
+from services.s3_service import s3_service
+from services.product_image_service import product_image_service
+from utils.xlsx_stream import ChunkBuffer, XlsxStreamWriter
+from utils.columnar_stream import CsvStreamWriter, ParquetStreamWriter, arrow_type_for
+
+# Уже сжатые форматы: повторное DEFLATE в архиве только тратит CPU
+COMPRESSED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.xlsx', '.zip', '.parquet')
+
+# Форматы выгрузки: расширение файла и media type
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportService:
+    """Потоковая выгрузка товаров: серверный курсор → строки → XLSX/CSV/Parquet по кускам"""
+
+    # Маппинг колонок БД к человеческим названиям
+    COLUMN_MAPPING = {
+        'id': 'ID',
+        'images': 'Изображения',
+        'manufacturer_name': 'Название производителя',
+        'part_number': 'Номер детали',
+        'part_name': 'Название',
+        'category': 'Категория',
+        'type': 'Тип',
+        'size': 'Размер',
+        'color': 'Цвет',
+        'brand': 'Бренд',
+        'producer': 'Производитель',
+        'gender': 'Пол',
+        'width': 'Ширина',
+        'height': 'Высота',
+        'age': 'Возраст',
+        'shape': 'Форма',
+        'year': 'Год'
+    }
+
+    def __init__(self, yield_per: int = 1000, image_concurrency: int = 16, chunk_size: int = 256 * 1024):
+        # Сколько строк серверный курсор отдает за один fetch
+        self.yield_per = yield_per
+        # Сколько изображений скачивается одновременно (и максимум держится в памяти)
+        self.image_concurrency = image_concurrency
+        # Размер кусков, которыми архив отдается клиенту
+        self.chunk_size = chunk_size
+
+    def build_query(self, brands: List[str], fields: List[str]):
+        """Core-запрос только нужных колонок; brand нужен всегда для виртуальной category"""
+        table_columns = Product.__table__.columns
+        needed = {"id", "brand"}
+        needed.update(f for f in fields if f in table_columns and f != 'category')
+        columns = [table_columns[name] for name in table_columns.keys() if name in needed]
+        return (
+            select(*columns)
+            .where(AttributeDictionary.in_condition("brand", brands))
+            .order_by(Product.id)
+            .execution_options(yield_per=self.yield_per)
+        )
+
+    async def has_products(self, db: AsyncSession, brands: List[str]) -> bool:
+        result = await db.execute(select(Product.id).where(AttributeDictionary.in_condition("brand", brands)).limit(1))
+        return result.first() is not None
+
+    def _format_images(self, value: str) -> str:
+        """Форматирование изображений с .jpg"""
+        formatted_images = []
+        for img in value.split(','):
+            img = img.strip()
+            if not img.endswith('.jpg'):
+                img += '.jpg'
+            formatted_images.append(img)
+        return ', '.join(formatted_images)
+
+    def format_columns(self, columns: Dict[str, Sequence[Any]], fields: List[str], empty: Any = "") -> List[List[Any]]:
+        """Колонки ячеек (CSV/XLSX) с теми же правилами, что и в исходной выгрузке"""
+        count = len(columns['id'])
+        formatted = []
+        for field in fields:
+            if field == 'category':
+                formatted.append([f"category/{brand}" if brand else "category/" for brand in columns['brand']])
+            elif field == 'description' or field not in columns:
+                # Виртуальная колонка — всегда пустая
+                formatted.append([empty] * count)
+            elif field == 'images':
+                formatted.append([self._format_images(value) if value else empty for value in columns[field]])
+            else:
+                formatted.append([empty if value is None or value == "" else value for value in columns[field]])
+        return formatted
+
+    def arrow_columns(self, columns: Dict[str, Sequence[Any]], fields: List[str], types: List[pa.DataType]) -> List[pa.Array]:
+        """
+        Те же правила для Parquet, но целыми массивами Arrow: значения колонки
+        конвертируются одним вызовом pa.array, category и images собираются
+        функциями pyarrow.compute без Python-кода на каждую ячейку.
+        """
+        count = len(columns['id'])
+        arrays = []
+        for field, arrow_type in zip(fields, types):
+            if field == 'category':
+                brands = pc.fill_null(pa.array(columns['brand'], type=pa.string()), "")
+                arrays.append(pc.binary_join_element_wise(pa.scalar("category/"), brands, ""))
+                continue
+            if field == 'description' or field not in columns:
+                arrays.append(pa.nulls(count, type=arrow_type))
+                continue
+            array = pa.array(columns[field], type=arrow_type, from_pandas=False)
+            if pa.types.is_string(arrow_type):
+                # Пустая строка выгружается как NULL, как и отсутствующее значение
+                array = pc.if_else(pc.equal(array, ""), pa.scalar(None, type=arrow_type), array)
+            if field == 'images':
+                array = self._arrow_images(array)
+            arrays.append(array)
+        return arrays
+
+    def _arrow_images(self, array: pa.Array) -> pa.Array:
+        """_format_images для массива: split → trim → .jpg → join без выхода в Python"""
+        parts = pc.split_pattern(array, ",")
+        names = pc.utf8_trim_whitespace(parts.flatten())
+        names = pc.if_else(pc.ends_with(names, ".jpg"), names, pc.binary_join_element_wise(names, ".jpg", ""))
+        return pc.binary_join(pa.ListArray.from_arrays(parts.offsets, names, mask=parts.is_null()), ", ")
+
+    def write_columns(self, writer, columns: Dict[str, Sequence[Any]], fields: List[str]) -> None:
+        """Пачка строк выгрузки в writer: для Parquet — массивы Arrow, для остальных — ячейки"""
+        if isinstance(writer, ParquetStreamWriter):
+            writer.write_columns(self.arrow_columns(columns, fields, writer.schema.types))
+        else:
+            writer.write_columns(self.format_columns(columns, fields, writer.empty_value))
+
+    async def iter_columns(self, brands: List[str], fields: List[str]) -> AsyncIterator[Dict[str, Sequence[Any]]]:
+        """
+        Пачки выгрузки (по yield_per строк) из серверного курсора: колонка БД → значения.
+        Сессия открывается внутри генератора, потому что ответ стримится уже после
+        выхода из обработчика.
+        """
+        query = self.build_query(brands, fields)
+        await replica_caught_up()
+        async with read_session() as session:
+            result = await session.stream(query)
+            keys = list(result.keys())
+            async for partition in result.partitions(self.yield_per):
+                # Транспонирование строк в колонки — один zip без обращения к полям строк
+                yield dict(zip(keys, zip(*partition)))
+
+    async def image_urls(self, brands: List[str]) -> List[str]:
+        """Уникальные ссылки на изображения выгружаемых товаров — по индексу product_images"""
+        await replica_caught_up()
+        async with read_session() as session:
+            return await product_image_service.urls_for_brands(session, brands)
+
+    def columns_for(self, selected_columns: List[Dict[str, str]]) -> Tuple[List[str], List[str]]:
+        """(fields, headers); заголовок по умолчанию — человеческое название из COLUMN_MAPPING"""
+        fields = [c['field'] for c in selected_columns]
+        headers = [c.get('display_name') or self.COLUMN_MAPPING.get(c['field'], c['field']) for c in selected_columns]
+        return fields, headers
+
+    def open_writer(self, fmt: str, fileobj, fields: List[str], headers: List[str]):
+        """Синхронный потоковый writer выбранного формата поверх файлового объекта"""
+        if fmt == 'csv':
+            return CsvStreamWriter(fileobj, headers)
+        if fmt == 'parquet':
+            table_columns = Product.__table__.columns
+            arrow_types = []
+            for field in fields:
+                if field in table_columns and field not in ('category', 'images'):
+                    arrow_types.append(arrow_type_for(table_columns[field].type.python_type.__name__))
+                else:
+                    arrow_types.append(arrow_type_for('str'))
+            return ParquetStreamWriter(fileobj, headers, arrow_types)
+        return XlsxStreamWriter(fileobj, headers, sheet_name='Данные')
+
+    async def stream_file(
+        self,
+        fmt: str,
+        brands: List[str],
+        selected_columns: List[Dict[str, str]],
+    ) -> AsyncIterator[bytes]:
+        """Файл выгрузки (xlsx, csv или parquet) кусками байт; порядок колонок — как выбрал пользователь"""
+        fields, headers = self.columns_for(selected_columns)
+        buffer = ChunkBuffer()
+        writer = self.open_writer(fmt, buffer, fields, headers)
+        yield buffer.drain()
+
+        async for columns in self.iter_columns(brands, fields):
+            self.write_columns(writer, columns, fields)
+            if buffer.size >= self.chunk_size:
+                yield buffer.drain()
+        writer.close()
+
+        tail = buffer.drain()
+        if tail:
+            yield tail
+
+    def image_filename(self, image_url: str) -> str:
+        """Имя файла изображения в папке media архива"""
+        filename = image_url.split('?')[0].split('/')[-1]
+        if not filename.endswith('.jpg'):
+            filename += '.jpg'
+        return filename
+
+    def image_client(self) -> httpx.AsyncClient:
+        """HTTP-клиент для внешних изображений с пулом по размеру окна загрузки"""
+        limits = httpx.Limits(
+            max_connections=self.image_concurrency,
+            max_keepalive_connections=self.image_concurrency
+        )
+        return httpx.AsyncClient(limits=limits, timeout=10)
+
+    async def _fetch_image(self, client: httpx.AsyncClient, image_url: str) -> Tuple[str, Optional[bytes]]:
+        """Изображения из нашего бакета читаются напрямую из S3 по ключу, остальные — по HTTP"""
+        try:
+            key = s3_service.key_from_url(image_url)
+            if key:
+                return image_url, await s3_service.get_object_bytes(key)
+            response = await client.get(image_url)
+            if response.status_code == 200:
+                return image_url, response.content
+        except Exception as e:
+            print(f"Ошибка загрузки изображения {image_url}: {e}")
+        return image_url, None
+
+    async def fetch_images(
+        self, client: httpx.AsyncClient, image_urls: Iterable[str]
+    ) -> AsyncIterator[Tuple[str, Optional[bytes]]]:
+        """
+        Параллельная загрузка с окном не более image_concurrency задач;
+        результаты отдаются по мере готовности, поэтому в памяти одновременно
+        находится ограниченное число изображений.
+        """
+        pending: Set[asyncio.Future] = set()
+        try:
+            for image_url in image_urls:
+                if len(pending) >= self.image_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.ensure_future(self._fetch_image(client, image_url)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # Клиент оборвал загрузку — не оставляем висящих задач
+            for task in pending:
+                task.cancel()
+
+    def add_image_to_archive(
+        self, archive: zipfile.ZipFile, written: Set[str], image_url: str, content: Optional[bytes]
+    ) -> bool:
+        """Кладет изображение в media/ архива; сжатые форматы — как ZIP_STORED"""
+        if content is None:
+            return False
+        filename = self.image_filename(image_url)
+        if filename in written:
+            return False
+        written.add(filename)
+        compress_type = (
+            zipfile.ZIP_STORED if filename.lower().endswith(COMPRESSED_EXTENSIONS)
+            else zipfile.ZIP_DEFLATED
+        )
+        archive.writestr(f'media/{filename}', content, compress_type=compress_type)
+        return True
+
+    async def stream_zip_with_images(
+        self,
+        brands: List[str],
+        selected_columns: List[Dict[str, str]],
+        fmt: str = 'xlsx',
+    ) -> AsyncIterator[bytes]:
+        """
+        ZIP-архив (data.<fmt> + media/*) кусками байт по мере формирования.
+        Сжатые форматы кладутся в архив как ZIP_STORED.
+        """
+        buffer = ChunkBuffer()
+        data_name = f'data.{fmt}'
+        data_compression = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            data_info = zipfile.ZipInfo(data_name)
+            data_info.compress_type = data_compression
+            with archive.open(data_info, 'w') as data_entry:
+                async for chunk in self.stream_file(fmt, brands, selected_columns):
+                    data_entry.write(chunk)
+                    if buffer.size >= self.chunk_size:
+                        yield buffer.drain()
+            yield buffer.drain()
+
+            unique_images = await self.image_urls(brands)
+            if unique_images:
+                written: Set[str] = set()
+                async with self.image_client() as client:
+                    async for image_url, content in self.fetch_images(client, unique_images):
+                        self.add_image_to_archive(archive, written, image_url, content)
+                        if buffer.size >= self.chunk_size:
+                            yield buffer.drain()
+
+        tail = buffer.drain()
+        if tail:
+            yield tail
+
+
+# Глобальный экземпляр
+export_service = ExportService(
+    image_concurrency=int(os.getenv('EXPORT_IMAGE_CONCURRENCY', '16'))
+)
@@ -0,0 +1,123 @@
+import asyncio
+from typing import Any, Dict, List
+from sqlalchemy import select, func, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import (
+    Product, ProductFacet, ProductFacetDelta, FACET_FIELDS, DICTIONARY_MODELS,
+    PRODUCT_FACETS_FOLD_SQL, async_session,
+)
+from services.attribute_dictionary import attribute_dictionary
+
+
+class FacetService:
+    """
+    Фасеты фильтров товаров (brand, category, color, type, gender, shape) с количествами.
+    Без фильтров значения читаются из сводной таблицы facet_counts плюс еще не
+    свернутые дельты facet_count_deltas, которые пишут триггеры на products;
+    с фильтрами считаются одним запросом GROUPING SETS по отфильтрованным строкам.
+    В обоих случаях поля со справочником считаются по id и возвращаются
+    каноническим значением — тем же, по которому работают фильтры и экспорт.
+    """
+
+    # Ключ advisory-блокировки свертки: одна свертка на всю базу за раз
+    FOLD_LOCK_KEY = 7241004
+
+    def __init__(self, fields: List[str] = None):
+        self.fields = fields or FACET_FIELDS
+
+    def _empty(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {field: [] for field in self.fields}
+
+    def _sorted(self, facets: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+        for field in facets:
+            facets[field].sort(key=lambda item: item["value"])
+        return facets
+
+    async def get_facets(self, db: AsyncSession) -> Dict[str, List[Dict[str, Any]]]:
+        """Глобальные фасеты: сводная таблица плюс несвернутые дельты"""
+        rows = union_all(
+            select(ProductFacet.facet, ProductFacet.value, ProductFacet.count.label("count")),
+            select(ProductFacetDelta.facet, ProductFacetDelta.value, ProductFacetDelta.diff.label("count")),
+        ).subquery()
+        total = func.sum(rows.c.count)
+        result = await db.execute(
+            select(rows.c.facet, rows.c.value, total)
+            .where(rows.c.facet.in_(self.fields))
+            .group_by(rows.c.facet, rows.c.value)
+            .having(total > 0)
+        )
+        grouped = {field: [] for field in self.fields}
+        for facet, value, count in result.all():
+            if facet in DICTIONARY_MODELS:
+                value = int(value)
+            grouped[facet].append((value, int(count)))
+        return await self._named(db, grouped)
+
+    async def fold_deltas(self, db: AsyncSession) -> bool:
+        """
+        Сворачивает дельты в facet_counts. Если свертку уже выполняет другой
+        процесс (несколько воркеров uvicorn), ничего не делает и возвращает False.
+        """
+        locked = await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": self.FOLD_LOCK_KEY})
+        if not locked:
+            await db.rollback()
+            return False
+        for statement in PRODUCT_FACETS_FOLD_SQL:
+            await db.execute(text(statement))
+        await db.commit()
+        return True
+
+    async def fold_periodically(self, interval: float) -> None:
+        """Фоновая свертка дельт раз в interval секунд (запускается в lifespan приложения)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with async_session() as db:
+                    await self.fold_deltas(db)
+            except Exception as e:
+                print(f"Ошибка свертки фасетов: {e}")
+
+    def _group_column(self, field: str):
+        """Поля со справочником группируются по целочисленному id, остальные — по строке"""
+        if field in DICTIONARY_MODELS:
+            return getattr(Product, f"{field}_id")
+        return getattr(Product, field)
+
+    async def get_filtered_facets(self, db: AsyncSession, conditions: list) -> Dict[str, List[Dict[str, Any]]]:
+        """Фасеты с количествами под текущими фильтрами — один проход по отфильтрованным строкам"""
+        columns = [self._group_column(field) for field in self.fields]
+        # grouping(col) = 0 для строк группы, построенной по этой колонке
+        grouping_flags = [func.grouping(column).label(f"g_{field}") for field, column in zip(self.fields, columns)]
+        stmt = (
+            select(*columns, *grouping_flags, func.count().label("cnt"))
+            .where(*conditions)
+            .group_by(func.grouping_sets(*columns))
+        )
+        result = await db.execute(stmt)
+
+        grouped = {field: [] for field in self.fields}
+        n = len(self.fields)
+        for row in result.all():
+            values, flags, count = row[:n], row[n:2 * n], row[2 * n]
+            for field, value, flag in zip(self.fields, values, flags):
+                if flag == 0:
+                    if value not in (None, ""):
+                        grouped[field].append((value, count))
+                    break
+
+        return await self._named(db, grouped)
+
+    async def _named(self, db: AsyncSession, grouped: Dict[str, list]) -> Dict[str, List[Dict[str, Any]]]:
+        """Пары (значение, количество) по полям → фасеты; id справочников заменяются значениями"""
+        facets = self._empty()
+        for field, items in grouped.items():
+            if field in DICTIONARY_MODELS:
+                # id → каноническое значение из кеша справочников
+                names = await attribute_dictionary.values_by_id(db, field, [value for value, _ in items])
+                items = [(names[value], count) for value, count in items if value in names]
+            facets[field] = [{"value": value, "count": count} for value, count in items]
+        return self._sorted(facets)
+
+
+# Глобальный экземпляр
+facet_service = FacetService()
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ImportJob, async_session
+from services.catalog_version import catalog_version
+from services.count_cache import product_count_cache
+from services.product_cache import product_detail_cache
+from services.parse_pool import parse_pool
+from services.product_import import product_import_service
+from services.upload_sessions import upload_session_store
+
+FINISHED_STATUSES = ("done", "failed")
+
+# Сколько ошибок валидации хранить в строке задачи (остальные только считаются)
+STORED_ERRORS = 10
+
+# Счетчики, которые задача переносит из результата ProductImportService.run
+COUNTERS = ("inserted", "updated", "unchanged", "invalid", "error_count")
+
+
+class ImportJobManager:
+    """
+    Фоновые задачи импорта товаров из Excel (/upload/confirm-mapping).
+    Запрос только ставит задачу в очередь и сразу отвечает; разбор и запись в БД
+    идут вне HTTP-запроса, поэтому длинные импорты не упираются в таймауты nginx.
+    Одновременно выполняется не более max_jobs задач — импорты нескольких
+    менеджеров ждут в очереди, а не нагружают Postgres параллельно. Разбор и проверка
+    пачек идут в пуле процессов parse_pool, чтение Parquet — в пуле потоков задачи,
+    запись — в event loop.
+    Прогресс обновляется в памяти и периодически сохраняется в таблицу import_jobs.
+    """
+
+    def __init__(self, max_jobs: int = 1, ttl_hours: int = 24):
+        self.max_jobs = max_jobs
+        self.ttl = timedelta(hours=ttl_hours)
+        # Семафор создается лениво: в Python 3.9 он привязывается к loop при создании
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="import-job")
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Задачи, ожидающие свободного воркера, в порядке постановки
+        self._queued: List[str] = []
+        # Как часто сбрасывать прогресс в БД (секунды)
+        self.persist_interval = 2.0
+
+    def to_dict(self, job: ImportJob) -> Dict[str, Any]:
+        """Состояние задачи; для выполняемых в этом процессе — живой прогресс из памяти"""
+        params = job.params or {}
+        data = {
+            "id": job.id,
+            "status": job.status,
+            "phase": job.phase,
+            "filename": params.get("filename"),
+            "strategy": params.get("strategy"),
+            "rows_processed": job.rows_processed,
+            "inserted": job.inserted,
+            "updated": job.updated,
+            "unchanged": job.unchanged,
+            "invalid": job.invalid,
+            "error_count": job.error_count,
+            "errors": job.errors or [],
+            "summary": job.summary,
+            "error": job.error,
+            "queue_position": None,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+        live = self._live(job.id)
+        if live:
+            data.update(live)
+        return data
+
+    async def submit(self, db: AsyncSession, user_id: int, params: Dict[str, Any]) -> ImportJob:
+        """Создает задачу и ставит ее в очередь; params — upload_id, mapping, strategy, filename"""
+        await self.cleanup_expired(db)
+        job = ImportJob(id=str(uuid.uuid4()), user_id=user_id, status="queued", phase="queued", params=params)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+
+        self._progress[job.id] = {"status": "queued", "phase": "queued", "rows_processed": 0}
+        self._queued.append(job.id)
+        task = asyncio.create_task(self._run(job.id, user_id, params))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _t, job_id=job.id: self._tasks.pop(job_id, None))
+        return job
+
+    async def get(self, db: AsyncSession, job_id: str) -> Optional[ImportJob]:
+        result = await db.execute(select(ImportJob).where(ImportJob.id == job_id))
+        return result.scalar_one_or_none()
+
+    async def get_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задачи в отдельной сессии (для SSE, которое живет дольше запроса)"""
+        async with async_session() as session:
+            job = await self.get(session, job_id)
+            return self.to_dict(job) if job else None
+
+    def _live(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Прогресс задачи из памяти (с местом в очереди) или None, если она здесь не выполняется"""
+        live = self._progress.get(job_id)
+        if live is None:
+            return None
+        state = {**live, "queue_position": None}
+        if job_id in self._queued:
+            state["queue_position"] = self._queued.index(job_id) + 1
+        return state
+
+    async def events(self, job_id: str, interval: float = 1.0):
+        """Поток состояний задачи для SSE: до завершения задачи, раз в interval секунд"""
+        last = None
+        while True:
+            state = self._live(job_id)
+            if state is None or state.get("status") in FINISHED_STATUSES:
+                state = await self.get_state(job_id)
+                if state is None:
+                    return
+            if state != last:
+                yield state
+                last = dict(state)
+            if state.get("status") in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(interval)
+
+    async def _persist(self, job_id: str, **values) -> None:
+        async with async_session() as session:
+            await session.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
+            await session.commit()
+
+    @staticmethod
+    def _apply(progress: Dict[str, Any], phase: str, result: Dict[str, Any]) -> None:
+        """Переносит фазу и счетчики результата импорта в живой прогресс"""
+        progress["phase"] = phase
+        progress["rows_processed"] = result["rows"]
+        progress["errors"] = result["errors"][:STORED_ERRORS]
+        for name in COUNTERS:
+            progress[name] = result[name]
+
+    @staticmethod
+    def _counters(progress: Dict[str, Any]) -> Dict[str, Any]:
+        values = {name: progress.get(name, 0) for name in COUNTERS}
+        values["rows_processed"] = progress.get("rows_processed", 0)
+        values["errors"] = progress.get("errors", [])
+        return values
+
+    async def _run(self, job_id: str, user_id: int, params: Dict[str, Any]) -> None:
+        progress = self._progress[job_id]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        async with self._semaphore:
+            self._queued.remove(job_id)
+            progress.update(status="running", phase="reading")
+            await self._persist(job_id, status="running", phase="reading", started_at=datetime.utcnow())
+            persist_state = {"last": time.monotonic(), "phase": "reading"}
+
+            async def on_progress(phase: str, result: Dict[str, Any]) -> None:
+                self._apply(progress, phase, result)
+                await self._maybe_persist(job_id, progress, persist_state)
+
+            try:
+                session = upload_session_store.load(params["upload_id"], user_id)
+                # Если фоновый разбор после загрузки еще не готов, таблица строится здесь же
+                # в пуле процессов: поток задачи дальше читает только Parquet
+                await parse_pool.run(upload_session_store.build_frame, session["content_hash"], wait=True)
+                # Из Parquet читаются только замаппенные колонки
+                chunks = upload_session_store.iter_chunks(
+                    session, product_import_service.chunk_size, columns=list(params["mapping"])
+                )
+                async with async_session() as db:
+                    result = await product_import_service.run(
+                        db, chunks, params["mapping"], params.get("strategy"),
+                        executor=self._executor, progress=on_progress,
+                    )
+                    progress["phase"] = "committing"
+                    await self._persist(job_id, phase="committing")
+                    await db.commit()
+
+                product_count_cache.invalidate()
+                await product_detail_cache.invalidate()
+                catalog_version.bump("products")
+
+                self._apply(progress, "done", result)
+                summary = product_import_service.summary(result)
+                print(
+                    f"Импорт {job_id}: строк {result['rows']}, добавлено {result['inserted']}, "
+                    f"обновлено {result['updated']}, без изменений {result['unchanged']}, "
+                    f"отброшено {result['invalid']}, ошибок валидации {result['error_count']}, "
+                    f"стратегия {result['strategy']}"
+                )
+                progress.update(status="done", summary=summary)
+                await self._persist(
+                    job_id,
+                    status="done",
+                    phase="done",
+                    summary=summary,
+                    finished_at=datetime.utcnow(),
+                    **self._counters(progress),
+                )
+            except Exception as e:
+                print(f"Ошибка задачи импорта {job_id}: {e}")
+                progress.update(status="failed", error=str(e))
+                # Транзакция импорта откатана: в товарах ничего не изменилось
+                await self._persist(
+                    job_id, status="failed", error=str(e), finished_at=datetime.utcnow(),
+                    inserted=0, updated=0, unchanged=0,
+                )
+            finally:
+                self._progress.pop(job_id, None)
+
+    async def _maybe_persist(self, job_id: str, progress: Dict[str, Any], state: Dict[str, Any]) -> None:
+        # Смена фазы сохраняется сразу, счетчики — не чаще persist_interval
+        now = time.monotonic()
+        if progress["phase"] != state["phase"] or now - state["last"] >= self.persist_interval:
+            state["last"] = now
+            state["phase"] = progress["phase"]
+            await self._persist(job_id, phase=progress["phase"], **self._counters(progress))
+
+    async def cleanup_expired(self, db: AsyncSession) -> None:
+        """Удаляет записи завершенных задач старше TTL"""
+        threshold = datetime.utcnow() - self.ttl
+        await db.execute(
+            delete(ImportJob).where(ImportJob.status.in_(FINISHED_STATUSES), ImportJob.created_at < threshold)
+        )
+        await db.commit()
+
+    async def recover(self, db: AsyncSession) -> None:
+        """При старте помечает прерванные перезапуском задачи как failed"""
+        await db.execute(
+            update(ImportJob)
+            .where(ImportJob.status.in_(("queued", "running")))
+            .values(status="failed", error="Задача прервана перезапуском сервера", finished_at=datetime.utcnow())
+        )
+        await db.commit()
+
+
+# Глобальный экземпляр
+import_job_manager = ImportJobManager(
+    max_jobs=int(os.getenv("IMPORT_JOB_WORKERS", "1")),
+    ttl_hours=int(os.getenv("IMPORT_JOB_TTL_HOURS", "24")),
+)
@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+
+def _warm_up() -> None:
+    """Импорт модулей разбора в процессе пула заранее, а не на первой загрузке файла"""
+    import services.product_import
+    import services.upload_sessions
+
+
+class ParsePoolBusy(Exception):
+    """Очередь пула разбора заполнена — запрос нужно повторить позже"""
+    pass
+
+
+class ParsePool:
+    """
+    Пул процессов для разбора Excel: предпросмотр и определение заголовка,
+    полный разбор листа в Parquet, проверка и очистка пачек импорта.
+    В потоках эта работа держит GIL и останавливает event loop uvicorn (вместе
+    с health check), в отдельных процессах — нет. Таблица листа целиком между
+    процессами не передается — она остается на диске (Parquet сессии загрузки);
+    по pickle идут словарь предпросмотра и пачки импорта: туда только замаппенные
+    колонки, обратно записи (около 200 КБ и 2–4 мс на пачку в 5000 строк против
+    ~3 МБ и ~45 мс для пачки листа с 26 колонками).
+
+    Одновременно выполняется max_workers задач, еще queue_depth ждут; при полной
+    очереди run() без wait отвечает ParsePoolBusy, а не копит запросы в памяти.
+    Пул создается и закрывается в lifespan приложения; до start() (скрипты)
+    задачи выполняются в потоке по умолчанию.
+    """
+
+    def __init__(self, max_workers: int = 2, queue_depth: int = 8):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Создается в start(): в Python 3.9 семафор привязывается к loop при создании
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: дочерние процессы не наследуют event loop, пул соединений БД и потоки API
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = self._create_executor()
+            self._slots = asyncio.Semaphore(self.max_workers + self.queue_depth)
+            for _ in range(self.max_workers):
+                self._executor.submit(_warm_up)
+
+    def shutdown(self) -> None:
+        """Ждет выполняемые задачи, ожидающие в очереди отменяет"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+    async def run(self, func: Callable[..., Any], *args: Any, wait: bool = False) -> Any:
+        """
+        Выполняет func(*args) в процессе пула. func и аргументы должны сериализоваться
+        pickle (функции и методы глобальных экземпляров модулей services).
+        wait=True — ждать места в очереди (фоновые задачи), иначе ParsePoolBusy.
+        """
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            return await loop.run_in_executor(None, func, *args)
+        if not wait and self._slots.locked():
+            raise ParsePoolBusy("Сервер занят разбором других файлов, повторите попытку позже")
+        async with self._slots:
+            executor = self._executor
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                # Процесс пула аварийно завершился (например, по памяти на огромном файле):
+                # пул больше не принимает задач — пересоздаем его для следующих запросов
+                if self._executor is executor:
+                    print("Пул разбора Excel пересоздан после аварийного завершения процесса")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._create_executor()
+                raise
+
+
+# Глобальный экземпляр
+parse_pool = ParsePool(
+    max_workers=int(os.getenv("PARSE_POOL_WORKERS", "2")),
+    queue_depth=int(os.getenv("PARSE_POOL_QUEUE", "8")),
+)
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import (
+    insert, update, delete, select, cast, type_coerce, func, case, literal_column, text, tuple_, or_,
+    Boolean, Float, Integer, Column, BigInteger, MetaData, Table,
+)
+from sqlalchemy.dialects.postgresql import JSONB, distinct_on, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product, PART_NUMBER_KEY_PREDICATE_SQL, PART_NUMBER_UNIQUE_INDEX
+
+
+# Записываемые из импорта колонки: как в ProductBulkService.columns, но со ссылками на
+# справочники — импорт передает <поле>_id из кеша, и триггер доверяет им без поиска
+IMPORT_COLUMNS = [
+    column for column in Product.__table__.columns
+    if column.name != "id" and column.computed is None and column.server_default is None
+]
+
+# Временная таблица для COPY-импорта (ON COMMIT DROP: живет до конца транзакции)
+IMPORT_STAGING = Table(
+    "products_import_staging",
+    MetaData(),
+    Column("seq", BigInteger),
+    *[Column(column.name, column.type) for column in IMPORT_COLUMNS],
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="drop",
+)
+
+
+def duplicate_part_number(error: Exception) -> Optional[str]:
+    """
+    Артикул из ошибки уникального индекса ux_products_part_number (IntegrityError
+    при commit); None — ошибка другая. Пустая строка — артикул не удалось разобрать.
+    """
+    message = str(getattr(error, "orig", error))
+    if PART_NUMBER_UNIQUE_INDEX not in message:
+        return None
+    match = re.search(r"\)=\((.*)\) already exists", message)
+    return match.group(1) if match else ""
+
+
+class ProductBulkService:
+    """
+    Массовая запись товаров. Каждая операция — один set-based SQL-запрос:
+    строки передаются одним параметром jsonb и разворачиваются через
+    jsonb_array_elements, поэтому размер пачки не упирается в лимит параметров
+    драйвера, а триггеры уровня statement (фасеты) срабатывают один раз.
+    Транзакцией управляет вызывающий код.
+    """
+
+    def __init__(self, max_rows: int = 5000):
+        self.max_rows = max_rows
+        table_columns = Product.__table__.columns
+        # Записываемые колонки: все, кроме id, вычисляемых, ссылок на справочники
+        # (<поле>_id заполняет триггер products_dictionary_sync по строковому значению)
+        # и служебных со значением по умолчанию на стороне БД (change_seq)
+        self.columns = [
+            column for column in table_columns
+            if column.name != "id" and column.computed is None and not column.foreign_keys
+            and column.server_default is None
+        ]
+        self.import_columns = IMPORT_COLUMNS
+
+    def _elements(self, rows: List[Dict[str, Any]], name: str):
+        """Табличная функция jsonb_array_elements(:payload) WITH ORDINALITY"""
+        payload = cast(json.dumps(rows, ensure_ascii=False), JSONB)
+        elements = (
+            func.jsonb_array_elements(payload)
+            .table_valued("value", with_ordinality="ordinality")
+            .alias(name)
+        )
+        return elements, type_coerce(elements.c.value, JSONB)
+
+    async def insert_many(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        INSERT ... SELECT из jsonb; возвращает id в порядке входных строк.
+        Порядок RETURNING не гарантирован, поэтому id берутся из последовательности
+        заранее (nextval в материализованном CTE рядом с ORDINALITY строки),
+        вставляются явно и возвращаются в порядке ORDINALITY.
+        """
+        if not rows:
+            return []
+        elements, data = self._elements(rows, "new_rows")
+        numbered = (
+            select(
+                func.nextval(func.pg_get_serial_sequence(Product.__tablename__, "id")).label("id"),
+                elements.c.ordinality,
+                *[cast(data[column.name].astext, column.type).label(column.name) for column in self.columns],
+            )
+            .cte("numbered")
+            .prefix_with("MATERIALIZED", dialect="postgresql")
+        )
+        names = ["id"] + [column.name for column in self.columns]
+        inserted = (
+            insert(Product)
+            .from_select(names, select(*[numbered.c[name] for name in names]))
+            .returning(Product.id)
+            .cte("inserted")
+        )
+        stmt = (
+            select(numbered.c.id)
+            .join(inserted, inserted.c.id == numbered.c.id)
+            .order_by(numbered.c.ordinality)
+        )
+        result = await db.execute(stmt)
+        return list(result.scalars().all())
+
+    def _upsert(self, source, names: List[str]):
+        """
+        INSERT ... SELECT с ON CONFLICT по артикулу (btrim(part_number), уникальный
+        индекс ux_products_part_number). Отсутствующее (null) поле не затирает значение
+        товара; товар, у которого после этого ничего не меняется, не обновляется
+        и не попадает в RETURNING. RETURNING inserted — xmax = 0 у вставленной строки.
+        """
+        table = Product.__table__
+        stmt = pg_insert(Product).from_select(names, source)
+        merged = {name: func.coalesce(stmt.excluded[name], table.c[name]) for name in names}
+        return stmt.on_conflict_do_update(
+            index_elements=[func.btrim(Product.part_number)],
+            index_where=text(PART_NUMBER_KEY_PREDICATE_SQL),
+            set_=merged,
+            where=tuple_(*[table.c[name] for name in names]).is_distinct_from(tuple_(*merged.values())),
+        ).returning(literal_column("(xmax = 0)", Boolean).label("inserted"))
+
+    async def upsert_many(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Вставка/обновление пачки по артикулу из jsonb (см. _upsert). Строки без артикула
+        всегда вставляются. Артикулы во входном списке не должны повторяться — одна
+        команда не обновляет строку дважды. Возвращает (inserted, updated); остальные
+        строки совпали с товарами и не изменились.
+        """
+        if not rows:
+            return 0, 0
+        elements, data = self._elements(rows, "import_rows")
+        source = (
+            select(*[cast(data[column.name].astext, column.type) for column in self.import_columns])
+            .order_by(elements.c.ordinality)
+        )
+        result = await db.execute(self._upsert(source, [column.name for column in self.import_columns]))
+        flags = result.scalars().all()
+        inserted = sum(1 for flag in flags if flag)
+        return inserted, len(flags) - inserted
+
+    async def upsert_many_by_lookup(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        То же, что upsert_many, но без ON CONFLICT — для базы, где уникальный индекс
+        по артикулу не создан (в каталоге есть дубликаты). Одна команда из двух CTE:
+        UPDATE всех товаров с артикулом из пачки (null не затирает значение, товары
+        без изменений не трогаются) и INSERT строк, артикула которых в базе нет.
+        Возвращает (inserted, updated) по строкам пачки.
+        """
+        if not rows:
+            return 0, 0
+        elements, data = self._elements(rows, "import_rows")
+        names = [column.name for column in self.import_columns]
+        source = select(
+            elements.c.ordinality,
+            *[cast(data[column.name].astext, column.type).label(column.name) for column in self.import_columns],
+        ).cte("source")
+        table = Product.__table__
+        key = func.btrim(source.c.part_number)
+        empty = literal_column("''")
+
+        merged = {name: func.coalesce(source.c[name], table.c[name]) for name in names}
+        updated = (
+            update(Product)
+            .where(func.btrim(Product.part_number) == key, key != empty)
+            .where(tuple_(*[table.c[name] for name in names]).is_distinct_from(tuple_(*merged.values())))
+            .values(merged)
+            .returning(source.c.ordinality)
+            .cte("updated")
+        )
+        # Обе CTE видят снимок до UPDATE: вставляются только артикулы, которых не было
+        existing = select(literal_column("1")).where(func.btrim(Product.part_number) == key).exists()
+        inserted = (
+            insert(Product)
+            .from_select(names, (
+                select(*[source.c[name] for name in names])
+                .where(or_(func.coalesce(key, empty) == empty, ~existing))
+                .order_by(source.c.ordinality)
+            ))
+            .returning(Product.id)
+            .cte("inserted")
+        )
+        result = await db.execute(select(
+            select(func.count()).select_from(inserted).scalar_subquery(),
+            select(func.count(func.distinct(updated.c.ordinality))).scalar_subquery(),
+        ))
+        inserted_count, updated_count = result.one()
+        return inserted_count, updated_count
+
+    async def create_staging(self, db: AsyncSession) -> None:
+        """Временная таблица для COPY (удаляется при commit/rollback транзакции)"""
+        connection = await db.connection()
+        # Повторный импорт в той же транзакции начинает с пустой таблицы
+        await connection.execute(text(f"DROP TABLE IF EXISTS pg_temp.{IMPORT_STAGING.name}"))
+        await connection.run_sync(lambda sync_conn: IMPORT_STAGING.create(sync_conn, checkfirst=False))
+
+    async def copy_to_staging(self, db: AsyncSession, rows: List[Dict[str, Any]], first_seq: int) -> None:
+        """
+        Пачка строк в staging через COPY (asyncpg copy_records_to_table, бинарный
+        протокол); seq — сквозной номер строки в файле, по нему последняя побеждает.
+        """
+        names = [column.name for column in self.import_columns]
+        converters = [self._python_type(column) for column in self.import_columns]
+        records = [
+            (first_seq + offset, *[
+                None if row.get(name) is None else convert(row[name])
+                for name, convert in zip(names, converters)
+            ])
+            for offset, row in enumerate(rows)
+        ]
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            IMPORT_STAGING.name, records=records, columns=["seq", *names]
+        )
+
+    async def merge_staging(self, db: AsyncSession) -> Tuple[int, int, int]:
+        """
+        Перенос staging в products одной командой: по артикулу остается последняя
+        строка файла, строки без артикула вставляются все.
+        Возвращает (inserted, updated, unchanged).
+        """
+        staging = IMPORT_STAGING.c
+        # Литерал, а не параметр: выражения DISTINCT ON и ORDER BY должны совпадать
+        key = func.nullif(func.btrim(staging.part_number), literal_column("''"))
+        # DISTINCT ON (ключ, seq для строк без ключа): одна строка на артикул
+        single = case((key.is_(None), staging.seq))
+        latest = (
+            select(IMPORT_STAGING)
+            .ext(distinct_on(key, single))
+            .order_by(key, single, staging.seq.desc())
+            .subquery("latest")
+        )
+        names = [column.name for column in self.import_columns]
+        source = select(*[latest.c[name] for name in names]).order_by(latest.c.seq)
+
+        total = (await db.execute(select(func.count()).select_from(latest))).scalar()
+        merged = self._upsert(source, names).cte("merged")
+        result = await db.execute(select(
+            func.count().filter(merged.c.inserted),
+            func.count().filter(~merged.c.inserted),
+        ))
+        inserted, updated = result.one()
+        return inserted, updated, total - inserted - updated
+
+    @staticmethod
+    def _python_type(column):
+        """Приведение значения к типу колонки для бинарного COPY (драйвер не приводит строки)"""
+        if isinstance(column.type, Float):
+            return float
+        if isinstance(column.type, Integer):
+            return int
+        return str
+
+    async def patch_many(self, db: AsyncSession, items: List[Dict[str, Any]]) -> List[int]:
+        """
+        UPDATE ... FROM jsonb по id. Меняются только переданные в элементе поля
+        (ключ есть в объекте — значение берется из него, в т.ч. null).
+        Возвращает id обновленных товаров.
+        """
+        if not items:
+            return []
+        elements, data = self._elements(items, "patch")
+        values = {
+            column.name: case(
+                (data.has_key(column.name), cast(data[column.name].astext, column.type)),
+                else_=column,
+            )
+            for column in self.columns
+        }
+        stmt = (
+            update(Product)
+            .where(Product.id == cast(data["id"].astext, Product.id.type))
+            .values(values)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        return result.scalars().all()
+
+    async def update_where(self, db: AsyncSession, conditions: list, values: Dict[str, Any]) -> List[int]:
+        """UPDATE по условиям фильтра списка товаров; возвращает id обновленных"""
+        stmt = (
+            update(Product)
+            .where(*conditions)
+            .values(values)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        return result.scalars().all()
+
+    async def delete_where(self, db: AsyncSession, conditions: list) -> List[int]:
+        """DELETE по условиям фильтра списка товаров; возвращает id удаленных"""
+        stmt = (
+            delete(Product)
+            .where(*conditions)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        return result.scalars().all()
+
+
+# Глобальный экземпляр
+product_bulk_service = ProductBulkService(
+    max_rows=int(os.getenv('BULK_WRITE_MAX_ROWS', '5000'))
+)
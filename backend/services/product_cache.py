@@ -0,0 +1,136 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class ProductCacheBackend(ABC):
+    """
+    Хранилище кеша карточек товаров: id → сериализованный ProductResponse (dict).
+    Методы асинхронные, чтобы вместо памяти процесса можно было подключить
+    общий кеш (Redis и т.п.) без изменения вызывающего кода.
+    """
+
+    @abstractmethod
+    async def get_many(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_many(self, payloads: Dict[int, Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_many(self, ids: Iterable[int]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    def size(self) -> int:
+        """Число записей для статистики; общий кеш может его не знать"""
+        return 0
+
+
+class MemoryProductCacheBackend(ProductCacheBackend):
+    """LRU в памяти процесса с TTL на запись"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    async def get_many(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        now = time.monotonic()
+        found: Dict[int, Dict[str, Any]] = {}
+        for product_id in ids:
+            entry = self._entries.get(product_id)
+            if entry is None:
+                continue
+            stored_at, payload = entry
+            if now - stored_at > self.ttl_seconds:
+                self._entries.pop(product_id, None)
+                continue
+            self._entries.move_to_end(product_id)
+            found[product_id] = payload
+        return found
+
+    async def set_many(self, payloads: Dict[int, Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        for product_id, payload in payloads.items():
+            self._entries[product_id] = (now, payload)
+            self._entries.move_to_end(product_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete_many(self, ids: Iterable[int]) -> None:
+        for product_id in ids:
+            self._entries.pop(product_id, None)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class ProductDetailCache:
+    """
+    Кеш карточек товаров для GET /products/{id} и GET /products/batch.
+    Хранятся готовые JSON-словари ProductResponse, промахи догружаются одним запросом.
+    Любая запись в products должна вызывать invalidate(): по списку id, если он известен,
+    иначе — полный сброс. Поколение защищает от гонки «прочитали из БД до записи,
+    положили в кеш после инвалидации»: такой результат в кеш не попадает.
+    """
+
+    def __init__(self, backend: ProductCacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Снимок поколения — берется перед чтением из БД и передается в put()"""
+        return self._generation
+
+    async def get_many(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        wanted = list(dict.fromkeys(ids))
+        found = await self.backend.get_many(wanted)
+        self.hits += len(found)
+        self.misses += len(wanted) - len(found)
+        return found
+
+    async def put(self, payloads: Dict[int, Dict[str, Any]], generation: int) -> None:
+        # Между чтением и сохранением была запись — результат мог устареть
+        if payloads and generation == self._generation:
+            await self.backend.set_many(payloads)
+
+    async def invalidate(self, ids: Optional[Iterable[int]] = None) -> None:
+        """Сброс карточек по id; без аргумента — всего кеша (массовые операции, импорт, чат)"""
+        self._generation += 1
+        self.invalidations += 1
+        if ids is None:
+            await self.backend.clear()
+        else:
+            await self.backend.delete_many(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Глобальный экземпляр
+product_detail_cache = ProductDetailCache(MemoryProductCacheBackend(
+    max_entries=int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("PRODUCT_CACHE_TTL", "300")),
+))
@@ -0,0 +1,79 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import select, union_all, literal, tuple_, text, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product, ProductTombstone
+
+
+class ProductChangeFeed:
+    """
+    Лента изменений товаров для инкрементальной синхронизации.
+    Номер изменения (change_seq) — id транзакции последней записи строки, удаления
+    хранятся надгробиями в product_tombstones. Отдаются только изменения завершенных
+    транзакций (номер меньше xmin текущего снимка), поэтому клиент, дочитавший ленту
+    до номера N, не пропустит транзакцию, которая зафиксируется позже с меньшим номером.
+    """
+
+    def __init__(self, max_limit: int = 5000):
+        self.max_limit = max_limit
+
+    async def watermark(self, db: AsyncSession) -> int:
+        """Номер самой старой незавершенной транзакции: все изменения до него видны"""
+        result = await db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+        return result.scalar()
+
+    def _after(self, seq_column, id_column, since: int, after_id: Optional[int]):
+        if after_id is None:
+            return seq_column > since
+        return tuple_(seq_column, id_column) > tuple_(since, after_id)
+
+    async def changes(
+        self,
+        db: AsyncSession,
+        since: int,
+        after_id: Optional[int],
+        limit: int,
+    ) -> Tuple[List[Tuple[int, int, bool]], bool]:
+        """
+        Страница изменений строго после (since, after_id) в порядке (change_seq, id):
+        список (seq, id, deleted) и признак, что есть следующая страница.
+        after_id=None — начиная со следующей транзакции после since.
+        """
+        watermark = await self.watermark(db)
+        upserts = (
+            select(
+                Product.change_seq.label("seq"),
+                Product.id.label("id"),
+                literal(False).label("deleted"),
+            )
+            .where(self._after(Product.change_seq, Product.id, since, after_id))
+            .where(Product.change_seq < watermark)
+            .order_by(Product.change_seq, Product.id)
+            .limit(limit + 1)
+            .subquery()
+        )
+        # Надгробие не нужно, если товар с тем же id снова существует (восстановление из бэкапа)
+        deletes = (
+            select(
+                ProductTombstone.change_seq.label("seq"),
+                ProductTombstone.product_id.label("id"),
+                literal(True).label("deleted"),
+            )
+            .where(self._after(ProductTombstone.change_seq, ProductTombstone.product_id, since, after_id))
+            .where(ProductTombstone.change_seq < watermark)
+            .where(~exists().where(Product.id == ProductTombstone.product_id))
+            .order_by(ProductTombstone.change_seq, ProductTombstone.product_id)
+            .limit(limit + 1)
+            .subquery()
+        )
+        feed = union_all(select(upserts), select(deletes)).subquery()
+        result = await db.execute(
+            select(feed.c.seq, feed.c.id, feed.c.deleted)
+            .order_by(feed.c.seq, feed.c.id)
+            .limit(limit + 1)
+        )
+        rows = [tuple(row) for row in result.all()]
+        return rows[:limit], len(rows) > limit
+
+
+# Глобальный экземпляр
+product_change_feed = ProductChangeFeed()
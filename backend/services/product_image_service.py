@@ -0,0 +1,65 @@
+from typing import Dict, List
+from sqlalchemy import select, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product, ProductImage
+from services.attribute_dictionary import AttributeDictionary
+
+
+class ProductImageService:
+    """
+    Связи товаров и изображений через таблицу product_images.
+    Все запросы — поиск по индексам (product_id, position) и (s3_key, product_id)
+    вместо разбора строки images и LIKE по всей таблице товаров.
+    """
+
+    def normalize_key(self, path: str) -> str:
+        """Ключ объекта из пути файлового менеджера (/products/a.jpg → products/a.jpg)"""
+        return path.strip().lstrip('/')
+
+    async def products_using(self, db: AsyncSession, keys: List[str]) -> Dict[str, List[int]]:
+        """id товаров для каждого ключа S3 (только для используемых ключей)"""
+        keys = [self.normalize_key(k) for k in keys if k and k.strip()]
+        if not keys:
+            return {}
+        result = await db.execute(
+            select(ProductImage.s3_key, ProductImage.product_id)
+            .where(ProductImage.s3_key.in_(keys))
+            .order_by(ProductImage.s3_key, ProductImage.product_id)
+        )
+        usage: Dict[str, List[int]] = {}
+        for key, product_id in result.all():
+            ids = usage.setdefault(key, [])
+            if not ids or ids[-1] != product_id:
+                ids.append(product_id)
+        return usage
+
+    async def unused_keys(self, db: AsyncSession, keys: List[str]) -> List[str]:
+        """Ключи, на которые не ссылается ни один товар (осиротевшие изображения)"""
+        normalized = [self.normalize_key(k) for k in keys if k and k.strip()]
+        used = await self.products_using(db, normalized)
+        return [key for key in normalized if key not in used]
+
+    async def product_images(self, db: AsyncSession, product_id: int) -> List[Dict[str, str]]:
+        """Изображения товара в порядке строки images"""
+        result = await db.execute(
+            select(ProductImage.position, ProductImage.url, ProductImage.s3_key)
+            .where(ProductImage.product_id == product_id)
+            .order_by(ProductImage.position)
+        )
+        return [
+            {"position": position, "url": url, "s3_key": s3_key}
+            for position, url, s3_key in result.all()
+        ]
+
+    async def urls_for_brands(self, db: AsyncSession, brands: List[str]) -> List[str]:
+        """Уникальные ссылки на изображения товаров выбранных брендов (для выгрузки)"""
+        result = await db.execute(
+            select(distinct(ProductImage.url))
+            .join(Product, Product.id == ProductImage.product_id)
+            .where(AttributeDictionary.in_condition("brand", brands))
+        )
+        return result.scalars().all()
+
+
+# Глобальный экземпляр
+product_image_service = ProductImageService()
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PART_NUMBER_UNIQUE_INDEX
+from services.attribute_dictionary import attribute_dictionary
+from services.excel_processor import excel_processor
+from services.parse_pool import parse_pool
+from services.product_bulk_service import product_bulk_service
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений валидации возвращать клиенту (остальные только считаются)
+MAX_REPORTED_ERRORS = 100
+
+
+class ProductImportService:
+    """
+    Импорт товаров из Excel пачками: каждая пачка строк (DataFrame из ExcelSheetStream
+    или сессии загрузки) маппится, валидируется и очищается по колонкам целиком
+    (pandas/NumPy, без обхода ячеек в Python) и записывается в текущую транзакцию
+    одним INSERT ... ON CONFLICT по артикулу. Память ограничена размером пачки,
+    а не файла. Commit выполняет вызывающий код.
+
+    Стратегии записи:
+    - upsert — INSERT ... ON CONFLICT на каждую пачку (строки передаются jsonb);
+    - copy — пачки потоком идут COPY во временную таблицу, слияние с products —
+      одна команда в конце; быстрее на прайс-листах в сотни тысяч строк и больше.
+    Если уникального индекса по артикулу нет, обе стратегии заменяются записью
+    пачек через поиск по артикулу (в результате strategy = 'lookup').
+    """
+
+    STRATEGIES = ('upsert', 'copy')
+
+    def __init__(self, chunk_size: int = 5000, strategy: str = 'upsert'):
+        self.chunk_size = chunk_size
+        self.strategy = strategy if strategy in self.STRATEGIES else 'upsert'
+        self._unique_key_ready = False
+
+    def mapped_frame(self, df: pd.DataFrame, mapping: Dict[str, str]) -> pd.DataFrame:
+        """Колонки Excel → поля товара по маппингу"""
+        df = df.rename(columns=mapping)
+        # Оставляем только замаппенные колонки; при повторе поля побеждает последняя колонка
+        mapped_columns = list(dict.fromkeys(mapping.values()))
+        existing_columns = [col for col in mapped_columns if col in df.columns]
+        df = df[existing_columns]
+        return df.loc[:, ~df.columns.duplicated(keep='last')]
+
+    def frame_records(self, df: pd.DataFrame) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Записи для вставки из таблицы после excel_processor.check_frame; возвращает
+        (валидные записи, число отброшенных строк, где не осталось ни одного значения).
+        """
+        non_empty = df.notna().any(axis=1).to_numpy()
+        df = df[non_empty].astype(object)
+        df = df.where(df.notna(), None)
+
+        # Удаляем None значения: пустая ячейка не затирает поле существующего товара
+        columns = list(df.columns)
+        valid_records = [
+            {key: value for key, value in zip(columns, row) if value is not None}
+            for row in df.itertuples(index=False, name=None)
+        ]
+        return valid_records, int((~non_empty).sum())
+
+    @staticmethod
+    def unique_records(valid_records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Одна запись на артикул (ключ — как у индекса ux_products_part_number: без
+        пробелов по краям), последняя в пачке имеет приоритет. Записи без артикула
+        остаются все — они всегда добавляются как новые товары.
+        """
+        by_part_number: Dict[str, Dict[str, Any]] = {}
+        without_part_number = []
+        for record in valid_records:
+            key = str(record.get('part_number') or '').strip(' ')
+            if key:
+                by_part_number.pop(key, None)
+                by_part_number[key] = record
+            else:
+                without_part_number.append(record)
+        return list(by_part_number.values()) + without_part_number
+
+    async def has_unique_key(self, db: AsyncSession) -> bool:
+        """
+        Есть ли уникальный индекс по артикулу (цель ON CONFLICT). Его нет, если при
+        миграции в каталоге были дубликаты артикулов — тогда импорт пишет через
+        поиск по артикулу (upsert_many_by_lookup), медленнее, но без отказа.
+        """
+        if self._unique_key_ready:
+            return True
+        result = await db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": PART_NUMBER_UNIQUE_INDEX})
+        self._unique_key_ready = bool(result.scalar())
+        if not self._unique_key_ready:
+            print(
+                f"Нет уникального индекса {PART_NUMBER_UNIQUE_INDEX} (в каталоге есть товары с одинаковым "
+                f"артикулом): импорт идет через поиск по артикулу"
+            )
+        return self._unique_key_ready
+
+    def prepare_chunk(
+        self, df: pd.DataFrame, start_row: int
+    ) -> Tuple[List[Dict[str, Any]], List[str], int, int]:
+        """
+        Вычислительная часть пачки без обращений к БД: проверка и приведение типов
+        уже замаппенной таблицы (mapped_frame) — один проход по колонкам; возвращает
+        (записи, ошибки, отброшено, строк). Номера строк в сообщениях — сквозные
+        по всему файлу (start_row).
+        """
+        df, errors = excel_processor.check_frame(df, start_row=start_row)
+        valid_records, invalid_count = self.frame_records(df)
+        return valid_records, errors, invalid_count, len(df)
+
+    @staticmethod
+    async def _call(executor: Optional[Executor], func, *args):
+        # Без пула — прямо в event loop (скрипты, бенчмарк)
+        if executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    @staticmethod
+    def summary(result: Dict[str, Any]) -> str:
+        """Сводка импорта для пользователя"""
+        inserted, updated, unchanged = result['inserted'], result['updated'], result['unchanged']
+        total_processed = inserted + updated + unchanged
+        if total_processed == 0:
+            return "Не было обработано ни одного товара"
+        summary = f"Импорт завершен успешно! Всего обработано: {total_processed} товаров"
+        if inserted > 0:
+            summary += f", добавлено новых: {inserted}"
+        if updated > 0:
+            summary += f", обновлено существующих: {updated}"
+        if unchanged > 0:
+            summary += f", без изменений: {unchanged}"
+        return summary
+
+    async def run(
+        self,
+        db: AsyncSession,
+        chunks: Iterable[pd.DataFrame],
+        mapping: Dict[str, str],
+        strategy: Optional[str] = None,
+        executor: Optional[Executor] = None,
+        progress: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Импорт всех пачек в текущей транзакции (без commit); strategy — из STRATEGIES.
+        executor — пул потоков для чтения пачек; prepare_chunk выполняется в parse_pool
+        (процессы), поэтому ни чтение, ни проверка пачек не занимают event loop.
+        В процесс пула уходят только замаппенные колонки пачки: pickle всей таблицы
+        листа с лишними колонками стоил бы больше самой проверки.
+        progress(phase, result) вызывается после каждой пачки ('writing') и перед
+        слиянием staging ('merging').
+        """
+        strategy = strategy or self.strategy
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"неизвестная стратегия импорта {strategy}, допустимы: {', '.join(self.STRATEGIES)}")
+        if not await self.has_unique_key(db):
+            # Без индекса ON CONFLICT недоступен ни для upsert, ни для слияния staging
+            strategy = 'lookup'
+        result = {
+            'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'invalid': 0,
+            'errors': [], 'error_count': 0, 'strategy': strategy,
+        }
+        staged = 0
+        if strategy == 'copy':
+            await product_bulk_service.create_staging(db)
+
+        iterator = iter(chunks)
+        chunk_number = 0
+        while True:
+            df = await self._call(executor, next, iterator, None)
+            if df is None:
+                break
+            chunk_number += 1
+            valid_records, errors, invalid_count, rows = await parse_pool.run(
+                self.prepare_chunk, self.mapped_frame(df, mapping), result['rows'] + 2, wait=True
+            )
+            result['error_count'] += len(errors)
+            result['errors'].extend(errors[:MAX_REPORTED_ERRORS - len(result['errors'])])
+            result['rows'] += rows
+            result['invalid'] += invalid_count
+
+            # Значения brand/color/type/gender/shape → id справочников
+            # через кеш в памяти (в БД уходят только новые значения)
+            await attribute_dictionary.resolve_records(db, valid_records)
+
+            if strategy == 'copy':
+                # Только COPY в staging; повторы артикула между пачками разрешит слияние
+                await product_bulk_service.copy_to_staging(db, valid_records, first_seq=staged)
+                staged += len(valid_records)
+                logger.debug(
+                    "Пачка %s: строк %s, в staging %s, ошибок валидации %s",
+                    chunk_number, result['rows'], staged, result['error_count'],
+                )
+                if progress:
+                    await progress('writing', result)
+                continue
+
+            # Один INSERT ... ON CONFLICT на пачку: точные счетчики без загрузки ORM-объектов
+            records = self.unique_records(valid_records)
+            if strategy == 'lookup':
+                inserted, updated = await product_bulk_service.upsert_many_by_lookup(db, records)
+            else:
+                inserted, updated = await product_bulk_service.upsert_many(db, records)
+            result['inserted'] += inserted
+            result['updated'] += updated
+            result['unchanged'] += len(records) - inserted - updated
+            logger.debug(
+                "Пачка %s: строк %s, добавлено %s, обновлено %s, ошибок валидации %s",
+                chunk_number, result['rows'], result['inserted'], result['updated'], result['error_count'],
+            )
+            if progress:
+                await progress('writing', result)
+
+        if strategy == 'copy':
+            if progress:
+                await progress('merging', result)
+            result['inserted'], result['updated'], result['unchanged'] = await product_bulk_service.merge_staging(db)
+            logger.debug(
+                "Staging слит: добавлено %s, обновлено %s, без изменений %s",
+                result['inserted'], result['updated'], result['unchanged'],
+            )
+        return result
+
+
+# Глобальный экземпляр
+product_import_service = ProductImportService(
+    chunk_size=int(os.getenv("EXCEL_CHUNK_ROWS", "5000")),
+    strategy=os.getenv("IMPORT_STRATEGY", "upsert"),
+)
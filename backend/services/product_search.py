@@ -0,0 +1,50 @@
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import func, literal, literal_column, or_
+from sqlalchemy.sql.elements import ColumnElement
+from models import Product, SEARCH_TEXT_SQL
+
+# Токены для tsquery: буквы и цифры (в т.ч. кириллица), без спецсимволов tsquery
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Выражение подстрочного поиска; совпадает с выражением индекса ix_products_search_trgm
+_search_text = literal_column(SEARCH_TEXT_SQL)
+
+
+class ProductSearch:
+    """
+    Поиск товаров по part_name, part_number, brand, color и manufacturer_name.
+    Полнотекстовое совпадение с префиксами (GIN по search_vector) объединяется
+    с подстрочным ILIKE (GIN pg_trgm), релевантность — ts_rank_cd по весам полей.
+    """
+
+    def tokenize(self, term: str) -> List[str]:
+        return _TOKEN_RE.findall(term.lower())
+
+    def build_tsquery(self, term: str) -> Optional[ColumnElement]:
+        """Префиксный tsquery вида 'rb:* & 3025:*' или None, если в строке нет слов"""
+        tokens = self.tokenize(term)
+        if not tokens:
+            return None
+        query_text = " & ".join(f"{token}:*" for token in tokens)
+        return func.to_tsquery(literal_column("'simple'::regconfig"), query_text)
+
+    def build(self, term: str) -> Tuple[ColumnElement, ColumnElement]:
+        """
+        Возвращает (условие WHERE, выражение релевантности).
+        Строки, найденные только по подстроке, получают релевантность 0.
+        """
+        pattern = f"%{term.strip()}%"
+        substring_match = _search_text.ilike(pattern)
+
+        tsquery = self.build_tsquery(term)
+        if tsquery is None:
+            return substring_match, literal(0.0)
+
+        condition = or_(Product.search_vector.op("@@")(tsquery), substring_match)
+        rank = func.ts_rank_cd(Product.search_vector, tsquery)
+        return condition, rank
+
+
+# Глобальный экземпляр
+product_search = ProductSearch()
@@ -2,7 +2,8 @@ import boto3
 from botocore.config import Config
 import zipfile
 import io
-from typing import List, Dict
+from typing import List, Dict, Optional
+from urllib.parse import urlparse, unquote
 import os
 from datetime import datetime
 import hashlib
@@ -11,6 +12,8 @@ class S3Service:
     def __init__(self):
         # Настройки для TWC Storage (S3-совместимое хранилище)
         endpoint_url = os.getenv('S3_ENDPOINT_URL')
+        # Размер пула HTTP-соединений boto3 (по умолчанию 10 — мало для параллельных операций)
+        max_pool_connections = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '50'))
         
         if endpoint_url:
             # Для S3-совместимых хранилищ (TWC Storage)
@@ -20,7 +23,7 @@ class S3Service:
                 aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                 aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
                 region_name=os.getenv('AWS_REGION', 'ru-1'),
-                config=Config(signature_version='s3v4')
+                config=Config(signature_version='s3v4', max_pool_connections=max_pool_connections)
             )
         else:
             # Для оригинального AWS S3
@@ -29,7 +32,7 @@ class S3Service:
                 aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                 aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
                 region_name=os.getenv('AWS_REGION', 'us-east-1'),
-                config=Config(signature_version='s3v4')
+                config=Config(signature_version='s3v4', max_pool_connections=max_pool_connections)
             )
         
         self.bucket = os.getenv('S3_BUCKET_NAME', 'ai-database-images')
@@ -52,6 +55,67 @@ class S3Service:
             else:
                 return f"https://{self.bucket}.s3.amazonaws.com/{key}"
 
+    def key_from_url(self, url: str) -> Optional[str]:
+        """
+        Возвращает ключ объекта, если ссылка указывает на наш бакет (прямой путь,
+        virtual-hosted или presigned URL), либо если это уже ключ без схемы.
+        Для чужих ссылок возвращает None.
+        """
+        if not url:
+            return None
+        parsed = urlparse(url.strip())
+        if not parsed.scheme:
+            return unquote(parsed.path).lstrip('/') or None
+
+        path = unquote(parsed.path).lstrip('/')
+        host = parsed.netloc.lower()
+        endpoint_host = urlparse(self.endpoint_url).netloc.lower() if self.endpoint_url else None
+        bucket = self.bucket.lower()
+
+        # virtual-hosted стиль: <bucket>.s3.amazonaws.com/<key> или <bucket>.<endpoint>/<key>
+        if host.startswith(f"{bucket}.") and (
+            host.endswith("amazonaws.com") or (endpoint_host and host.endswith(endpoint_host))
+        ):
+            return path or None
+        # path стиль: <endpoint>/<bucket>/<key>
+        if (host == endpoint_host or host.endswith("amazonaws.com")) and path.startswith(f"{self.bucket}/"):
+            return path[len(self.bucket) + 1:] or None
+        return None
+
+    async def get_object_bytes(self, key: str) -> bytes:
+        """Скачивание объекта по ключу без блокировки event loop"""
+        import asyncio
+
+        def op():
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+            return response['Body'].read()
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, op)
+
+    async def upload_file(self, local_path: str, key: str, content_type: str = 'application/octet-stream') -> str:
+        """Загрузка файла с диска (multipart для больших файлов) без блокировки event loop"""
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None,
+            lambda: self.s3.upload_file(local_path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+        )
+        return key
+
+    def build_download_url(self, key: str, filename: str, expires_in: int = 60 * 60) -> str:
+        """Presigned URL для скачивания объекта под указанным именем файла"""
+        return self.s3.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': key,
+                'ResponseContentDisposition': f'attachment; filename="{filename}"'
+            },
+            ExpiresIn=expires_in
+        )
+
     async def upload_images_from_zip(self, zip_content: bytes) -> Dict[str, List[str]]:
         """Распаковка ZIP и загрузка изображений в S3"""
         uploaded = []
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from services.excel_stream_reader import excel_stream_reader
+
+
+class UploadSessionExpired(Exception):
+    """Сессия загрузки не найдена или истек ее срок"""
+    pass
+
+
+class UploadSessionStore:
+    """
+    Сессии загрузки Excel между /upload/excel и /upload/confirm-mapping.
+    По хешу содержимого файла хранятся: исходный файл и предпросмотр (сразу при загрузке),
+    затем — разобранная и очищенная таблица в Parquet (build_frame в фоне). Разбор
+    (analyze_source, build_frame) выполняется в пуле процессов parse_pool. Повторная
+    загрузка того же файла не разбирается заново; сессия — JSON с upload_id, хешем
+    и владельцем. Пока Parquet не готов, импорт читает исходный файл потоково.
+    Таблица пишется и читается пачками (row group), поэтому память не зависит
+    от размера файла. Файлы старше TTL удаляются при создании новых сессий.
+    Хранилище — локальный каталог, поэтому сессии видны всем воркерам одного хоста.
+    """
+
+    def __init__(self, ttl_minutes: int = 60, storage_dir: Optional[str] = None):
+        self.ttl_seconds = ttl_minutes * 60
+        # UPLOAD_STORAGE_DIR — например, том вне каталога приложения; иначе backend/uploads
+        self.storage_dir = Path(storage_dir) if storage_dir else Path(__file__).parent.parent / "uploads"
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def _source_path(self, content_hash: str, filename: str) -> Path:
+        # Расширение исходного файла сохраняется: по нему openpyxl/pandas выбирают формат
+        suffix = '.xls' if filename.lower().endswith('.xls') else '.xlsx'
+        return self.storage_dir / f"{content_hash}.source{suffix}"
+
+    def _frame_path(self, content_hash: str) -> Path:
+        return self.storage_dir / f"{content_hash}.parquet"
+
+    def _analysis_path(self, content_hash: str) -> Path:
+        return self.storage_dir / f"{content_hash}.json"
+
+    def _session_path(self, upload_id: str) -> Path:
+        return self.storage_dir / f"session-{upload_id}.json"
+
+    def _fresh(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime < self.ttl_seconds
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _write_json(path: Path, data: Dict[str, Any]) -> None:
+        # Запись через временный файл: параллельный читатель не увидит половину JSON
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _column_array(series: pd.Series) -> pa.Array:
+        # Ячейки хранятся текстом: тип колонки в Excel может меняться от пачки к пачке,
+        # а схема Parquet общая. Числа и даты приводятся при импорте, как и раньше.
+        return pa.array(series.where(series.isna(), series.astype(str)), type=pa.string(), from_pandas=True)
+
+    def _write_frame(self, path: Path, stream) -> Dict[str, Any]:
+        """Пишет пачки ExcelSheetStream в Parquet и возвращает анализ структуры"""
+        # Колонки хранятся по позиции: заголовки Excel могут повторяться,
+        # настоящие названия лежат в JSON анализа
+        schema = pa.schema([(f"c{i}", pa.string()) for i in range(stream.width)])
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        head = None
+        with pq.ParquetWriter(tmp, schema, compression="snappy") as writer:
+            for chunk in stream.chunks():
+                if head is None:
+                    head = chunk.head(3)
+                writer.write_table(pa.Table.from_arrays(
+                    [self._column_array(chunk.iloc[:, i]) for i in range(stream.width)], schema=schema
+                ))
+        os.replace(tmp, path)
+
+        positions = stream.available_positions
+        sample = head.iloc[:, positions] if head is not None else pd.DataFrame()
+        return {
+            'available_columns': stream.available_columns,
+            'positions': positions,
+            'structure_info': stream.structure_info(),
+            'sample_data': sample.where(sample.notna(), None).to_dict('records'),
+        }
+
+    def cached_analysis(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Предпросмотр или полный разбор того же файла, если он еще не истек"""
+        analysis_path = self._analysis_path(content_hash)
+        if not self._fresh(analysis_path):
+            return None
+        analysis = json.loads(analysis_path.read_text(encoding="utf-8"))
+        # Разбор в старом формате (без признака готовности) делается заново
+        if 'ready' not in analysis:
+            return None
+        data_path = (
+            self._frame_path(content_hash) if analysis['ready']
+            else self._source_path(content_hash, analysis['filename'])
+        )
+        return analysis if self._fresh(data_path) else None
+
+    def save_source(self, content_hash: str, filename: str, content: bytes) -> None:
+        """Сохраняет исходный файл; предпросмотр строит analyze_source, таблицу — build_frame"""
+        self.cleanup_expired()
+        source_path = self._source_path(content_hash, filename)
+        tmp = source_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, source_path)
+
+    def analyze_source(self, content_hash: str, filename: str) -> Dict[str, Any]:
+        """
+        Быстрый предпросмотр сохраненного файла (заголовок, колонки, примеры строк).
+        Читает файл с диска, а не из памяти запроса: в пул процессов передаются
+        только хеш и имя файла.
+        """
+        preview = excel_stream_reader.preview(self._source_path(content_hash, filename), filename)
+        analysis = {**preview, 'filename': filename, 'ready': False}
+        self._write_json(self._analysis_path(content_hash), analysis)
+        return analysis
+
+    def build_frame(self, content_hash: str) -> None:
+        """
+        Полный потоковый разбор исходного файла в Parquet (фоновая задача после ответа
+        /upload/excel). При ошибке сессия продолжает работать через исходный файл.
+        """
+        analysis_path = self._analysis_path(content_hash)
+        try:
+            analysis = json.loads(analysis_path.read_text(encoding="utf-8"))
+            if analysis.get('ready'):
+                return
+            stream = excel_stream_reader.open(self._source_path(content_hash, analysis['filename']), analysis['filename'])
+            full = self._write_frame(self._frame_path(content_hash), stream)
+            self._write_json(analysis_path, {**full, 'filename': analysis['filename'], 'ready': True})
+        except Exception as e:
+            print(f"Не удалось подготовить таблицу загрузки {content_hash}: {e}")
+
+    def create(self, content_hash: str, filename: str, user_id: int) -> str:
+        """Создает сессию для файла, сохраненного save_source (или ранее загруженного)"""
+        # Продлеваем жизнь сохраненного разбора вместе с новой сессией
+        paths = (self._analysis_path(content_hash), self._source_path(content_hash, filename), self._frame_path(content_hash))
+        for path in paths:
+            if path.exists():
+                os.utime(path)
+
+        upload_id = uuid.uuid4().hex
+        self._write_json(self._session_path(upload_id), {
+            'upload_id': upload_id,
+            'content_hash': content_hash,
+            'filename': filename,
+            'user_id': user_id,
+            'created_at': time.time(),
+        })
+        return upload_id
+
+    def load(self, upload_id: str, user_id: int) -> Dict[str, Any]:
+        """Сессия и анализ структуры; строки таблицы — через iter_chunks"""
+        session_path = self._session_path(upload_id)
+        if not upload_id.isalnum() or not self._fresh(session_path):
+            raise UploadSessionExpired("Сессия загрузки не найдена или истекла, загрузите файл заново")
+        session = json.loads(session_path.read_text(encoding="utf-8"))
+        if session['user_id'] != user_id:
+            raise UploadSessionExpired("Сессия загрузки не найдена или истекла, загрузите файл заново")
+
+        content_hash = session['content_hash']
+        analysis = self.cached_analysis(content_hash)
+        if analysis is None:
+            raise UploadSessionExpired("Сессия загрузки не найдена или истекла, загрузите файл заново")
+        return {**session, **analysis}
+
+    def iter_chunks(
+        self, session: Dict[str, Any], chunk_size: int, columns: Optional[List[str]] = None
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Таблица сессии пачками по chunk_size строк: из Parquet или, пока он не готов,
+        из исходного файла. columns — только эти колонки Excel (например, замаппенные);
+        из Parquet остальные колонки не читаются вовсе.
+        """
+        content_hash = session['content_hash']
+        analysis = self.cached_analysis(content_hash)
+        if analysis is None:
+            raise UploadSessionExpired("Сессия загрузки не найдена или истекла, загрузите файл заново")
+        if not analysis['ready']:
+            for df in excel_stream_reader.open(
+                self._source_path(content_hash, analysis['filename']), analysis['filename'], chunk_size
+            ).chunks():
+                yield df if columns is None else df.loc[:, df.columns.isin(columns)]
+            return
+
+        selected = [
+            (name, position) for name, position in zip(analysis['available_columns'], analysis['positions'])
+            if columns is None or name in columns
+        ]
+        names = [name for name, _ in selected]
+        parquet = pq.ParquetFile(self._frame_path(content_hash))
+        parquet_columns = [f"c{position}" for _, position in selected]
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=parquet_columns):
+            df = batch.to_pandas().astype(object)
+            df.columns = names
+            yield df.where(df.notna(), np.nan)
+
+    def cleanup_expired(self) -> None:
+        """Удаляет сессии и сохраненные таблицы старше TTL"""
+        for path in self.storage_dir.iterdir():
+            if path.is_file() and not self._fresh(path):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+# Глобальный экземпляр
+upload_session_store = UploadSessionStore(
+    ttl_minutes=int(os.getenv("UPLOAD_SESSION_TTL_MINUTES", "60")),
+    storage_dir=os.getenv("UPLOAD_STORAGE_DIR"),
+)
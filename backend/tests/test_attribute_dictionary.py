@@ -0,0 +1,50 @@
+import re
+import sys
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from models import ATTR_WHITESPACE_PATTERN, PRODUCT_ATTR_FUNCTIONS_SQL, PRODUCT_FACETS_BACKFILL_SQL
+from services.attribute_dictionary import AttributeDictionary
+from services.export_service import export_service
+
+WHITESPACE = [chr(code) for code in range(sys.maxunicode + 1) if chr(code).isspace()]
+
+
+def test_pattern_covers_exactly_python_whitespace():
+    """Класс пробелов — ровно str.isspace(), как у прежнего str.split()"""
+    pattern = re.compile(ATTR_WHITESPACE_PATTERN)
+    matched = [chr(code) for code in range(sys.maxunicode + 1) if pattern.fullmatch(chr(code))]
+    assert matched == WHITESPACE
+
+
+def test_sql_function_uses_the_same_pattern():
+    assert f"regexp_replace(v, '{ATTR_WHITESPACE_PATTERN}', ' ', 'g')" in PRODUCT_ATTR_FUNCTIONS_SQL[0]
+    # \s в PostgreSQL зависит от локали — в функции его быть не должно
+    assert "\\s" not in PRODUCT_ATTR_FUNCTIONS_SQL[0]
+
+
+@pytest.mark.parametrize("space", WHITESPACE, ids=lambda c: f"U+{ord(c):04X}")
+def test_any_whitespace_gives_the_same_key(space):
+    assert AttributeDictionary.normalize(f"{space}Ray{space}{space}Ban{space}") == "ray ban"
+    assert AttributeDictionary.canonical(f"Ray{space}Ban") == "Ray Ban"
+
+
+@pytest.mark.parametrize("value", [None, "", " ", "\xa0\t"])
+def test_empty_values(value):
+    assert AttributeDictionary.canonical(value) is None
+    assert AttributeDictionary.normalize(value) is None
+
+
+def test_export_selects_brands_by_dictionary_id():
+    """Экспорт выбирает товары по id справочника, как фильтры и фасеты, а не по строке"""
+    sql = str(export_service.build_query(["Ray\xa0Ban"], ["brand"]).compile(dialect=postgresql.dialect()))
+    assert "products.brand_id IN (SELECT product_brands.id" in sql
+    assert "products.brand IN" not in sql
+
+
+def test_facet_counts_group_dictionary_fields_by_id():
+    assert "('brand', p.brand_id::text)" in PRODUCT_FACETS_BACKFILL_SQL
+    assert "('color', p.color_id::text)" in PRODUCT_FACETS_BACKFILL_SQL
+    # category справочника не имеет и считается по строке
+    assert "('category', p.category)" in PRODUCT_FACETS_BACKFILL_SQL
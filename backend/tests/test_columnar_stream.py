@@ -0,0 +1,89 @@
+import csv
+from io import BytesIO, StringIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from services.export_service import export_service
+from utils.columnar_stream import CsvStreamWriter, ParquetStreamWriter, arrow_type_for
+from utils.xlsx_stream import ChunkBuffer
+
+
+def test_csv_round_trip():
+    buffer = ChunkBuffer()
+    writer = CsvStreamWriter(buffer, ["ID", "Название", "Ширина"])
+    writer.write_row([1, 'Очки "Aviator", золото', 50.5])
+    writer.write_rows([[2, "две\nстроки", ""], [3, "", 52]])
+    writer.close()
+
+    rows = list(csv.reader(StringIO(buffer.drain().decode("utf-8"))))
+    assert rows == [
+        ["ID", "Название", "Ширина"],
+        ["1", 'Очки "Aviator", золото', "50.5"],
+        ["2", "две\nстроки", ""],
+        ["3", "", "52"],
+    ]
+
+
+def test_parquet_round_trip_across_row_groups():
+    buffer = ChunkBuffer()
+    types = [arrow_type_for("int"), arrow_type_for("str"), arrow_type_for("float")]
+    writer = ParquetStreamWriter(buffer, ["ID", "Название", "Ширина"], types, row_group_size=3)
+    rows = [[i, f"товар {i}" if i % 4 else None, i / 2 if i % 3 else None] for i in range(10)]
+    for start in range(0, len(rows), 2):
+        writer.write_rows(rows[start:start + 2])
+    writer.close()
+
+    parquet = pq.ParquetFile(BytesIO(buffer.drain()))
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.schema.types == [pa.int64(), pa.string(), pa.float64()]
+    assert [list(row.values()) for row in table.to_pylist()] == rows
+
+
+def test_export_writer_types_follow_product_columns():
+    fields, headers = export_service.columns_for([
+        {"field": "part_number"}, {"field": "width"}, {"field": "year"},
+        {"field": "category"}, {"field": "description", "display_name": "Описание"},
+    ])
+    buffer = ChunkBuffer()
+    writer = export_service.open_writer("parquet", buffer, fields, headers)
+    writer.write_rows([["A1", 50.5, 2020, "category/Gucci", writer.empty_value]])
+    writer.close()
+
+    table = pq.read_table(BytesIO(buffer.drain()))
+    assert table.column_names == ["Номер детали", "Ширина", "Год", "Категория", "Описание"]
+    assert table.schema.types == [pa.string(), pa.float64(), pa.int64(), pa.string(), pa.string()]
+    assert table.to_pylist() == [{
+        "Номер детали": "A1", "Ширина": 50.5, "Год": 2020, "Категория": "category/Gucci", "Описание": None,
+    }]
+
+
+def test_arrow_columns_match_cell_formatting():
+    """Parquet собирает колонки через pyarrow.compute — значения те же, что у CSV/XLSX"""
+    columns = {
+        "id": (1, 2, 3, 4),
+        "brand": ("Gucci", None, "", "Prada"),
+        "part_number": ("A1", "", None, "B2"),
+        "width": (50.5, None, 52.0, 0.0),
+        "images": ("a.jpg, b", None, "", " x.png ,y.jpg,"),
+    }
+    fields = ["id", "category", "part_number", "width", "images", "description"]
+    types = [pa.int64(), pa.string(), pa.string(), pa.float64(), pa.string(), pa.string()]
+
+    arrays = export_service.arrow_columns(columns, fields, types)
+    assert [array.to_pylist() for array in arrays] == export_service.format_columns(columns, fields, None)
+    assert arrays[4].to_pylist() == ["a.jpg, b.jpg", None, None, "x.png.jpg, y.jpg, .jpg"]
+
+
+def test_parquet_writer_accepts_columns_and_rows():
+    buffer = ChunkBuffer()
+    writer = ParquetStreamWriter(buffer, ["ID", "Название"], [pa.int64(), pa.string()], row_group_size=4)
+    writer.write_columns([pa.array([1, 2], type=pa.int64()), ["a", None]])
+    writer.write_rows([[3, "c"], [4, "d"]])
+    writer.write_columns([[5], ["e"]])
+    writer.close()
+
+    parquet = pq.ParquetFile(BytesIO(buffer.drain()))
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.read().column("Название").to_pylist() == ["a", None, "c", "d", "e"]
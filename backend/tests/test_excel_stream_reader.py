@@ -0,0 +1,98 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from services.advanced_excel_processor import advanced_excel_processor
+from services.excel_stream_reader import excel_stream_reader
+
+
+def _xlsx(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+SHEETS = {
+    "header_first": [
+        ["Артикул", "Бренд", "Цвет", "Ширина"],
+        ["A1", "Ray-Ban", "черный", 50.5],
+        ["A2", "Gucci", None, 52],
+    ],
+    "title_rows": [
+        ["Прайс-лист на 01.10"],
+        [],
+        ["Артикул", "Бренд", "Цвет", "Год", "Цена"],
+        ["A1", "Ray-Ban", "черный", 2020, 100],
+        ["A2", "Gucci", "красный", 2021, 200],
+    ],
+    "empty_rows_and_column": [
+        ["Артикул", "Пустая", "Бренд", "Описание"],
+        ["A1", None, "Ray-Ban", "очки"],
+        [None, None, None, None],
+        ["A2", None, "Gucci", None],
+        [],
+        ["A3", None, None, "оправа"],
+        [],
+        [],
+    ],
+}
+
+
+@pytest.fixture(params=sorted(SHEETS))
+def sheet(request):
+    content = _xlsx(SHEETS[request.param])
+    return content, advanced_excel_processor.process_excel_advanced(content, "a.xlsx")
+
+
+def _plain(df):
+    """Пустые ячейки → None, чтобы сравнивать таблицы без оглядки на NaN и dtype"""
+    return df.astype(object).where(df.notna(), None)
+
+
+def _stream_frame(stream):
+    chunks = list(stream.chunks())
+    df = pd.concat(chunks, ignore_index=True)
+    return df.iloc[:, stream.available_positions]
+
+
+def test_stream_matches_full_read(sheet):
+    content, expected = sheet
+    stream = excel_stream_reader.open(content, "a.xlsx", chunk_size=2)
+    df = _stream_frame(stream)
+
+    assert stream.header_row == expected['structure_info']['header_row']
+    assert stream.available_columns == expected['available_columns']
+    info = stream.structure_info()
+    for key in ('header_row', 'data_start_row', 'total_rows', 'total_columns', 'empty_rows'):
+        assert info[key] == expected['structure_info'][key], key
+
+    reference = expected['dataframe'].reset_index(drop=True)
+    assert df.shape == reference.shape
+    assert _plain(df).values.tolist() == _plain(reference).values.tolist()
+
+
+def test_preview_matches_full_read(sheet):
+    content, expected = sheet
+    preview = excel_stream_reader.preview(content, "a.xlsx")
+
+    assert preview['structure_info']['header_row'] == expected['structure_info']['header_row']
+    assert preview['available_columns'] == expected['available_columns']
+    assert preview['sample_data'] == _plain(expected['dataframe'].head(3)).to_dict('records')
+
+
+def test_na_strings_match_pandas_defaults():
+    """NA_STRINGS — тот же список, что pandas по умолчанию считает пустой ячейкой"""
+    from io import StringIO
+
+    from services.excel_stream_reader import NA_STRINGS
+
+    tokens = sorted(NA_STRINGS - {''})
+    parsed = pd.read_csv(StringIO("\n".join(["value"] + tokens + ["NA-не"])), dtype=object)['value']
+    assert parsed[:-1].isna().all()
+    assert parsed.iloc[-1] == "NA-не"
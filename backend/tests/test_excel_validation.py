@@ -0,0 +1,131 @@
+import math
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.excel_processor import INTEGER_MAX, INTEGER_MIN, excel_processor
+
+STRING_FIELDS = [
+    'manufacturer_name', 'part_number', 'part_name', 'category', 'type', 'size',
+    'color', 'brand', 'producer', 'gender', 'age', 'shape',
+]
+
+# Ячейки, как они приходят из Excel: числа, строки с числами и без, пустые, даты
+CELLS = [
+    None, np.nan, 0, 1, -3, 2020, 2020.0, 2020.5, 1e300, float('inf'), True,
+    '', ' ', '12', ' 12 ', '+7', '-0', '12.5', '1e3', '1,5', 'abc', 'nan', 'inf',
+    '1_000', '٣', '2020.0', '0x10', datetime(2024, 1, 1),
+    3000000000, '99999999999', 2 ** 31 - 1, -2 ** 31, 2 ** 31,
+]
+
+
+def legacy_validate(records, start_row=2):
+    """Проверка по строкам в том виде, в каком она была до check_frame"""
+    errors = []
+    for i, record in enumerate(records):
+        row_num = i + start_row
+        if 'width' in record and record['width'] is not None:
+            try:
+                float(record['width'])
+            except (ValueError, TypeError):
+                errors.append(f"Строка {row_num}: width должен быть числом")
+        if 'height' in record and record['height'] is not None:
+            try:
+                float(record['height'])
+            except (ValueError, TypeError):
+                errors.append(f"Строка {row_num}: height должен быть числом")
+        if 'year' in record and record['year'] is not None:
+            try:
+                int(record['year'])
+            except (ValueError, TypeError):
+                errors.append(f"Строка {row_num}: year должен быть целым числом")
+        for field in STRING_FIELDS:
+            if field in record and record[field] is not None:
+                if len(str(record[field])) > 255:
+                    errors.append(f"Строка {row_num}: {field} слишком длинный (макс 255 символов)")
+    return errors
+
+
+def _records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _python(convert, value):
+    try:
+        return convert(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def _fits_integer(cell):
+    # Целые вне INTEGER базы (3000000000, 1e300) check_frame намеренно считает
+    # ошибкой: раньше они проходили проверку и роняли INSERT всего импорта,
+    # а inf ронял сам старый валидатор (OverflowError)
+    try:
+        value = int(cell)
+    except OverflowError:
+        return False
+    except (ValueError, TypeError):
+        return True
+    return INTEGER_MIN <= value <= INTEGER_MAX
+
+
+def test_validation_matches_legacy_validator():
+    n = len(CELLS)
+    df = pd.DataFrame({
+        'width': pd.Series(CELLS, dtype=object),
+        'height': pd.Series(CELLS[::-1], dtype=object),
+        'year': pd.Series([cell for cell in CELLS[3:] + CELLS[:3] if _fits_integer(cell)] + [None], dtype=object),
+        'brand': pd.Series(['x' * 256 if i % 3 == 0 else 'Ray-Ban' for i in range(n)], dtype=object),
+        'color': pd.Series([None if i % 2 else 'y' * 300 for i in range(n)], dtype=object),
+    })
+    assert excel_processor.check_frame(df, start_row=10)[1] == legacy_validate(_records(df), start_row=10)
+
+
+@pytest.mark.parametrize('cell', CELLS, ids=repr)
+def test_to_float_matches_float(cell):
+    values, invalid = excel_processor.to_float(pd.Series([cell], dtype=object))
+    if pd.isna(cell):
+        assert not invalid[0]
+        return
+    expected = _python(float, cell)
+    assert invalid[0] == (expected is None)
+    if expected is not None:
+        assert values[0] == expected or (math.isnan(values[0]) and math.isnan(expected))
+
+
+@pytest.mark.parametrize('cell', CELLS, ids=repr)
+def test_to_int_matches_int(cell):
+    values, invalid = excel_processor.to_int(pd.Series([cell], dtype=object))
+    if pd.isna(cell):
+        assert not invalid[0]
+        return
+    expected = _python(int, cell)
+    if not _fits_integer(cell):
+        expected = None
+    assert invalid[0] == (expected is None)
+    if expected is not None:
+        assert values[0] == expected
+
+
+def test_check_frame_cleans_values():
+    df = pd.DataFrame({
+        'width': pd.Series(['12.5', 'abc', None, float('inf')], dtype=object),
+        'year': pd.Series(['2020', 2021.7, '2020.5', None], dtype=object),
+        'part_name': pd.Series(['  ', 'a' * 300, 'Очки', None], dtype=object),
+    })
+    cleaned, errors = excel_processor.check_frame(df)
+    assert cleaned['width'].tolist()[0] == 12.5
+    assert cleaned['width'].isna().tolist() == [False, True, True, True]
+    assert cleaned['year'].tolist()[:2] == [2020, 2021]
+    assert cleaned['year'].isna().tolist() == [False, False, True, True]
+    assert pd.isna(cleaned['part_name'].tolist()[0])
+    assert cleaned['part_name'].tolist()[1] == 'a' * 255
+    assert cleaned['part_name'].tolist()[2] == 'Очки'
+    assert errors == [
+        "Строка 3: width должен быть числом",
+        "Строка 3: part_name слишком длинный (макс 255 символов)",
+        "Строка 4: year должен быть целым числом",
+    ]
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, insert, select
+from sqlalchemy.dialects import postgresql
+
+from utils.pagination import InvalidCursorError, decode_cursor, encode_cursor, keyset_segments
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("brand", "asc", "Оптика", 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, "brand", "asc") == ("Оптика", 42)
+
+
+def test_cursor_with_null_value():
+    cursor = encode_cursor("color", "desc", None, 7)
+    assert decode_cursor(cursor, "color", "desc") == (None, 7)
+
+
+def test_cursor_for_other_sort_is_rejected():
+    cursor = encode_cursor("brand", "asc", "A", 1)
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, "brand", "desc")
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, "year", "asc")
+
+
+@pytest.mark.parametrize("cursor", ["", "не-base64", "e30"])
+def test_broken_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, "brand", "asc")
+
+
+ROWS = [
+    (1, "B"), (2, None), (3, "A"), (4, "B"), (5, None),
+    (6, "C"), (7, "A"), (8, None), (9, "B"), (10, "C"),
+]
+
+
+@pytest.fixture
+def items():
+    engine = create_engine("sqlite://")
+    table = Table("items", MetaData(), Column("id", Integer, primary_key=True), Column("color", String))
+    table.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(table), [{"id": id_, "color": color} for id_, color in ROWS])
+    with engine.connect() as conn:
+        yield conn, table
+
+
+def _pg_order(table, sort_order):
+    # Порядок PostgreSQL по умолчанию: NULLS LAST для ASC, NULLS FIRST для DESC
+    if sort_order == "desc":
+        return [table.c.color.desc().nulls_first(), table.c.id.desc()]
+    return [table.c.color.asc().nulls_last(), table.c.id.asc()]
+
+
+@pytest.mark.parametrize("sort_order", ["asc", "desc"])
+@pytest.mark.parametrize("page_size", [1, 2, 3, 4])
+def test_keyset_pages_cover_all_rows_with_nulls(items, sort_order, page_size):
+    conn, table = items
+    expected = conn.execute(select(table.c.id).order_by(*_pg_order(table, sort_order))).scalars().all()
+
+    seen = []
+    cursor = None
+    while True:
+        query = select(table.c.id, table.c.color).order_by(*_pg_order(table, sort_order))
+        segments = [query]
+        if cursor:
+            value, last_id = decode_cursor(cursor, "color", sort_order)
+            segments = keyset_segments(query, table.c.color, table.c.id, sort_order, value, last_id)
+        # Как в GET /products: следующий сегмент — только если страница не набрана
+        page = []
+        for segment in segments:
+            page.extend(conn.execute(segment.limit(page_size - len(page))).all())
+            if len(page) == page_size:
+                break
+        if not page:
+            break
+        seen.extend(row.id for row in page)
+        cursor = encode_cursor("color", sort_order, page[-1].color, page[-1].id)
+
+    assert seen == expected
+
+
+@pytest.mark.parametrize("sort_order, expected", [("asc", [4, 5]), ("desc", [2, 1])])
+def test_keyset_by_id(items, sort_order, expected):
+    conn, table = items
+    [query] = keyset_segments(select(table.c.id), table.c.id, table.c.id, sort_order, None, 3)
+    ids = conn.execute(query.order_by(*_pg_order(table, sort_order)[1:]).limit(2)).scalars().all()
+    assert ids == expected
+
+
+@pytest.mark.parametrize("sort_order", ["asc", "desc"])
+@pytest.mark.parametrize("value", ["B", None])
+def test_keyset_conditions_are_index_bounds(sort_order, value):
+    """
+    Каждый сегмент — условие, которое PostgreSQL берет границей индекса (color, id):
+    сравнение строк или IS [NOT] NULL с id, без OR (с OR индекс читается с начала)
+    """
+    table = Table("items", MetaData(), Column("id", Integer, primary_key=True), Column("color", String))
+    for segment in keyset_segments(select(table.c.id), table.c.color, table.c.id, sort_order, value, 5):
+        where = str(segment.whereclause.compile(dialect=postgresql.dialect()))
+        assert " OR " not in where
+        if value is not None and "IS" not in where:
+            assert where.startswith("(items.color, items.id) ")
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from services.product_cache import MemoryProductCacheBackend, ProductCacheBackend, ProductDetailCache
+
+
+def _cache(**kwargs):
+    return ProductDetailCache(MemoryProductCacheBackend(**kwargs))
+
+
+def test_put_and_get_many_count_hits():
+    async def scenario():
+        cache = _cache()
+        await cache.put({1: {"id": 1}, 2: {"id": 2}}, cache.generation)
+        found = await cache.get_many([1, 2, 3, 1])
+        return cache, found
+
+    cache, found = asyncio.run(scenario())
+    assert found == {1: {"id": 1}, 2: {"id": 2}}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_put_after_invalidation_is_dropped():
+    """Чтение из БД до записи, сохранение после инвалидации — в кеш не попадает"""
+    async def scenario():
+        cache = _cache()
+        generation = cache.generation
+        await cache.invalidate([1])
+        await cache.put({1: {"id": 1, "brand": "старый"}}, generation)
+        stale = await cache.get_many([1])
+        await cache.put({1: {"id": 1, "brand": "новый"}}, cache.generation)
+        fresh = await cache.get_many([1])
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale == {}
+    assert fresh == {1: {"id": 1, "brand": "новый"}}
+
+
+def test_invalidate_by_ids_and_everything():
+    async def scenario():
+        cache = _cache()
+        await cache.put({1: {"id": 1}, 2: {"id": 2}, 3: {"id": 3}}, cache.generation)
+        await cache.invalidate([2])
+        partial = await cache.get_many([1, 2, 3])
+        await cache.invalidate()
+        return cache, partial, await cache.get_many([1, 3])
+
+    cache, partial, cleared = asyncio.run(scenario())
+    assert sorted(partial) == [1, 3]
+    assert cleared == {}
+    assert cache.invalidations == 2
+    assert cache.generation == 2
+
+
+def test_memory_backend_evicts_least_recent():
+    async def scenario():
+        backend = MemoryProductCacheBackend(max_entries=2)
+        await backend.set_many({1: {}, 2: {}})
+        await backend.get_many([1])
+        await backend.set_many({3: {}})
+        return await backend.get_many([1, 2, 3])
+
+    assert sorted(asyncio.run(scenario())) == [1, 3]
+
+
+def test_memory_backend_expires_entries():
+    async def scenario():
+        backend = MemoryProductCacheBackend(ttl_seconds=-1)
+        await backend.set_many({1: {}})
+        return await backend.get_many([1]), backend.size()
+
+    assert asyncio.run(scenario()) == ({}, 0)
+
+
+def test_backend_must_implement_every_operation():
+    class PartialBackend(ProductCacheBackend):
+        async def get_many(self, ids):
+            return {}
+
+    with pytest.raises(TypeError):
+        PartialBackend()
@@ -0,0 +1,18 @@
+from models import Product
+from routes.api import SORTABLE_FIELDS
+
+
+def test_sortable_fields_have_keyset_index():
+    """Каждое поле сортировки покрыто индексом (поле, id), кроме самого id"""
+    indexed = {
+        index.columns.keys()[0]
+        for index in Product.__table__.indexes
+        if index.columns.keys()[1:] == ["id"]
+    }
+    for field in SORTABLE_FIELDS - {"id"}:
+        assert field in indexed, f"нет индекса ({field}, id)"
+
+
+def test_service_columns_are_not_sortable():
+    assert "change_seq" not in SORTABLE_FIELDS
+    assert not any(field.endswith("_id") for field in SORTABLE_FIELDS)
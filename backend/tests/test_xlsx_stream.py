@@ -0,0 +1,75 @@
+import asyncio
+from io import BytesIO
+
+from openpyxl import load_workbook
+
+from services.export_service import ExportService
+from utils.xlsx_stream import ChunkBuffer, XlsxStreamWriter
+
+HEADERS = ["ID", "Название", "Ширина", "В наличии"]
+ROWS = [
+    [1, "Очки <Ray-Ban> & Co", 50.5, True],
+    [2, "", 52, False],
+    [3, "управляющий\x01символ", float("nan"), True],
+    [4, "  пробелы  ", -0.25, False],
+]
+
+
+def _read(content):
+    workbook = load_workbook(BytesIO(content), read_only=True)
+    sheet = workbook.active
+    return sheet.title, [list(row) for row in sheet.iter_rows(values_only=True)]
+
+
+def test_writer_round_trip_through_openpyxl():
+    buffer = ChunkBuffer()
+    writer = XlsxStreamWriter(buffer, HEADERS, sheet_name='Данные "1"')
+    writer.write_row(ROWS[0])
+    writer.write_rows(ROWS[1:])
+    writer.close()
+
+    title, rows = _read(buffer.drain())
+    assert title == 'Данные "1"'
+    assert rows[0] == HEADERS
+    assert rows[1] == ROWS[0]
+    # NaN записывается пустой строкой, недопустимые в XML символы удаляются
+    assert rows[2] == ROWS[1]
+    assert rows[3] == [3, "управляющийсимвол", "", True]
+    assert rows[4] == ROWS[3]
+
+
+def test_header_row_is_bold():
+    buffer = ChunkBuffer()
+    writer = XlsxStreamWriter(buffer, HEADERS)
+    writer.close()
+    sheet = load_workbook(BytesIO(buffer.drain())).active
+    assert all(cell.font.b for cell in sheet[1])
+
+
+class RowsExportService(ExportService):
+    """Выгрузка с пачками колонок вместо серверного курсора — остальной путь stream_file как в проде"""
+
+    async def iter_columns(self, brands, fields):
+        for start in range(0, 20000, 1000):
+            ids = range(start, start + 1000)
+            yield {
+                "id": list(ids),
+                "brand": ["Ray-Ban"] * 1000,
+                "part_name": [f"товар {i}" for i in ids],
+                "width": [i / 10 for i in ids],
+            }
+
+
+def test_export_xlsx_yields_chunks_before_the_end():
+    columns = [{"field": "id"}, {"field": "part_name"}, {"field": "width"}, {"field": "category"}]
+
+    async def collect():
+        service = RowsExportService(chunk_size=4096)
+        return [chunk async for chunk in service.stream_file("xlsx", ["Ray-Ban"], columns)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 2
+    _, data = _read(b"".join(chunks))
+    assert data[0] == ["ID", "Название", "Ширина", "Категория"]
+    assert len(data) == 20001
+    assert data[-1] == [19999, "товар 19999", 1999.9, "category/Ray-Ban"]
@@ -0,0 +1,94 @@
+import csv
+import io
+from typing import Any, Dict, Iterable, List, Sequence, Union
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class CsvStreamWriter:
+    """Потоковая запись CSV (UTF-8, разделитель запятая) в файловый объект с бинарным write()"""
+
+    empty_value = ""
+
+    def __init__(self, fileobj, headers: List[str]):
+        self._fileobj = fileobj
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text)
+        self.write_rows([headers])
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        self._writer.writerows(rows)
+        self._fileobj.write(self._text.getvalue().encode("utf-8"))
+        self._text.seek(0)
+        self._text.truncate(0)
+
+    def write_row(self, values: Sequence[Any]) -> None:
+        self.write_rows([values])
+
+    def write_columns(self, columns: Sequence[Sequence[Any]]) -> None:
+        self.write_rows(zip(*columns))
+
+    def close(self) -> None:
+        pass
+
+
+class ParquetStreamWriter:
+    """
+    Потоковая запись Parquet: пачки колонок (массивы Arrow или списки значений)
+    копятся до row_group_size строк и записываются одной группой строк.
+    """
+
+    # NULL остается NULL — типизированные колонки не должны содержать пустых строк
+    empty_value = None
+
+    def __init__(self, fileobj, headers: List[str], arrow_types: List[pa.DataType], row_group_size: int = 50000):
+        self.schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type in zip(headers, arrow_types)])
+        self.row_group_size = row_group_size
+        self._sink = pa.PythonFile(fileobj, mode="w")
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression="snappy")
+        self._pending: List[pa.RecordBatch] = []
+        self._pending_rows = 0
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        self._writer.write_table(pa.Table.from_batches(self._pending, schema=self.schema))
+        self._pending = []
+        self._pending_rows = 0
+
+    def write_columns(self, columns: Sequence[Union[pa.Array, Sequence[Any]]]) -> None:
+        """Пачка колонок в порядке заголовков; готовые массивы Arrow не копируются"""
+        arrays = [
+            column if isinstance(column, pa.Array) else pa.array(column, type=field.type, from_pandas=False)
+            for column, field in zip(columns, self.schema)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush()
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        rows = list(rows)
+        if rows:
+            self.write_columns(list(zip(*rows)))
+
+    def write_row(self, values: Sequence[Any]) -> None:
+        self.write_rows([values])
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+        self._sink.close()
+
+
+def arrow_type_for(sql_type_name: str) -> pa.DataType:
+    """Тип Arrow для python_type колонки SQLAlchemy"""
+    mapping: Dict[str, pa.DataType] = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+    }
+    return mapping.get(sql_type_name, pa.string())
@@ -0,0 +1,109 @@
+import base64
+import json
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import tuple_
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import InstrumentedAttribute
+
+
+class InvalidCursorError(ValueError):
+    """Курсор не удалось разобрать или он не соответствует текущей сортировке"""
+    pass
+
+
+def encode_cursor(sort_field: str, sort_order: str, value: Any, last_id: int) -> str:
+    """Упаковывает позицию последней строки страницы в непрозрачный курсор"""
+    payload = {"f": sort_field, "o": sort_order, "v": value, "id": last_id}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_field: str, sort_order: str) -> Tuple[Any, int]:
+    """Распаковывает курсор и проверяет, что он выдан для той же сортировки"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value, last_id = payload["v"], int(payload["id"])
+        field, order = payload["f"], payload["o"]
+    except Exception:
+        raise InvalidCursorError("Некорректный курсор")
+
+    if field != sort_field or order != sort_order:
+        raise InvalidCursorError("Курсор выдан для другой сортировки")
+    return value, last_id
+
+
+def keyset_segments(
+    query: Select,
+    sort_column: InstrumentedAttribute,
+    id_column: InstrumentedAttribute,
+    sort_order: str,
+    value: Any,
+    last_id: int,
+) -> List[Select]:
+    """
+    Запросы строк "строго после (value, last_id)" — по одному на сегмент порядка;
+    вызывающий код выполняет их по очереди, пока не наберет страницу.
+    Порядок NULL как в PostgreSQL: NULLS LAST для ASC и NULLS FIRST для DESC.
+
+    Условие каждого сегмента — граница индекса (колонка, id), а не фильтр: для
+    непустых значений это сравнение строк (col, id) > (value, last_id), для NULL —
+    col IS NULL AND id > last_id. Ожидаемый план любой страницы, сколь угодно
+    глубокой: Index Scan [Backward] using ix_products_<поле>_id,
+    Index Cond: (ROW(<поле>, id) > ROW($1, $2)) — без Filter и без чтения
+    предыдущих страниц. Условие с OR по тем же колонкам PostgreSQL границей
+    индекса не считает и просматривает индекс с начала.
+    """
+    if sort_column is id_column:
+        if sort_order == "desc":
+            return [query.where(id_column < last_id)]
+        return [query.where(id_column > last_id)]
+
+    if sort_order == "desc":
+        if value is None:
+            # Хвост NULL (идет первым), затем все непустые значения
+            return [
+                query.where(sort_column.is_(None), id_column < last_id),
+                query.where(sort_column.isnot(None)),
+            ]
+        # Сравнение строк с NULL не выполняется — строки с NULL уже позади
+        return [query.where(tuple_(sort_column, id_column) < tuple_(value, last_id))]
+    if value is None:
+        return [query.where(sort_column.is_(None), id_column > last_id)]
+    # Остаток непустых значений, затем хвост NULL
+    return [
+        query.where(tuple_(sort_column, id_column) > tuple_(value, last_id)),
+        query.where(sort_column.is_(None)),
+    ]
+
+
+def keyset_order_by(
+    query: Select,
+    sort_column: InstrumentedAttribute,
+    id_column: InstrumentedAttribute,
+    sort_order: str,
+) -> Select:
+    """Сортировка по колонке с id в качестве tie-breaker (порядок совпадает с индексом)"""
+    if sort_column is id_column:
+        return query.order_by(id_column.desc() if sort_order == "desc" else id_column.asc())
+    if sort_order == "desc":
+        return query.order_by(sort_column.desc(), id_column.desc())
+    return query.order_by(sort_column.asc(), id_column.asc())
+
+
+def next_cursor_for(
+    rows: list,
+    has_more: bool,
+    sort_field: str,
+    sort_order: str,
+) -> Optional[str]:
+    """
+    Курсор следующей страницы или None, если страница последняя.
+    rows — строки вида (Product, sort_value) или строки Core-запроса
+    с колонками id и sort_value (проекция полей).
+    """
+    if not rows or not has_more:
+        return None
+    last = rows[-1]
+    last_id = last.id if "id" in last._fields else last[0].id
+    return encode_cursor(sort_field, sort_order, last.sort_value, last_id)
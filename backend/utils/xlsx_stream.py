@@ -0,0 +1,159 @@
+import math
+import re
+import zipfile
+from typing import Any, Iterable, List
+from xml.sax.saxutils import escape
+
+# Символы, недопустимые в XML 1.0 (openpyxl на них падает с IllegalCharacterError)
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Стиль 0 — обычный, стиль 1 — жирный (для строки заголовков, как у pandas.to_excel)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_FOOTER = '</sheetData></worksheet>'
+
+
+class ChunkBuffer:
+    """Неперематываемый приемник (ZipFile, Parquet): накапливает байты до очередной выдачи клиенту"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+        self.position = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self.size += len(data)
+            self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _cell_xml(value: Any, style: int = 0) -> str:
+    style_attr = f' s="{style}"' if style else ""
+    if isinstance(value, bool):
+        return f'<c t="b"{style_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, float) and not math.isfinite(value):
+        value = ""
+    elif isinstance(value, (int, float)):
+        return f'<c t="n"{style_attr}><v>{value!r}</v></c>'
+    text = _ILLEGAL_XML_CHARS.sub("", str(value))
+    return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _row_xml(values: Iterable[Any], style: int = 0) -> str:
+    return "<row>" + "".join(_cell_xml(v, style) for v in values) + "</row>"
+
+
+def _workbook_xml(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+class XlsxStreamWriter:
+    """
+    Синхронная потоковая запись XLSX в любой файловый объект (в т.ч. неперематываемый).
+    Строки сразу сериализуются в XML листа и сжимаются, в памяти не накапливаются.
+    """
+
+    empty_value = ""
+
+    def __init__(self, fileobj, headers: List[str], sheet_name: str = "Данные"):
+        self._archive = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED)
+        self._archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        self._archive.writestr("_rels/.rels", _ROOT_RELS)
+        self._archive.writestr("xl/workbook.xml", _workbook_xml(sheet_name))
+        self._archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        self._archive.writestr("xl/styles.xml", _STYLES)
+        self._sheet = self._archive.open("xl/worksheets/sheet1.xml", "w")
+        self._sheet.write((_SHEET_HEADER + _row_xml(headers, style=1)).encode("utf-8"))
+
+    def write_row(self, values: Iterable[Any]) -> None:
+        self._sheet.write(_row_xml(values).encode("utf-8"))
+
+    def write_rows(self, rows: Iterable[Iterable[Any]]) -> None:
+        self._sheet.write("".join(_row_xml(values) for values in rows).encode("utf-8"))
+
+    def write_columns(self, columns: Iterable[Iterable[Any]]) -> None:
+        self.write_rows(zip(*columns))
+
+    def close(self) -> None:
+        self._sheet.write(_SHEET_FOOTER.encode("utf-8"))
+        self._sheet.close()
+        self._archive.close()
@@ -124,15 +124,63 @@ export default {
     })
   },
 
-  confirmMapping(file, mapping) {
+  confirmMapping(file, mapping, uploadId = null) {
     const formData = new FormData()
-    formData.append('file', file)
-    formData.append('mapping_data', JSON.stringify({ mapping }))
+    // С upload_id сервер берет уже разобранную таблицу, файл повторно не отправляется
+    if (uploadId) {
+      formData.append('mapping_data', JSON.stringify({ mapping, upload_id: uploadId }))
+    } else {
+      formData.append('file', file)
+      formData.append('mapping_data', JSON.stringify({ mapping }))
+    }
+    // Сервер ставит импорт в очередь и сразу возвращает задачу (id, status, phase, ...)
     return api.post('/upload/confirm-mapping', formData, {
       headers: { 'Content-Type': 'multipart/form-data' }
     })
   },
 
+  // Состояние задачи импорта
+  getImportJob(jobId) {
+    return api.get(`/upload/import-jobs/${jobId}`)
+  },
+
+  // Прогресс задачи импорта через SSE: onState вызывается на каждое состояние,
+  // промис возвращает последнее. EventSource не передает заголовок Authorization,
+  // поэтому поток читается через fetch
+  async streamImportJob(jobId, onState) {
+    const token = localStorage.getItem('access_token')
+    const response = await fetch(`${API_BASE_URL}/upload/import-jobs/${jobId}/events`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {}
+    })
+    if (!response.ok || !response.body) {
+      throw new Error(`Не удалось получить прогресс импорта (HTTP ${response.status})`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let state = null
+    for (;;) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const events = buffer.split('\n\n')
+      buffer = events.pop()
+      for (const event of events) {
+        const data = event
+          .split('\n')
+          .filter(line => line.startsWith('data:'))
+          .map(line => line.slice(5).trim())
+          .join('\n')
+        if (data) {
+          state = JSON.parse(data)
+          onState(state)
+        }
+      }
+    }
+    return state
+  },
+
   // Экспорт данных
   exportProducts(exportData) {
     return api.post('/products/export', exportData, { responseType: 'blob' })